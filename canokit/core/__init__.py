@@ -27,6 +27,8 @@
 
 from enum import Enum, unique
 from typing import (
+    Any,
+    Callable,
     Type,
     List,
     Dict,
@@ -35,10 +37,15 @@ from typing import (
     Union,
     Optional,
     Hashable,
+    Iterator,
     NamedTuple,
 )
+from contextlib import contextmanager
 import re
 import abc
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 _VERSION_STRING_PATTERN = re.compile(r"[^\d]*(?P<major>\d+).(?P<minor>\d+).(?P<patch>\d+)\b")
@@ -159,6 +166,52 @@ class NotSupportedError(ValueError):
     """Attempting an action that is not supported on this YubiKey"""
 
 
+class CommandEvent(NamedTuple):
+    """Details about a single command sent to a YubiKey, as given to observers.
+
+    For smart cards, application is the AID of the selected application (or of the one
+    being selected, for SELECT) and ins the instruction. For OTP, application is
+    AID.OTP and ins the slot of the command.
+    """
+
+    application: Optional[bytes]
+    ins: int
+    sent: int  # Bytes of command data sent
+    received: int  # Bytes of response data received
+    segments: int  # Number of APDUs or feature reports exchanged
+    sw: Optional[int]  # Final status word, None for OTP
+    duration: float  # Wall time, in seconds
+    wait: Optional[float]  # Time spent waiting for touch, None if not measurable
+    error: Optional[Exception] = None
+
+
+CommandObserver = Callable[[CommandEvent], Any]
+
+_command_observers: List[CommandObserver] = []
+
+
+def add_command_observer(observer: CommandObserver) -> None:
+    """Register an observer to be called with a CommandEvent for every command.
+
+    The observer is called on the thread sending the command, after the response has
+    been received. Exceptions raised by observers are logged and ignored.
+    """
+    _command_observers.append(observer)
+
+
+def remove_command_observer(observer: CommandObserver) -> None:
+    """Unregister an observer previously added with add_command_observer."""
+    _command_observers.remove(observer)
+
+
+def _notify_command(observers: List[CommandObserver], event: CommandEvent) -> None:
+    for observer in observers + _command_observers:
+        try:
+            observer(event)
+        except Exception as e:
+            logger.error("Command observer failed", exc_info=e)
+
+
 def require_version(
     my_version: Version, min_version: Tuple[int, int, int], message=None
 ):
@@ -183,6 +236,9 @@ def bytes2int(data: bytes) -> int:
     return int.from_bytes(data, "big")
 
 
+_TlvData = Union[bytes, bytearray, memoryview]
+
+
 def _tlv_parse(data, offset=0):
     try:
         tag = data[offset]
@@ -214,6 +270,34 @@ def _tlv_parse(data, offset=0):
         raise ValueError("Invalid encoding of tag/length")
 
 
+def _tlv_iter(data, offset=0):
+    """Yields (tag, value_offset, length, end) for each TLV in data."""
+    total = len(data)
+    while offset < total:
+        tag, value_offset, ln, end = _tlv_parse(data, offset)
+        if end > total:
+            raise ValueError("Incorrect TLV length")
+        yield tag, value_offset, ln, end
+        offset = end
+
+
+def iter_tlv(data: _TlvData) -> Iterator[Tuple[int, memoryview]]:
+    """Iterate over a sequence of TLVs, yielding (tag, value) pairs.
+
+    Values are memoryviews into data, no copies are made while iterating.
+    """
+    view = memoryview(data)
+    for tag, offset, ln, _ in _tlv_iter(view):
+        yield tag, view[offset : offset + ln]
+
+
+def _encode_length(length):
+    if length < 0x80:
+        return bytes([length])
+    ln_bytes = int2bytes(length)
+    return bytes([0x80 | len(ln_bytes)]) + ln_bytes
+
+
 T_Tlv = TypeVar("T_Tlv", bound="Tlv")
 
 
@@ -239,13 +323,7 @@ class Tlv(bytes):
             buf = bytearray()
             buf.extend(int2bytes(tag))
             value = value or b""
-            length = len(value)
-            if length < 0x80:
-                buf.append(length)
-            else:
-                ln_bytes = int2bytes(length)
-                buf.append(0x80 | len(ln_bytes))
-                buf.extend(ln_bytes)
+            buf.extend(_encode_length(len(value)))
             buf.extend(value)
             data = bytes(buf)
         else:  # Binary TLV data
@@ -264,26 +342,100 @@ class Tlv(bytes):
     def __repr__(self):
         return f"Tlv(tag=0x{self.tag:02x}, value={self.value.hex()})"
 
+    @classmethod
+    def _from_parsed(cls: Type[T_Tlv], data, tag: int, offset: int, ln: int) -> T_Tlv:
+        # Construct without parsing the encoded data again
+        tlv = bytes.__new__(cls, data)
+        tlv._tag, tlv._value_offset, tlv._value_ln = tag, offset, ln
+        return tlv
+
     @classmethod
     def parse_from(cls: Type[T_Tlv], data: bytes) -> Tuple[T_Tlv, bytes]:
         tag, offs, ln, end = _tlv_parse(data)
         return cls(data[:end]), data[end:]
 
     @classmethod
-    def parse_list(cls: Type[T_Tlv], data: bytes) -> List[T_Tlv]:
+    def parse_list(cls: Type[T_Tlv], data: _TlvData) -> List[T_Tlv]:
+        view = memoryview(data)
         res = []
-        while data:
-            tlv, data = cls.parse_from(data)
-            res.append(tlv)
+        start = 0
+        for tag, offs, ln, end in _tlv_iter(view):
+            res.append(cls._from_parsed(view[start:end], tag, offs - start, ln))
+            start = end
         return res
 
     @classmethod
-    def parse_dict(cls: Type[T_Tlv], data: bytes) -> Dict[int, bytes]:
-        return dict((tlv.tag, tlv.value) for tlv in cls.parse_list(data))
+    def parse_dict(cls: Type[T_Tlv], data: _TlvData) -> Dict[int, bytes]:
+        return {tag: bytes(value) for tag, value in iter_tlv(data)}
 
     @classmethod
     def unpack(cls: Type[T_Tlv], tag: int, data: bytes) -> bytes:
-        tlv = cls(data)
-        if tlv.tag != tag:
-            raise ValueError(f"Wrong tag, got 0x{tlv.tag:02x} expected 0x{tag:02x}")
-        return tlv.value
+        view = memoryview(data)
+        tlv_tag, offs, ln, end = _tlv_parse(view)
+        if len(view) != end:
+            raise ValueError("Incorrect TLV length")
+        if tlv_tag != tag:
+            raise ValueError(f"Wrong tag, got 0x{tlv_tag:02x} expected 0x{tag:02x}")
+        return bytes(view[offs : offs + ln])
+
+
+class TlvWriter:
+    """Builds a sequence of TLVs in a single buffer.
+
+    Constructed TLVs are written in place, with their length filled in once the
+    contained TLVs have been written.
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._open: List[int] = []
+
+    def __len__(self):
+        return len(self._buf)
+
+    def add(self, tag: int, value: bytes = b"") -> "TlvWriter":
+        """Write a TLV with the given tag and value."""
+        self._buf += int2bytes(tag)
+        self._buf += _encode_length(len(value))
+        self._buf += value
+        return self
+
+    def add_header(self, tag: int, length: int) -> "TlvWriter":
+        """Write only the tag and length of a TLV, without a value."""
+        self._buf += int2bytes(tag)
+        self._buf += _encode_length(length)
+        return self
+
+    def add_raw(self, data: bytes) -> "TlvWriter":
+        """Write pre-encoded data as-is."""
+        self._buf += data
+        return self
+
+    def begin(self, tag: int) -> "TlvWriter":
+        """Start a constructed TLV. Must be followed by a matching end()."""
+        self._buf += int2bytes(tag)
+        self._open.append(len(self._buf))
+        self._buf.append(0)  # Length placeholder
+        return self
+
+    def end(self) -> "TlvWriter":
+        """Finish the most recently started constructed TLV."""
+        offset = self._open.pop()
+        length = len(self._buf) - offset - 1
+        if length < 0x80:
+            self._buf[offset] = length
+        else:
+            self._buf[offset : offset + 1] = _encode_length(length)
+        return self
+
+    @contextmanager
+    def constructed(self, tag: int) -> Iterator["TlvWriter"]:
+        """Context manager wrapping begin() and end()."""
+        self.begin(tag)
+        yield self
+        self.end()
+
+    def get_bytes(self) -> bytes:
+        if self._open:
+            raise ValueError("Unterminated constructed TLV")
+        return bytes(self._buf)
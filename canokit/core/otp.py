@@ -25,11 +25,22 @@
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
-from . import Connection, CommandError, TimeoutError, Version
-
-from time import sleep
+from . import (
+    Connection,
+    CommandError,
+    TimeoutError,
+    Version,
+    AID,
+    CommandEvent,
+    CommandObserver,
+    _command_observers,
+    _notify_command,
+)
+from .trace import trace
+
+from time import sleep, perf_counter
 from threading import Event
-from typing import Optional, Callable
+from typing import Dict, Iterator, List, Optional, Callable, Union
 import abc
 import struct
 import logging
@@ -50,17 +61,17 @@ class OtpConnection(Connection, metaclass=abc.ABCMeta):
         """Reads an 8 byte feature report"""
 
     @abc.abstractmethod
-    def send(self, data: bytes) -> None:
+    def send(self, data: Union[bytes, bytearray, memoryview]) -> None:
         """Writes an 8 byte feature report"""
 
 
 CRC_OK_RESIDUAL = 0xF0B8
 
 
-def calculate_crc(data: bytes) -> int:
+def calculate_crc(data: Union[bytes, bytearray, memoryview]) -> int:
     crc = 0xFFFF
-    for index in range(len(data)):
-        crc ^= data[index]
+    for byte in data:
+        crc ^= byte
         for i in range(8):
             j = crc & 1
             crc >>= 1
@@ -69,7 +80,7 @@ def calculate_crc(data: bytes) -> int:
     return crc & 0xFFFF
 
 
-def check_crc(data: bytes) -> bool:
+def check_crc(data: Union[bytes, bytearray, memoryview]) -> bool:
     return calculate_crc(data) == CRC_OK_RESIDUAL
 
 
@@ -106,19 +117,55 @@ CONFIG_STATUS_MASK = 0x1F
 STATUS_PROCESSING = 1
 STATUS_UPNEEDED = 2
 
+POLL_INTERVAL_MIN = 0.0005  # First poll interval, doubled for each poll
+POLL_INTERVAL_MAX = 0.02  # Longest poll interval while processing
+TOUCH_POLL_INTERVAL = 0.1  # Poll interval while waiting for touch
+READY_TIMEOUT = 1.0  # How long to wait for the YubiKey to accept a report
+
 
 def _should_send(packet, seq):
     """All-zero packets are skipped, except for the very first and last packets"""
     return seq in (0, 9) or any(packet)
 
 
-def _format_frame(slot, payload):
-    return payload + struct.pack("<BH", slot, calculate_crc(payload)) + b"\0\0\0"
+_FRAME_TRAILER = struct.Struct("<BH3x")  # Slot, CRC, padding
+
+
+def _format_frame(buf: bytearray, slot: int, data: bytes) -> None:
+    """Writes a frame for data sent to slot into buf, which must be FRAME_SIZE."""
+    length = len(data)
+    buf[:length] = data
+    buf[length:SLOT_DATA_SIZE] = bytes(SLOT_DATA_SIZE - length)
+    crc = calculate_crc(memoryview(buf)[:SLOT_DATA_SIZE])
+    _FRAME_TRAILER.pack_into(buf, SLOT_DATA_SIZE, slot, crc)
+
+
+def _poll_intervals(
+    expected: float = 0.0, maximum: float = POLL_INTERVAL_MAX
+) -> Iterator[float]:
+    """Intervals to poll at, backing off exponentially up to maximum.
+
+    If the expected processing time is known, most of it is waited out first.
+    """
+    if expected > POLL_INTERVAL_MIN:
+        yield min(expected * 0.9, maximum)
+    interval = POLL_INTERVAL_MIN
+    while True:
+        yield interval
+        interval = min(interval * 2, maximum)
 
 
 class OtpProtocol:
     def __init__(self, otp_connection: OtpConnection):
         self.connection = otp_connection
+        self._observers: List[CommandObserver] = []
+        self._segments = 0
+        self._wait = 0.0
+        # Observed processing time of the last command, per slot
+        self._processing_times: Dict[int, float] = {}
+        # Buffers reused for each command frame, and each report sent
+        self._frame = bytearray(FRAME_SIZE)
+        self._report = bytearray(FEATURE_RPT_SIZE)
         report = self._receive()
         self.version = Version.from_bytes(report[1:4])
         if self.version[0] == 3:  # NEO, may have cached pgmSeq in arbitrator
@@ -131,6 +178,13 @@ class OtpProtocol:
     def close(self) -> None:
         self.connection.close()
 
+    def add_observer(self, observer: CommandObserver) -> None:
+        """Register an observer to be called with a CommandEvent for each command."""
+        self._observers.append(observer)
+
+    def remove_observer(self, observer: CommandObserver) -> None:
+        self._observers.remove(observer)
+
     def send_and_receive(
         self,
         slot: int,
@@ -150,20 +204,59 @@ class OtpProtocol:
         @return response data (including CRC) in the case of data, or an updated status
             struct
         """
-        payload = (data or b"").ljust(SLOT_DATA_SIZE, b"\0")
-        if len(payload) > SLOT_DATA_SIZE:
+        data = data or b""
+        if len(data) > SLOT_DATA_SIZE:
             raise ValueError("Payload too large for HID frame")
         if not on_keepalive:
             on_keepalive = lambda x: None  # noqa
-        frame = _format_frame(slot, payload)
+        frame = self._frame
+        _format_frame(frame, slot, data)
 
-        logger.debug("SEND: %s", frame.hex())
-        response = self._read_frame(
-            self._send_frame(frame), event or Event(), on_keepalive
-        )
-        logger.debug("RECV: %s", response.hex())
+        self._segments, self._wait = 0, 0.0
+        try:
+            if not (self._observers or _command_observers):
+                response = self._read_frame(
+                    self._send_frame(frame), event or Event(), on_keepalive, slot
+                )
+            else:
+                response = self._observed_exchange(
+                    slot, len(data), frame, event or Event(), on_keepalive
+                )
+        except Exception:
+            trace.record_otp(frame, b"")
+            raise
+        trace.record_otp(frame, response)
         return response
 
+    def _observed_exchange(self, slot, sent, frame, event, on_keepalive):
+        start = perf_counter()
+        error: Optional[Exception] = None
+        received = 0
+        try:
+            response = self._read_frame(
+                self._send_frame(frame), event, on_keepalive, slot
+            )
+            received = len(response)
+            return response
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            _notify_command(
+                self._observers,
+                CommandEvent(
+                    AID.OTP,
+                    slot,
+                    sent,
+                    received,
+                    self._segments,
+                    None,
+                    perf_counter() - start,
+                    self._wait,
+                    error,
+                ),
+            )
+
     def _receive(self):
         report = self.connection.receive()
         if len(report) != FEATURE_RPT_SIZE:
@@ -182,42 +275,72 @@ class OtpProtocol:
         return self._receive()[1:-1]
 
     def _await_ready_to_write(self):
-        """Sleep for up to ~1s waiting for the WRITE flag to be unset"""
-        for _ in range(20):
+        """Poll for up to ~1s waiting for the WRITE flag to be unset"""
+        deadline = perf_counter() + READY_TIMEOUT
+        intervals = _poll_intervals()
+        while True:
             if (self._receive()[FEATURE_RPT_DATA_SIZE] & SLOT_WRITE_FLAG) == 0:
                 return
-            sleep(0.05)
+            remaining = deadline - perf_counter()
+            if remaining <= 0:
+                break
+            sleep(min(next(intervals), remaining))
         raise Exception("Timeout waiting for YubiKey to become ready to receive")
 
-    def _send_frame(self, buf):
-        """Sends a 70 byte frame"""
-        prog_seq = self._receive()[STATUS_OFFSET_PROG_SEQ]
-        seq = 0
-        while buf:
-            report, buf = buf[:FEATURE_RPT_DATA_SIZE], buf[FEATURE_RPT_DATA_SIZE:]
-            if _should_send(report, seq):
-                report += struct.pack(">B", 0x80 | seq)
-                self._await_ready_to_write()
+    def _send_frame(self, frame):
+        """Sends a 70 byte frame
+
+        Readiness is tracked from the last status report read. The status read first
+        is also used as the write-ready check for the first report sent. Sending a
+        report sets the WRITE flag, so the status is read again before each later
+        report, until the YubiKey has cleared it.
+        """
+        status = self._receive()
+        prog_seq = status[STATUS_OFFSET_PROG_SEQ]
+        ready = (status[FEATURE_RPT_DATA_SIZE] & SLOT_WRITE_FLAG) == 0
+        report = self._report
+        view = memoryview(frame)
+        for seq, offset in enumerate(range(0, FRAME_SIZE, FEATURE_RPT_DATA_SIZE)):
+            packet = view[offset : offset + FEATURE_RPT_DATA_SIZE]
+            if _should_send(packet, seq):
+                report[:FEATURE_RPT_DATA_SIZE] = packet
+                report[FEATURE_RPT_DATA_SIZE] = SLOT_WRITE_FLAG | seq
+                if not ready:
+                    self._await_ready_to_write()
                 self.connection.send(report)
-            seq += 1
+                ready = False  # WRITE is set until the report has been consumed
+                self._segments += 1
 
         return prog_seq
 
-    def _read_frame(self, prog_seq, event, on_keepalive):
-        """Reads one frame"""
+    def _read_frame(self, prog_seq, event, on_keepalive, slot=None):
+        """Reads one frame
+
+        While the YubiKey is busy it is polled at increasing intervals, starting from
+        the processing time observed for the last command to the same slot.
+        """
         response = b""
         seq = 0
         needs_touch = False
+        start: Optional[float] = perf_counter()
+        intervals = _poll_intervals(self._processing_times.get(slot, 0.0))
 
         try:
             while True:
                 report = self._receive()
                 status_byte = report[FEATURE_RPT_DATA_SIZE]
+                if start is not None and (
+                    status_byte & RESP_PENDING_FLAG or status_byte == 0
+                ):  # Done processing, remember how long it took
+                    if slot is not None and not needs_touch:
+                        self._processing_times[slot] = perf_counter() - start
+                    start = None
                 if (status_byte & RESP_PENDING_FLAG) != 0:  # Response packet
                     if seq == (status_byte & SEQUENCE_MASK):
                         # Correct sequence
                         response += report[:FEATURE_RPT_DATA_SIZE]
                         seq += 1
+                        self._segments += 1
                     elif 0 == (status_byte & SEQUENCE_MASK):
                         # Transmission complete
                         self._reset_state()
@@ -241,12 +364,14 @@ class OtpProtocol:
                     if (status_byte & RESP_TIMEOUT_WAIT_FLAG) != 0:
                         on_keepalive(STATUS_UPNEEDED)
                         needs_touch = True
-                        timeout = 0.1
+                        timeout = TOUCH_POLL_INTERVAL
                     else:
                         on_keepalive(STATUS_PROCESSING)
-                        timeout = 0.02
-                    sleep(timeout)
-                    if event.wait(timeout):
+                        timeout = next(intervals)
+                    waited = perf_counter()
+                    cancelled = event.wait(timeout)
+                    self._wait += perf_counter() - waited
+                    if cancelled:
                         self._reset_state()
                         raise TimeoutError("Command cancelled by Event")
         except KeyboardInterrupt:
@@ -25,15 +25,31 @@
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
-from . import Version, TRANSPORT, Connection, CommandError, ApplicationNotAvailableError
-from time import time
+from . import (
+    Version,
+    TRANSPORT,
+    Connection,
+    CommandError,
+    ApplicationNotAvailableError,
+    CommandEvent,
+    CommandObserver,
+    _command_observers,
+    _notify_command,
+)
+from time import time, perf_counter
 from enum import Enum, IntEnum, unique
-from typing import Tuple
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple, Optional
 import abc
 import struct
 
 
 class SmartCardConnection(Connection, metaclass=abc.ABCMeta):
+    # AID and response of the last SELECT, if no other command has been sent since
+    _selected: Optional[Tuple[bytes, bytes]] = None
+    # Largest APDU format supported, determined from the ATR on first use
+    _supported_apdu_format: Optional["ApduFormat"] = None
+
     @property
     @abc.abstractmethod
     def transport(self) -> TRANSPORT:
@@ -43,6 +59,49 @@ class SmartCardConnection(Connection, metaclass=abc.ABCMeta):
     def send_and_receive(self, apdu: bytes) -> Tuple[bytes, int]:
         """Sends a command APDU and returns the response"""
 
+    @property
+    def atr(self) -> Optional[bytes]:
+        """Get the ATR of the card, if available"""
+        return None
+
+    @property
+    def supported_apdu_format(self) -> "ApduFormat":
+        """Get the largest APDU format the card supports, as given by its ATR.
+
+        The result is determined once, and cached for the lifetime of the connection.
+        """
+        if self._supported_apdu_format is None:
+            atr = self.atr
+            if atr and _atr_supports_extended_apdu(atr):
+                self._supported_apdu_format = ApduFormat.EXTENDED
+            else:
+                self._supported_apdu_format = ApduFormat.SHORT
+        return self._supported_apdu_format
+
+    def reset_selection(self) -> None:
+        """Forget which application is currently selected.
+
+        This must be called after sending a command directly with send_and_receive,
+        if it might affect which application is selected.
+        """
+        self._selected = None
+
+    @contextmanager
+    def transaction(self, timeout: float = 10.0) -> Iterator[None]:
+        """Get exclusive access to the card for a sequence of commands.
+
+        No other application may communicate with the card until the block exits.
+        Transactions may be nested. Connections which aren't shared with other
+        applications have nothing to do, which is the default.
+
+        @param timeout  seconds to wait for other applications to release the card
+        """
+        yield
+
+
+class CardResetError(CommandError):
+    """The card was reset by another application, and any state on it was lost"""
+
 
 class ApduError(CommandError):
     """Thrown when an APDU response has the wrong SW code"""
@@ -94,6 +153,37 @@ SW1_HAS_MORE_DATA = 0x61
 SHORT_APDU_MAX_CHUNK = 0xFF
 
 
+def _atr_historical_bytes(atr):
+    k = atr[1] & 0x0F
+    y = atr[1] >> 4
+    offset = 2
+    while y:  # Skip over interface bytes
+        offset += bin(y).count("1")
+        y = atr[offset - 1] >> 4 if y & 0x8 else 0  # Next TDi, if present
+    return atr[offset : offset + k]
+
+
+def _atr_supports_extended_apdu(atr):
+    """Checks the card capabilities of the historical bytes for extended Lc/Le."""
+    try:
+        historical = _atr_historical_bytes(atr)
+        if historical[0] == 0x80:  # COMPACT-TLV objects follow
+            end = len(historical)
+        elif historical[0] == 0x00:  # COMPACT-TLV objects, 3 byte status indicator
+            end = len(historical) - 3
+        else:
+            return False
+        offset = 1
+        while offset < end:
+            tag, ln = historical[offset] >> 4, historical[offset] & 0x0F
+            if tag == 0x7 and ln >= 3:  # Card capabilities
+                return historical[offset + 3] & 0x40 != 0
+            offset += 1 + ln
+    except IndexError:
+        pass  # Malformed ATR
+    return False
+
+
 def _encode_short_apdu(cla, ins, p1, p2, data):
     return struct.pack(">BBBBB", cla, ins, p1, p2, len(data)) + data
 
@@ -108,23 +198,43 @@ class SmartCardProtocol:
         smartcard_connection: SmartCardConnection,
         ins_send_remaining: int = INS_SEND_REMAINING,
     ):
-        self.apdu_format = ApduFormat.SHORT
+        self.apdu_format = smartcard_connection.supported_apdu_format
         self.connection = smartcard_connection
         self._ins_send_remaining = ins_send_remaining
         self._touch_workaround = False
         self._last_long_resp = 0.0
+        self._observers: List[CommandObserver] = []
+        self._aid: Optional[bytes] = None
+        self._segments = 0
 
     def close(self) -> None:
         self.connection.close()
 
+    def add_observer(self, observer: CommandObserver) -> None:
+        """Register an observer to be called with a CommandEvent for each command."""
+        self._observers.append(observer)
+
+    def remove_observer(self, observer: CommandObserver) -> None:
+        self._observers.remove(observer)
+
     def enable_touch_workaround(self, version: Version) -> None:
         self._touch_workaround = self.connection.transport == TRANSPORT.USB and (
             (4, 2, 0) <= version <= (4, 2, 6)
         )
 
     def select(self, aid: bytes) -> bytes:
+        """Selects an application, returning the response to SELECT.
+
+        If the application is already selected, and no other command has been sent
+        over the connection since, the previous response is returned without
+        sending anything.
+        """
+        selected = self.connection._selected
+        if selected and selected[0] == aid:
+            self._aid = selected[0]
+            return selected[1]
         try:
-            return self.send_apdu(0, INS_SELECT, P1_SELECT, P2_SELECT, aid)
+            response = self.send_apdu(0, INS_SELECT, P1_SELECT, P2_SELECT, aid)
         except ApduError as e:
             if e.sw in (
                 SW.FILE_NOT_FOUND,
@@ -133,10 +243,62 @@ class SmartCardProtocol:
             ):
                 raise ApplicationNotAvailableError()
             raise
+        self._aid = bytes(aid)
+        self.connection._selected = (self._aid, response)
+        return response
 
     def send_apdu(
-        self, cla: int, ins: int, p1: int, p2: int, data: bytes = b""
+        self,
+        cla: int,
+        ins: int,
+        p1: int,
+        p2: int,
+        data: bytes = b"",
+        out: Optional[bytearray] = None,
     ) -> bytes:
+        """Sends an APDU, handling command chaining and chained responses.
+
+        The response data is accumulated in a single growable buffer. If out is
+        given the response is appended to it, and the same buffer is returned.
+        """
+        if not (self._observers or _command_observers):
+            return self._send_apdu(cla, ins, p1, p2, data, out)
+
+        start = perf_counter()
+        offset = len(out) if out is not None else 0
+        sw: Optional[int] = SW.OK
+        error: Optional[Exception] = None
+        received = 0
+        try:
+            response = self._send_apdu(cla, ins, p1, p2, data, out)
+            received = len(response) - offset
+            return response
+        except ApduError as e:
+            sw, error = e.sw, e
+            raise
+        except Exception as e:
+            sw, error = None, e
+            raise
+        finally:
+            _notify_command(
+                self._observers,
+                CommandEvent(
+                    bytes(data) if ins == INS_SELECT else self._aid,
+                    ins,
+                    len(data),
+                    received,
+                    self._segments,
+                    sw,
+                    perf_counter() - start,
+                    None,  # Touch is waited for by the card, within the response
+                    error,
+                ),
+            )
+
+    def _send_apdu(self, cla, ins, p1, p2, data, out):
+        # Any command may change the state reflected in the SELECT response
+        self.connection.reset_selection()
+
         if (
             self._touch_workaround
             and self._last_long_resp > 0
@@ -147,16 +309,21 @@ class SmartCardProtocol:
             )  # Dummy APDU, returns error
             self._last_long_resp = 0
 
+        self._segments = 1
         if self.apdu_format is ApduFormat.SHORT:
-            while len(data) > SHORT_APDU_MAX_CHUNK:
-                chunk, data = data[:SHORT_APDU_MAX_CHUNK], data[SHORT_APDU_MAX_CHUNK:]
+            view = memoryview(data)
+            offset, remaining = 0, len(view)
+            while remaining > SHORT_APDU_MAX_CHUNK:
+                end = offset + SHORT_APDU_MAX_CHUNK
                 response, sw = self.connection.send_and_receive(
-                    _encode_short_apdu(0x10 | cla, ins, p1, p2, chunk)
+                    _encode_short_apdu(0x10 | cla, ins, p1, p2, view[offset:end])
                 )
                 if sw != SW.OK:
                     raise ApduError(response, sw)
+                offset, remaining = end, remaining - SHORT_APDU_MAX_CHUNK
+                self._segments += 1
             response, sw = self.connection.send_and_receive(
-                _encode_short_apdu(cla, ins, p1, p2, data)
+                _encode_short_apdu(cla, ins, p1, p2, view[offset:])
             )
             get_data = _encode_short_apdu(0, self._ins_send_remaining, 0, 0, b"")
         elif self.apdu_format is ApduFormat.EXTENDED:
@@ -168,18 +335,21 @@ class SmartCardProtocol:
             raise TypeError("Invalid ApduFormat set")
 
         # Read chained response
-        buf = b""
+        buf = bytearray() if out is None else out
+        start = len(buf)
         while sw >> 8 == SW1_HAS_MORE_DATA:
             buf += response
             response, sw = self.connection.send_and_receive(get_data)
+            self._segments += 1
 
         if sw != SW.OK:
+            del buf[start:]
             raise ApduError(response, sw)
         buf += response
 
-        if self._touch_workaround and len(buf) > 54:
+        if self._touch_workaround and len(buf) - start > 54:
             self._last_long_resp = time()
         else:
             self._last_long_resp = 0
 
-        return buf
+        return buf if out is not None else bytes(buf)
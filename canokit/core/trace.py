@@ -0,0 +1,245 @@
+# Copyright (c) 2020 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""In-memory trace of the raw traffic exchanged with YubiKeys.
+
+Exchanges are stored as raw bytes in a fixed size ring buffer, and are only formatted
+when the trace is dumped. Command data which may contain PINs or keys, and responses
+which may contain secrets (such as OATH codes, HMAC responses, or PIN protected data),
+are redacted before they are stored.
+"""
+
+from itertools import count
+from time import monotonic
+from threading import Lock
+from typing import Hashable, List, NamedTuple, Optional, Set, TextIO, Union
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+TRACE_APDU = 1  # sent: command APDU, received: response data, sw: status word
+TRACE_OTP = 2  # sent: OTP frame, received: response data
+
+_KIND_NAMES = {TRACE_APDU: "APDU", TRACE_OTP: "OTP"}
+
+_Data = Union[bytes, bytearray, memoryview]
+
+# INS of commands whose data may contain PINs or keys (any application)
+REDACTED_INS = frozenset(
+    (
+        0x01,  # OATH PUT, OTP slot config
+        0x03,  # OATH SET CODE
+        0x1C,  # Management WRITE CONFIG (lock code)
+        0x20,  # VERIFY
+        0x24,  # CHANGE REFERENCE DATA
+        0xA3,  # OATH VALIDATE (response to a traced challenge)
+        0x2C,  # RESET RETRY COUNTER
+        0xDA,  # OpenPGP PUT DATA
+        0xDB,  # PUT DATA (key import, PIN protected data)
+        0xFE,  # PIV IMPORT KEY
+        0xFF,  # PIV SET MANAGEMENT KEY
+    )
+)
+
+# INS of commands whose response may contain secrets (any application)
+REDACTED_RESPONSE_INS = frozenset(
+    (
+        0x2A,  # OpenPGP PERFORM SECURITY OPERATION (decipher)
+        0x87,  # PIV GENERAL AUTHENTICATE (decipher, management key challenge)
+        0xA2,  # OATH CALCULATE
+        0xA3,  # OATH VALIDATE
+        0xA4,  # OATH CALCULATE ALL, unless it's a SELECT
+        0xA5,  # OATH SEND REMAINING
+    )
+)
+
+# OTP slot commands whose payload may contain keys or access codes
+REDACTED_OTP_COMMANDS = frozenset((0x01, 0x03, 0x04, 0x05, 0x11, 0x15))
+
+# OTP slot commands whose response is computed from a secret, sent over HID or CCID
+REDACTED_OTP_RESPONSES = frozenset((0x20, 0x28, 0x30, 0x38))
+
+_INS_OTP_CONFIG = 0x01
+_INS_SELECT = 0xA4
+_INS_GET_DATA = 0xCB
+_INS_SEND_REMAINING = 0xC0
+_P1_SELECT = 0x04
+_SW1_HAS_MORE_DATA = 0x61
+
+# PIV object holding PIN protected data, such as a stored management key
+_OBJECT_PIVMAN_PROTECTED_DATA = b"\x5c\x03\x5f\xc1\x09"
+
+_APDU_HEADER_SIZE = 4
+_OTP_PAYLOAD_SIZE = 64
+
+
+def _is_secret_response(apdu):
+    ins = apdu[1]
+    if ins in REDACTED_RESPONSE_INS:
+        return ins != _INS_SELECT or apdu[2] != _P1_SELECT
+    if ins == _INS_OTP_CONFIG:
+        return apdu[2] in REDACTED_OTP_RESPONSES
+    if ins == _INS_GET_DATA:
+        return _OBJECT_PIVMAN_PROTECTED_DATA in bytes(apdu[_APDU_HEADER_SIZE:])
+    return False
+
+
+class TraceEntry(NamedTuple):
+    """A single traced exchange, timestamped in seconds since the trace started."""
+
+    timestamp: float
+    kind: int
+    sent: bytes
+    received: bytes
+    sw: int
+    redacted: int  # Number of bytes of sent data that were withheld
+    redacted_received: int = 0  # Number of bytes of response data that were withheld
+
+    def format(self) -> str:
+        name = _KIND_NAMES.get(self.kind, str(self.kind))
+        if self.redacted:
+            sent = f"{self.sent.hex()} <{self.redacted} bytes redacted>"
+        else:
+            sent = self.sent.hex()
+        if self.redacted_received:
+            received = f"<{self.redacted_received} bytes redacted>"
+        else:
+            received = self.received.hex()
+        if self.kind == TRACE_APDU:
+            received = f"{received} SW={self.sw:04x}"
+        return (
+            f"{self.timestamp:12.6f} {name} SEND: {sent}\n"
+            f"{self.timestamp:12.6f} {name} RECV: {received}"
+        )
+
+
+class TraceBuffer:
+    """A fixed size ring buffer of the most recent exchanges.
+
+    Recording is thread safe, and only copies the exchanged data.
+    """
+
+    def __init__(self, size: int = 256):
+        self.size = size
+        self.enabled = True
+        self._start = monotonic()
+        self._entries: List[Optional[tuple]] = [None] * size
+        self._counter = count()
+        # Channels with the rest of a redacted response pending
+        self._redact_remaining: Set[Hashable] = set()
+        self._lock = Lock()
+
+    def record_apdu(
+        self, apdu: _Data, response: _Data, sw: int, channel: Hashable = None
+    ) -> None:
+        """Record a command APDU with its response.
+
+        The channel identifies the connection the APDU was sent over, so that the rest
+        of a chained response is redacted like its first part.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            redact_response = _is_secret_response(apdu) or (
+                apdu[1] == _INS_SEND_REMAINING and channel in self._redact_remaining
+            )
+            if redact_response and sw >> 8 == _SW1_HAS_MORE_DATA:
+                self._redact_remaining.add(channel)
+            else:
+                self._redact_remaining.discard(channel)
+        if len(apdu) > _APDU_HEADER_SIZE and apdu[1] in REDACTED_INS:
+            redacted = len(apdu) - _APDU_HEADER_SIZE
+            apdu = apdu[:_APDU_HEADER_SIZE]
+        else:
+            redacted = 0
+        if redact_response and response:
+            redacted_received, response = len(response), b""
+        else:
+            redacted_received = 0
+        self._store(
+            TRACE_APDU, bytes(apdu), bytes(response), sw, redacted, redacted_received
+        )
+
+    def record_otp(self, frame: _Data, response: _Data) -> None:
+        """Record an OTP frame (payload, slot, CRC) with its response."""
+        if not self.enabled:
+            return
+        command = frame[_OTP_PAYLOAD_SIZE]
+        if command in REDACTED_OTP_COMMANDS:
+            redacted = _OTP_PAYLOAD_SIZE
+            frame = frame[_OTP_PAYLOAD_SIZE:]
+        else:
+            redacted = 0
+        if command in REDACTED_OTP_RESPONSES and response:
+            redacted_received, response = len(response), b""
+        else:
+            redacted_received = 0
+        self._store(
+            TRACE_OTP, bytes(frame), bytes(response), 0, redacted, redacted_received
+        )
+
+    def _store(self, kind, sent, received, sw, redacted, redacted_received):
+        index = next(self._counter)
+        entry = (
+            index,
+            monotonic(),
+            kind,
+            sent,
+            received,
+            sw,
+            redacted,
+            redacted_received,
+        )
+        self._entries[index % self.size] = entry
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s", self._entry(entry).format())
+
+    def _entry(self, entry) -> TraceEntry:
+        _, timestamp, *rest = entry
+        return TraceEntry(timestamp - self._start, *rest)
+
+    def clear(self) -> None:
+        self._entries = [None] * self.size
+        self._counter = count()
+        with self._lock:
+            self._redact_remaining.clear()
+
+    def entries(self) -> List[TraceEntry]:
+        """Get the recorded exchanges, oldest first."""
+        entries = [e for e in self._entries if e is not None]
+        entries.sort(key=lambda e: e[0])
+        return [self._entry(e) for e in entries]
+
+    def dump(self, fd: TextIO) -> None:
+        """Write the recorded exchanges to a text file."""
+        for entry in self.entries():
+            fd.write(entry.format() + "\n")
+
+
+# The trace used by all connections
+trace = TraceBuffer()
@@ -231,7 +231,7 @@ class DeviceInfo:
     def parse(cls, encoded: bytes, default_version: Version) -> "DeviceInfo":
         if len(encoded) - 1 != encoded[0]:
             raise BadResponseError("Invalid length")
-        data = Tlv.parse_dict(encoded[1:])
+        data = Tlv.parse_dict(memoryview(encoded)[1:])
         locked = data.get(TAG_CONFIG_LOCK) == b"\1"
         serial = bytes2int(data.get(TAG_SERIAL, b"\0")) or None
         ff_value = bytes2int(data.get(TAG_FORM_FACTOR, b"\0"))
@@ -382,6 +382,7 @@ class _ManagementSmartCardBackend(_Backend):
         if self.version[0] == 3:
             # Workaround to "de-select" on NEO, otherwise it gets stuck.
             self.protocol.connection.send_and_receive(b"\xa4\x04\x00\x08")
+            self.protocol.connection.reset_selection()
             self.protocol.select(AID.OTP)
 
     def close(self):
@@ -4,6 +4,8 @@ from .core import (
     require_version,
     Version,
     Tlv,
+    TlvWriter,
+    iter_tlv,
     AID,
     BadResponseError,
 )
@@ -270,8 +272,10 @@ class OathSession:
         return self._challenge is not None
 
     def reset(self) -> None:
-        self.protocol.send_apdu(0, INS_RESET, 0xDE, 0xAD)
-        _, self._salt, self._challenge = _parse_select(self.protocol.select(AID.OATH))
+        with self.protocol.connection.transaction():
+            self.protocol.send_apdu(0, INS_RESET, 0xDE, 0xAD)
+            select = self.protocol.select(AID.OATH)
+        _, self._salt, self._challenge = _parse_select(select)
         self._has_key = False
         self._device_id = _get_device_id(self._salt)
 
@@ -317,18 +321,18 @@ class OathSession:
         cred_id = d.get_id()
         secret = _hmac_shorten_key(d.secret, d.hash_algorithm)
         secret = secret.ljust(HMAC_MINIMUM_KEY_SIZE, b"\0")
-        data = Tlv(TAG_NAME, cred_id) + Tlv(
-            TAG_KEY,
-            struct.pack("<BB", d.oath_type | d.hash_algorithm, d.digits) + secret,
-        )
+        writer = TlvWriter().add(TAG_NAME, cred_id)
+        writer.add_header(TAG_KEY, 2 + len(secret))
+        writer.add_raw(struct.pack("<BB", d.oath_type | d.hash_algorithm, d.digits))
+        writer.add_raw(secret)
 
         if touch_required:
-            data += struct.pack(b">BB", TAG_PROPERTY, PROP_REQUIRE_TOUCH)
+            writer.add_raw(struct.pack(b">BB", TAG_PROPERTY, PROP_REQUIRE_TOUCH))
 
         if d.counter > 0:
-            data += Tlv(TAG_IMF, struct.pack(">I", d.counter))
+            writer.add(TAG_IMF, struct.pack(">I", d.counter))
 
-        self.protocol.send_apdu(0, INS_PUT, 0, 0, data)
+        self.protocol.send_apdu(0, INS_PUT, 0, 0, writer.get_bytes())
         return Credential(
             self.device_id,
             cred_id,
@@ -352,10 +356,13 @@ class OathSession:
 
     def list_credentials(self) -> List[Credential]:
         creds = []
-        for tlv in Tlv.parse_list(self.protocol.send_apdu(0, INS_LIST, 0, 0)):
-            data = Tlv.unpack(TAG_NAME_LIST, tlv)
+        for tag, data in iter_tlv(self.protocol.send_apdu(0, INS_LIST, 0, 0)):
+            if tag != TAG_NAME_LIST:
+                raise ValueError(
+                    f"Wrong tag, got 0x{tag:02x} expected 0x{TAG_NAME_LIST:02x}"
+                )
             oath_type = OATH_TYPE(MASK_TYPE & data[0])
-            cred_id = data[1:]
+            cred_id = bytes(data[1:])
             issuer, name, period = _parse_cred_id(cred_id, oath_type)
             creds.append(
                 Credential(
@@ -387,31 +394,38 @@ class OathSession:
         challenge = _get_challenge(timestamp, DEFAULT_PERIOD)
 
         entries = {}
-        data = Tlv.parse_list(
-            self.protocol.send_apdu(
-                0, INS_CALCULATE_ALL, 0, 1, Tlv(TAG_CHALLENGE, challenge)
-            )
-        )
-        while data:
-            cred_id = Tlv.unpack(TAG_NAME, data.pop(0))
-            tlv = data.pop(0)
-            resp_tag = tlv.tag
-            oath_type = OATH_TYPE.HOTP if resp_tag == TAG_HOTP else OATH_TYPE.TOTP
-            touch = resp_tag == TAG_TOUCH
-            issuer, name, period = _parse_cred_id(cred_id, oath_type)
-
-            credential = Credential(
-                self.device_id, cred_id, issuer, name, oath_type, period, touch
+        with self.protocol.connection.transaction():
+            tlvs = iter_tlv(
+                self.protocol.send_apdu(
+                    0, INS_CALCULATE_ALL, 0, 1, Tlv(TAG_CHALLENGE, challenge)
+                )
             )
+            for name_tag, name_value in tlvs:
+                if name_tag != TAG_NAME:
+                    raise ValueError(
+                        f"Wrong tag, got 0x{name_tag:02x} expected 0x{TAG_NAME:02x}"
+                    )
+                try:
+                    resp_tag, value = next(tlvs)
+                except StopIteration:
+                    raise ValueError("Missing response for credential")
+                cred_id = bytes(name_value)
+                oath_type = OATH_TYPE.HOTP if resp_tag == TAG_HOTP else OATH_TYPE.TOTP
+                touch = resp_tag == TAG_TOUCH
+                issuer, name, period = _parse_cred_id(cred_id, oath_type)
+
+                credential = Credential(
+                    self.device_id, cred_id, issuer, name, oath_type, period, touch
+                )
 
-            code = None  # Will be None for HOTP and touch
-            if resp_tag == TAG_TRUNCATED:  # Only TOTP, no-touch here
-                if period == DEFAULT_PERIOD:
-                    code = _format_code(credential, timestamp, tlv.value)
-                else:
-                    # Non-standard period, recalculate
-                    code = self.calculate_code(credential, timestamp)
-            entries[credential] = code
+                code = None  # Will be None for HOTP and touch
+                if resp_tag == TAG_TRUNCATED:  # Only TOTP, no-touch here
+                    if period == DEFAULT_PERIOD:
+                        code = _format_code(credential, timestamp, value)
+                    else:
+                        # Non-standard period, recalculate
+                        code = self.calculate_code(credential, timestamp)
+                entries[credential] = code
 
         return entries
 
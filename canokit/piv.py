@@ -31,6 +31,7 @@ from .core import (
     bytes2int,
     Version,
     Tlv,
+    TlvWriter,
     AID,
     CommandError,
     NotSupportedError,
@@ -663,7 +664,10 @@ class PivSession:
             INS_PUT_DATA,
             0x3F,
             0xFF,
-            Tlv(TAG_OBJ_ID, int2bytes(object_id)) + Tlv(TAG_OBJ_DATA, data or b""),
+            TlvWriter()
+            .add(TAG_OBJ_ID, int2bytes(object_id))
+            .add(TAG_OBJ_DATA, data or b"")
+            .get_bytes(),
         )
 
     def get_certificate(self, slot: SLOT) -> x509.Certificate:
@@ -685,10 +689,13 @@ class PivSession:
 
     def put_certificate(self, slot: SLOT, certificate: x509.Certificate) -> None:
         cert_data = certificate.public_bytes(Encoding.DER)
-        data = (
-            Tlv(TAG_CERTIFICATE, cert_data) + Tlv(TAG_CERT_INFO, b"\0") + Tlv(TAG_LRC)
-        )
-        self.put_object(OBJECT_ID.from_slot(slot), data)
+        # Build the object data in place, rather than through put_object
+        writer = TlvWriter().add(TAG_OBJ_ID, int2bytes(OBJECT_ID.from_slot(slot)))
+        with writer.constructed(TAG_OBJ_DATA):
+            writer.add(TAG_CERTIFICATE, cert_data)
+            writer.add(TAG_CERT_INFO, b"\0")
+            writer.add(TAG_LRC)
+        self.protocol.send_apdu(0, INS_PUT_DATA, 0x3F, 0xFF, writer.get_bytes())
 
     def delete_certificate(self, slot: SLOT) -> None:
         self.put_object(OBJECT_ID.from_slot(slot))
@@ -707,26 +714,25 @@ class PivSession:
         check_key_support(self.version, key_type, pin_policy, touch_policy, False)
         ln = key_type.bit_len // 8
         numbers = private_key.private_numbers()
+        writer = TlvWriter()
         if key_type.algorithm == ALGORITHM.RSA:
             numbers = cast(rsa.RSAPrivateNumbers, numbers)
             if numbers.public_numbers.e != 65537:
                 raise NotSupportedError("RSA exponent must be 65537")
             ln //= 2
-            data = (
-                Tlv(0x01, int2bytes(numbers.p, ln))
-                + Tlv(0x02, int2bytes(numbers.q, ln))
-                + Tlv(0x03, int2bytes(numbers.dmp1, ln))
-                + Tlv(0x04, int2bytes(numbers.dmq1, ln))
-                + Tlv(0x05, int2bytes(numbers.iqmp, ln))
-            )
+            writer.add(0x01, int2bytes(numbers.p, ln))
+            writer.add(0x02, int2bytes(numbers.q, ln))
+            writer.add(0x03, int2bytes(numbers.dmp1, ln))
+            writer.add(0x04, int2bytes(numbers.dmq1, ln))
+            writer.add(0x05, int2bytes(numbers.iqmp, ln))
         else:
             numbers = cast(ec.EllipticCurvePrivateNumbers, numbers)
-            data = Tlv(0x06, int2bytes(numbers.private_value, ln))
+            writer.add(0x06, int2bytes(numbers.private_value, ln))
         if pin_policy:
-            data += Tlv(TAG_PIN_POLICY, int2bytes(pin_policy))
+            writer.add(TAG_PIN_POLICY, int2bytes(pin_policy))
         if touch_policy:
-            data += Tlv(TAG_TOUCH_POLICY, int2bytes(touch_policy))
-        self.protocol.send_apdu(0, INS_IMPORT_KEY, key_type, slot, data)
+            writer.add(TAG_TOUCH_POLICY, int2bytes(touch_policy))
+        self.protocol.send_apdu(0, INS_IMPORT_KEY, key_type, slot, writer.get_bytes())
         return key_type
 
     def generate_key(
@@ -777,22 +783,16 @@ class PivSession:
         )
 
     def _use_private_key(self, slot, key_type, message, exponentiation):
+        writer = TlvWriter()
+        with writer.constructed(TAG_DYN_AUTH):
+            writer.add(TAG_AUTH_RESPONSE)
+            writer.add(
+                TAG_AUTH_EXPONENTIATION if exponentiation else TAG_AUTH_CHALLENGE,
+                message,
+            )
         try:
             response = self.protocol.send_apdu(
-                0,
-                INS_AUTHENTICATE,
-                key_type,
-                slot,
-                Tlv(
-                    TAG_DYN_AUTH,
-                    Tlv(TAG_AUTH_RESPONSE)
-                    + Tlv(
-                        TAG_AUTH_EXPONENTIATION
-                        if exponentiation
-                        else TAG_AUTH_CHALLENGE,
-                        message,
-                    ),
-                ),
+                0, INS_AUTHENTICATE, key_type, slot, writer.get_bytes()
             )
             return Tlv.unpack(
                 TAG_AUTH_RESPONSE,
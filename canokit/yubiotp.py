@@ -49,7 +49,7 @@ import struct
 from hashlib import sha1
 from threading import Event
 from enum import unique, IntEnum, IntFlag
-from typing import TypeVar, Optional, Union, Callable
+from typing import TypeVar, Optional, Union, Callable, Iterable, Iterator
 
 
 T = TypeVar("T")
@@ -298,6 +298,13 @@ class CFGSTATE(IntFlag):
     LED_INV = 0x10  # LED behavior is inverted (EXTFLAG_LED_INV mirror)
 
 
+def _pad_hmac_challenge(challenge: bytes) -> bytes:
+    # Pad challenge with byte different from last
+    return challenge.ljust(
+        HMAC_CHALLENGE_SIZE, b"\1" if challenge.endswith(b"\0") else b"\0"
+    )
+
+
 def _shorten_hmac_key(key: bytes) -> bytes:
     if len(key) > SHA1_BLOCK_SIZE:
         key = sha1(key).digest()  # nosec
@@ -824,14 +831,37 @@ class YubiOtpSession:
     ) -> bytes:
         require_version(self.version, (2, 2, 0))
 
-        # Pad challenge with byte different from last
-        challenge = challenge.ljust(
-            HMAC_CHALLENGE_SIZE, b"\1" if challenge.endswith(b"\0") else b"\0"
-        )
         return self.backend.send_and_receive(
             SLOT.map(slot, CONFIG_SLOT.CHAL_HMAC_1, CONFIG_SLOT.CHAL_HMAC_2),
-            challenge,
+            _pad_hmac_challenge(challenge),
             HMAC_RESPONSE_SIZE,
             event,
             on_keepalive,
         )
+
+    def calculate_hmac_sha1_many(
+        self,
+        slot: SLOT,
+        challenges: Iterable[bytes],
+        event: Optional[Event] = None,
+        on_keepalive: Optional[Callable[[int], None]] = None,
+    ) -> Iterator[bytes]:
+        """Calculate HMAC-SHA1 responses for many challenges, using the same slot.
+
+        The challenges are read lazily, and each response is yielded as soon as it
+        has been received, so the challenges can be streamed from a file.
+        """
+        require_version(self.version, (2, 2, 0))
+        config_slot = SLOT.map(slot, CONFIG_SLOT.CHAL_HMAC_1, CONFIG_SLOT.CHAL_HMAC_2)
+
+        def calculate():
+            for challenge in challenges:
+                yield self.backend.send_and_receive(
+                    config_slot,
+                    _pad_hmac_challenge(challenge),
+                    HMAC_RESPONSE_SIZE,
+                    event,
+                    on_keepalive,
+                )
+
+        return calculate()
@@ -29,6 +29,7 @@ from canokit.core import ApplicationNotAvailableError
 from canokit.core.otp import OtpConnection
 from canokit.core.fido import FidoConnection
 from canokit.core.smartcard import SmartCardConnection
+from canokit.core.trace import trace
 from canokit.management import USB_INTERFACE
 
 import ckman.logging_setup
@@ -42,6 +43,8 @@ from ..device import (
     scan_devices,
     connect_to_device,
     ConnectionNotAvailableException,
+    DeviceMonitor,
+    reuse_listings,
 )
 from ..util import get_windows_version
 from ..diagnostics import get_diagnostics
@@ -55,6 +58,7 @@ from .fido import fido
 from .config import config
 from .aliases import apply_aliases
 from .apdu import apdu
+from functools import partial
 import click
 import ctypes
 import time
@@ -82,13 +86,16 @@ WIN_CTAP_RESTRICTED = (
 )
 
 
-def _scan_changes(state, attempts=10):
-    for _ in range(attempts):
-        time.sleep(0.25)
-        devices, new_state = scan_devices()
-        if new_state != state:
-            return devices, new_state
-    raise TimeoutError("Timed out waiting for state change")
+def _scan_changes(state, timeout=2.5):
+    deadline = time.monotonic() + timeout
+    with DeviceMonitor() as monitor:
+        while True:
+            devices, new_state = scan_devices()
+            if new_state != state:
+                return devices, new_state
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not monitor.wait(remaining):
+                raise TimeoutError("Timed out waiting for state change")
 
 
 def retrying_connect(serial, connections, attempts=10, state=None):
@@ -121,6 +128,11 @@ def print_diagnostics(ctx, param, value):
     ctx.exit()
 
 
+def _write_trace(trace_file):
+    with open(trace_file, "w") as fd:
+        trace.dump(fd)
+
+
 def _disabled_interface(connections, cmd_name):
     interfaces = [USB_INTERFACE_MAPPING[c] for c in connections]
     req = ", ".join((t.name or str(t) for t in interfaces))
@@ -228,6 +240,14 @@ def _run_cmd_for_single(ctx, cmd, connections, reader_name=None):
     help="Write logs to the given FILE instead of standard error; "
     "ignored unless --log-level is also set.",
 )
+@click.option(
+    "--trace-file",
+    default=None,
+    type=str,
+    metavar="FILE",
+    help="Write the traffic exchanged with the YubiKey to FILE when done, "
+    "with PINs, keys and secret responses redacted.",
+)
 @click.option(
     "--diagnose",
     is_flag=True,
@@ -252,7 +272,7 @@ def _run_cmd_for_single(ctx, cmd, connections, reader_name=None):
     help="Show --help, including hidden commands, and exit.",
 )
 @click.pass_context
-def cli(ctx, device, log_level, log_file, reader):
+def cli(ctx, device, log_level, log_file, trace_file, reader):
     """
     Configure your YubiKey via the command line.
 
@@ -267,10 +287,15 @@ def cli(ctx, device, log_level, log_file, reader):
       $ ckman --device 0123456 info
     """
     ctx.obj = YkmanContextObject()
+    # List each backend once for the whole command, unless devices change
+    ctx.with_resource(reuse_listings())
 
     if log_level:
         ckman.logging_setup.setup(log_level, log_file=log_file)
 
+    if trace_file:
+        ctx.call_on_close(partial(_write_trace, trace_file))
+
     if reader and device:
         ctx.fail("--reader and --device options can't be combined.")
 
@@ -348,9 +373,9 @@ def list_keys(ctx, serials, readers):
             )
         pids.add(dev.pid)
 
-    # Look for FIDO devices that we can't access
+    # Look for FIDO devices that we can't access, in the listings read above
     if not serials:
-        devs, _ = scan_devices()
+        devs, _ = scan_devices(reuse=True)
         for pid, count in devs.items():
             if pid not in pids:
                 for _ in range(count):
@@ -359,7 +384,7 @@ def list_keys(ctx, serials, readers):
                     click.echo(f"{name} [{mode}] <access denied>")
 
 
-COMMANDS = (list_keys, info, openpgp, oath, piv, fido, config, apdu)
+COMMANDS = (list_keys, info, otp, openpgp, oath, piv, fido, config, apdu)
 
 
 for cmd in COMMANDS:
@@ -151,6 +151,7 @@ def apdu(ctx, no_pretty, app, apdu, send_apdu):
             apdu = a2b_hex(apdu)
             click.echo("SEND: " + _hex(apdu))
             resp, sw = protocol.connection.send_and_receive(apdu)
+            protocol.connection.reset_selection()
             _print_response(resp, sw, no_pretty)
     else:  # Standard mode
         for apdu, check in apdus:
@@ -25,7 +25,7 @@
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
-from canokit.core import TRANSPORT
+from canokit.core import TRANSPORT, TimeoutError
 from canokit.management import (
     ManagementSession,
     DeviceConfig,
@@ -35,6 +35,7 @@ from canokit.management import (
     Mode,
 )
 from .. import YUBIKEY
+from ..device import wait_for_reappearance
 from .util import (
     click_postpone_execution,
     click_force_option,
@@ -47,17 +48,36 @@ import re
 import click
 import logging
 
-
 logger = logging.getLogger(__name__)
 
 
 CLEAR_LOCK_CODE = b"\0" * 16
 
+# How long --wait waits for the YubiKey to reconnect, in seconds
+WAIT_TIMEOUT = 30.0
+
 
 def prompt_lock_code():
     return click_prompt("Enter your lock code", hide_input=True)
 
 
+click_wait_option = click.option(
+    "-w",
+    "--wait",
+    is_flag=True,
+    help="Wait for the YubiKey to reconnect with the new configuration.",
+)
+
+
+def _wait_for_reconnect(ctx, interfaces):
+    click.echo("Waiting for the YubiKey to reconnect...", err=True)
+    try:
+        wait_for_reappearance(ctx.obj["info"].serial, WAIT_TIMEOUT, interfaces)
+    except TimeoutError:
+        cli_fail("Timed out waiting for the YubiKey to reconnect.")
+    click.echo("YubiKey reconnected.", err=True)
+
+
 @click.group()
 @click.pass_context
 @click_postpone_execution
@@ -223,6 +243,7 @@ def set_lock_code(ctx, lock_code, new_lock_code, clear, generate, force):
     help="Sets the timeout when waiting for touch"
     " for challenge-response in the OTP application.",
 )
+@click_wait_option
 def usb(
     ctx,
     enable,
@@ -235,6 +256,7 @@ def usb(
     chalresp_timeout,
     lock_code,
     force,
+    wait,
 ):
     """
     Enable or disable applications over USB.
@@ -347,6 +369,9 @@ def usb(
         logger.error("Failed to write config", exc_info=e)
         cli_fail("Failed to configure USB applications.")
 
+    if wait and reboot:
+        _wait_for_reconnect(ctx, USB_INTERFACE.for_capabilities(usb_enabled))
+
 
 @config.command()
 @click.pass_context
@@ -538,8 +563,9 @@ def _parse_mode_string(ctx, param, mode):
     help="Sets the timeout when waiting for touch for challenge response.",
 )
 @click_force_option
+@click_wait_option
 @click.pass_context
-def mode(ctx, mode, touch_eject, autoeject_timeout, chalresp_timeout, force):
+def mode(ctx, mode, touch_eject, autoeject_timeout, chalresp_timeout, force, wait):
     """
     Manage connection modes (USB Interfaces).
 
@@ -608,3 +634,7 @@ def mode(ctx, mode, touch_eject, autoeject_timeout, chalresp_timeout, force):
             "Failed to switch mode on the YubiKey. Make sure your "
             "YubiKey does not have an access code set."
         )
+        return
+
+    if wait:
+        _wait_for_reconnect(ctx, mode.interfaces)
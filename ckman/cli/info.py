@@ -34,7 +34,8 @@ from canokit.yubiotp import YubiOtpSession
 from canokit.oath import OathSession
 
 from .util import cli_fail
-from ..device import is_fips_version, get_name, connect_to_device
+from ..device import is_fips_version, get_name
+from ..scheduler import InterfaceScheduler
 from ..otp import is_in_fips_mode as otp_in_fips_mode
 from ..oath import is_in_fips_mode as oath_in_fips_mode
 from ..fido import is_in_fips_mode as ctap_in_fips_mode
@@ -103,28 +104,27 @@ def print_app_status_table(supported_apps, enabled_apps):
 
 
 def get_overall_fips_status(pid, info):
-    statuses = {}
-
     usb_enabled = info.config.enabled_capabilities[TRANSPORT.USB]
 
-    statuses["OTP"] = False
+    # Group the checks by interface, to switch between them as few times as possible
+    scheduler = InterfaceScheduler(info.serial)
+    checks = {}
     if usb_enabled & CAPABILITY.OTP:
-        with connect_to_device(info.serial, [OtpConnection])[0] as conn:
-            otp_app = YubiOtpSession(conn)
-            statuses["OTP"] = otp_in_fips_mode(otp_app)
-
-    statuses["OATH"] = False
+        checks["OTP"] = scheduler.add(
+            OtpConnection, lambda conn: otp_in_fips_mode(YubiOtpSession(conn))
+        )
     if usb_enabled & CAPABILITY.OATH:
-        with connect_to_device(info.serial, [SmartCardConnection])[0] as conn:
-            oath_app = OathSession(conn)
-            statuses["OATH"] = oath_in_fips_mode(oath_app)
-
-    statuses["FIDO U2F"] = False
+        checks["OATH"] = scheduler.add(
+            SmartCardConnection, lambda conn: oath_in_fips_mode(OathSession(conn))
+        )
     if usb_enabled & CAPABILITY.U2F:
-        with connect_to_device(info.serial, [FidoConnection])[0] as conn:
-            statuses["FIDO U2F"] = ctap_in_fips_mode(conn)
+        checks["FIDO U2F"] = scheduler.add(FidoConnection, ctap_in_fips_mode)
+    scheduler.run()
 
-    return statuses
+    return {
+        name: checks[name].result() if name in checks else False
+        for name in ("OTP", "OATH", "FIDO U2F")
+    }
 
 
 def _check_fips_status(pid, info):
@@ -57,6 +57,12 @@ from .util import (
 )
 from .. import __version__
 from ..device import is_fips_version
+from ..provisioning import (
+    RecordWriter,
+    UnrecordedCredentialError,
+    YubiOtpProvisioner,
+    serial_public_id as _serial_public_id,
+)
 from ..scancodes import encode, KEYBOARD_LAYOUT
 from ..otp import (
     PrepareUploadFailed,
@@ -69,14 +75,12 @@ from ..otp import (
     format_oath_code,
 )
 from threading import Event
-from time import time
+from time import time, perf_counter
 import logging
 import os
-import struct
 import click
 import webbrowser
 
-
 logger = logging.getLogger(__name__)
 
 
@@ -171,6 +175,10 @@ def otp(ctx, access_code):
     """
 
     ctx.obj["session"] = YubiOtpSession(ctx.obj["conn"])
+    ctx.obj["access_code"] = _read_access_code(ctx, access_code)
+
+
+def _read_access_code(ctx, access_code):
     if access_code is not None:
         if access_code == "-":
             access_code = click_prompt("Enter the access code", hide_input=True)
@@ -180,7 +188,7 @@ def otp(ctx, access_code):
         except Exception as e:
             ctx.fail("Failed to parse access code: " + str(e))
 
-    ctx.obj["access_code"] = access_code
+    return access_code
 
 
 @otp.command()
@@ -374,7 +382,7 @@ def yubiotp(
                 serial = session.get_serial()
             except CommandError:
                 cli_fail("Serial number not set, public ID must be provided")
-            public_id = modhex_encode(b"\xff\x00" + struct.pack(b">I", serial))
+            public_id = modhex_encode(_serial_public_id(serial))
             click.echo(f"Using YubiKey serial as public ID: {public_id}")
         elif force:
             ctx.fail(
@@ -452,6 +460,91 @@ def yubiotp(
         webbrowser.open_new_tab(upload_url)
 
 
+@otp.command("yubiotp-bulk")
+@click_slot_argument
+@click.option(
+    "-o",
+    "--output",
+    required=True,
+    metavar="FILE",
+    help="File to append the programmed credentials to, as CSV (serial, public ID, "
+    "private ID, key), or JSON Lines if it ends with .jsonl.",
+)
+@click.option(
+    "-w",
+    "--watch",
+    is_flag=True,
+    help="Keep programming YubiKeys as they are inserted, until interrupted.",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(1, 64),
+    default=8,
+    show_default=True,
+    help="Number of YubiKeys to program at the same time.",
+)
+@click.option(
+    "--no-enter",
+    is_flag=True,
+    help="Don't send an Enter keystroke after emitting the OTP.",
+)
+@click_force_option
+@click.pass_context
+def yubiotp_bulk(ctx, slot, output, watch, jobs, no_enter, force):
+    """
+    Program Yubico OTP credentials to many YubiKeys.
+
+    Programs every attached YubiKey, in parallel, with the serial number as public
+    ID and a random private ID and key. Each credential is appended to FILE once
+    programmed. A YubiKey failing to be programmed doesn't stop the others.
+    """
+    root_params = ctx.find_root().params
+    if root_params.get("device") or root_params.get("reader"):
+        ctx.fail("--device and --reader can't be used with this command.")
+    access_code = _read_access_code(ctx, ctx.parent.params.get("access_code"))
+
+    force or click.confirm(
+        f"Program a YubiOTP credential in slot {slot} of every YubiKey"
+        + (" inserted" if watch else "")
+        + "?",
+        abort=True,
+        err=True,
+    )
+
+    programmed, failed = [], []
+
+    def on_done(device, record, error):
+        if record:
+            programmed.append(record)
+            click.echo(f"Programmed YubiKey {record.serial}.")
+        elif isinstance(error, UnrecordedCredentialError):
+            failed.append(device)
+            click.echo(
+                f"WARNING: YubiKey {error.record.serial} was programmed, but its "
+                f"credential could not be written to {output}: {error.__cause__}",
+                err=True,
+            )
+        else:
+            failed.append(device)
+            click.echo(f"Failed to program YubiKey: {error}", err=True)
+
+    if watch:
+        click.echo("Insert YubiKeys to program, press Ctrl+C to stop...", err=True)
+    with RecordWriter(output) as writer:
+        provisioner = YubiOtpProvisioner(
+            slot, writer, access_code, not no_enter, jobs, on_done=on_done
+        )
+        try:
+            provisioner.run(None if watch else 0)
+        except KeyboardInterrupt:
+            click.echo(err=True)
+
+    click.echo(f"Programmed {len(programmed)} YubiKeys, {len(failed)} failed.")
+    if failed:
+        ctx.exit(1)
+
+
 @otp.command()
 @click_slot_argument
 @click.argument("password", required=False)
@@ -619,8 +712,16 @@ def chalresp(ctx, slot, key, totp, touch, force, generate):
     default="6",
     help="Number of digits in generated TOTP code (default: 6).",
 )
+@click.option(
+    "-b",
+    "--batch",
+    type=click.File("r"),
+    metavar="FILE",
+    help="Read challenges from FILE (use '-' for stdin), one per line, and output "
+    "one response per line.",
+)
 @click.pass_context
-def calculate(ctx, slot, challenge, totp, digits):
+def calculate(ctx, slot, challenge, totp, digits, batch):
     """
     Perform a challenge-response operation.
 
@@ -629,24 +730,29 @@ def calculate(ctx, slot, challenge, totp, digits):
     """
     session = ctx.obj["session"]
 
-    if not challenge and not totp:
+    if batch and challenge:
+        ctx.fail("CHALLENGE can't be used with --batch.")
+
+    if not challenge and not totp and not batch:
         challenge = click_prompt("Enter a challenge (hex)")
 
     # Check that slot is not empty
     if not session.get_config_state().is_configured(slot):
         cli_fail("Cannot perform challenge-response on an empty slot.")
 
-    if totp:  # Challenge omitted or timestamp
-        if challenge is None:
-            challenge = time_challenge(int(time()))
-        else:
+    def parse_challenge(value):
+        if totp:  # Timestamp
             try:
-                challenge = time_challenge(int(challenge))
+                return time_challenge(int(value))
             except Exception as e:
                 logger.error("Error", exc_info=e)
                 ctx.fail("Timestamp challenge for TOTP must be an integer.")
-    else:  # Challenge is hex
-        challenge = bytes.fromhex(challenge)
+        return bytes.fromhex(value)  # Challenge is hex
+
+    def format_response(response):
+        if totp:
+            return format_oath_code(response, int(digits))
+        return response.hex()
 
     try:
         event = Event()
@@ -656,17 +762,58 @@ def calculate(ctx, slot, challenge, totp, digits):
                 prompt_for_touch()
                 setattr(on_keepalive, "prompted", True)
 
-        response = session.calculate_hmac_sha1(slot, challenge, event, on_keepalive)
-        if totp:
-            value = format_oath_code(response, int(digits))
+        if batch:
+            _calculate_batch(
+                ctx,
+                session,
+                slot,
+                batch,
+                parse_challenge,
+                format_response,
+                event,
+                on_keepalive,
+            )
+            return
+
+        if totp and challenge is None:  # Challenge omitted
+            challenge = time_challenge(int(time()))
         else:
-            value = response.hex()
+            challenge = parse_challenge(challenge)
 
-        click.echo(value)
+        response = session.calculate_hmac_sha1(slot, challenge, event, on_keepalive)
+        click.echo(format_response(response))
     except CommandError as e:
         _failed_to_write_msg(ctx, e)
 
 
+def _calculate_batch(
+    ctx, session, slot, batch, parse_challenge, format_response, event, on_keepalive
+):
+    def read_challenges():
+        for number, line in enumerate(batch, 1):
+            line = line.strip()
+            if line:
+                try:
+                    yield parse_challenge(line)
+                except ValueError:
+                    ctx.fail(f"Invalid challenge on line {number}.")
+
+    count = 0
+    start = perf_counter()
+    for response in session.calculate_hmac_sha1_many(
+        slot, read_challenges(), event, on_keepalive
+    ):
+        click.echo(format_response(response))
+        count += 1
+    elapsed = perf_counter() - start
+    if count and elapsed > 0:
+        click.echo(
+            f"Calculated {count} responses in {elapsed:.2f}s "
+            f"({count / elapsed:.1f} per second).",
+            err=True,
+        )
+
+
 def parse_modhex_or_bcd(value):
     try:
         return True, modhex_decode(value)
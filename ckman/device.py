@@ -32,6 +32,7 @@ from canokit.core import (
     Connection,
     NotSupportedError,
     ApplicationNotAvailableError,
+    TimeoutError,
 )
 from canokit.core.otp import OtpConnection, CommandRejectedError
 from canokit.core.fido import FidoConnection
@@ -50,17 +51,36 @@ from canokit.management import (
 )
 from canokit.yubiotp import YubiOtpSession
 from .base import PID, YUBIKEY, YkmanDevice
+from .settings import AppData
+from .planner import planner
 from .hid import (
     list_otp_devices as _list_otp_devices,
     list_ctap_devices as _list_ctap_devices,
+    open_hid_monitor,
 )
-from .pcsc import list_devices as _list_ccid_devices
+from .pcsc import list_devices as _list_ccid_devices, ScardMonitor
 from smartcard.pcsc.PCSCExceptions import EstablishContextException
 from smartcard.Exceptions import NoCardException
 
-from time import sleep
-from collections import Counter
-from typing import Dict, Mapping, List, Tuple, Optional, Iterable, Type
+from time import sleep, monotonic, perf_counter
+from threading import Event, Lock, Thread
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import (
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    Mapping,
+    List,
+    NamedTuple,
+    Set,
+    Tuple,
+    Optional,
+    Iterable,
+    Type,
+    cast,
+)
 import sys
 import ctypes
 import logging
@@ -68,6 +88,18 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+# Name of the AppData file remembering which device each serial was last found on
+DEVICE_INDEX = "devices"
+
+# Name of the AppData file caching the applications found on devices without a
+# usable Management application
+PROBE_CACHE = "capabilities"
+
+# Serializes the read-modify-write of the AppData files above, as devices are read
+# from several threads
+_app_data_lock = Lock()
+
+
 class ConnectionNotAvailableException(ValueError):
     def __init__(self, connection_types):
         super().__init__(
@@ -119,24 +151,86 @@ def is_fips_version(version: Version) -> bool:
 
 BASE_NEO_APPS = CAPABILITY.OTP | CAPABILITY.OATH | CAPABILITY.PIV | CAPABILITY.OPENPGP
 
-CONNECTION_LIST_MAPPING = {
-    SmartCardConnection: list_ccid_devices,
-    OtpConnection: list_otp_devices,
-    FidoConnection: list_ctap_devices,
-}
+# FidoConnection is only a virtual subclass of Connection
+CONNECTION_LIST_MAPPING = cast(
+    Dict[Type[Connection], Callable[[], List[YkmanDevice]]],
+    {
+        SmartCardConnection: list_ccid_devices,
+        OtpConnection: list_otp_devices,
+        FidoConnection: list_ctap_devices,
+    },
+)
+
+
+# Device listings reused within reuse_listings, so that a single command doesn't
+# enumerate the same backend more than once
+_listings: Dict[Type[Connection], List[YkmanDevice]] = {}
+_listings_depth = 0
+_listings_lock = Lock()
+
 
+@contextmanager
+def reuse_listings() -> Iterator[None]:
+    """Reuse device listings until the block exits.
 
-def scan_devices() -> Tuple[Mapping[PID, int], int]:
+    Within the block, list_all_devices, connect_to_device and scan_devices (if asked
+    to) list each connection type at most once. Listings are dropped when a
+    DeviceMonitor reports a possible change, or by calling invalidate_listings.
+    Outside of the block, devices are always listed again.
+    """
+    global _listings_depth
+    with _listings_lock:
+        _listings_depth += 1
+    try:
+        yield
+    finally:
+        with _listings_lock:
+            _listings_depth -= 1
+            if not _listings_depth:
+                _listings.clear()
+
+
+def invalidate_listings() -> None:
+    """Drop the device listings kept by reuse_listings."""
+    with _listings_lock:
+        _listings.clear()
+
+
+def _list_devices(
+    connection_type: Type[Connection], reuse: bool = True
+) -> List[YkmanDevice]:
+    """Lists devices of a connection type.
+
+    Within reuse_listings, a previous listing is returned if reuse is True. Pass False
+    to force a new listing, when looking for changes.
+    """
+    if reuse:
+        with _listings_lock:
+            cached = _listings.get(connection_type)
+        if cached is not None:
+            return list(cached)
+    devs = list(CONNECTION_LIST_MAPPING[connection_type]())
+    with _listings_lock:
+        if _listings_depth:
+            _listings[connection_type] = devs
+    return list(devs)
+
+
+def scan_devices(reuse: bool = False) -> Tuple[Mapping[PID, int], int]:
     """Scan USB for attached YubiKeys, without opening any connections.
 
     Returns a dict mapping PID to device count, and a state object which can be used to
     detect changes in attached devices.
+
+    :param reuse: Reuse device listings, within reuse_listings. By default the devices
+        are listed again, and the listings are then reused by list_all_devices and
+        connect_to_device.
     """
     fingerprints = set()
     merged: Dict[PID, int] = {}
-    for list_devs in CONNECTION_LIST_MAPPING.values():
+    for connection_type in CONNECTION_LIST_MAPPING:
         try:
-            devs = list_devs()
+            devs = _list_devices(connection_type, reuse)
         except Exception as e:
             logger.error("Unable to list devices for connection", exc_info=e)
             devs = []
@@ -157,53 +251,457 @@ def scan_devices() -> Tuple[Mapping[PID, int], int]:
     return merged, hash(tuple(fingerprints))
 
 
-def list_all_devices() -> List[Tuple[YkmanDevice, DeviceInfo]]:
+class DeviceMonitor:
+    """Waits for YubiKeys to be attached or removed, or cards to be inserted.
+
+    PC/SC reader and card notifications are used, and inotify for HID devices on
+    Linux. Where these aren't available, wait returns every poll_interval instead.
+    """
+
+    def __init__(self, poll_interval: float = 0.25):
+        self.poll_interval = poll_interval
+        self._changed = Event()
+        self._stop = Event()
+        self._sources = []
+        self._threads: List[Thread] = []
+        for open_source in (ScardMonitor, open_hid_monitor):
+            try:
+                source = open_source()
+            except Exception as e:
+                logger.debug("Unable to monitor devices, will poll", exc_info=e)
+                source = None
+            if source is not None:
+                self._sources.append(source)
+            self._start(source)
+
+    def _start(self, source) -> None:
+        thread = Thread(target=self._run, args=(source,), daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _run(self, source) -> None:
+        try:
+            while source is not None and not self._stop.is_set():
+                if source.wait(1.0):
+                    self._changed.set()
+        except Exception as e:
+            logger.debug("Device monitor failed, will poll", exc_info=e)
+        while not self._stop.wait(self.poll_interval):
+            self._changed.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait for a possible change, returning False if timeout passed without one.
+
+        Devices should be listed again after this returns, to find out what changed.
+        """
+        changed = self._changed.wait(timeout)
+        self._changed.clear()
+        if changed:
+            invalidate_listings()
+        return changed
+
+    def close(self) -> None:
+        self._stop.set()
+        for source in self._sources:
+            source.cancel()
+        for thread in self._threads:
+            thread.join(2.0)
+        if any(thread.is_alive() for thread in self._threads):
+            logger.warning("Device monitor didn't stop, leaving it open")
+            return
+        for source in self._sources:
+            source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        self.close()
+
+
+class DeviceEvent(NamedTuple):
+    """A YubiKey interface being attached (or detached, if attached is False)."""
+
+    attached: bool
+    connection_type: Type[Connection]
+    device: YkmanDevice
+
+
+def _list_by_fingerprint(connection_type) -> Dict[Hashable, YkmanDevice]:
+    return {d.fingerprint: d for d in _list_devices(connection_type, False)}
+
+
+def watch(
+    timeout: Optional[float] = None,
+    connection_types: Iterable[Type[Connection]] = CONNECTION_LIST_MAPPING.keys(),
+) -> Iterator[DeviceEvent]:
+    """Yields a DeviceEvent each time a YubiKey interface is attached or detached.
+
+    Interfaces which are already attached are reported first. Devices are not opened,
+    and are identified by their fingerprints.
+
+    :param timeout: Stop after this many seconds, if given.
+    :param connection_types: Filter connection types.
+    """
+    deadline = None if timeout is None else monotonic() + timeout
+    attached: Dict[Type[Connection], Dict[Hashable, YkmanDevice]] = {
+        t: {} for t in connection_types
+    }
+    with DeviceMonitor() as monitor:
+        while True:
+            for connection_type, known in attached.items():
+                try:
+                    devs = _list_by_fingerprint(connection_type)
+                except Exception as e:
+                    logger.debug(f"Unable to list {connection_type}", exc_info=e)
+                    continue
+                for fingerprint in list(known):
+                    if fingerprint not in devs:
+                        yield DeviceEvent(
+                            False, connection_type, known.pop(fingerprint)
+                        )
+                for fingerprint, dev in devs.items():
+                    if fingerprint not in known:
+                        known[fingerprint] = dev
+                        yield DeviceEvent(True, connection_type, dev)
+
+            remaining = None if deadline is None else deadline - monotonic()
+            if remaining is not None and remaining <= 0:
+                return
+            if not monitor.wait(remaining):
+                return
+
+
+def _timed_read_info(
+    dev: YkmanDevice, connection_type: Type[Connection], conn: Connection
+) -> DeviceInfo:
+    # Reads device info, recording how long it took for the interface planner
+    start = perf_counter()
+    try:
+        info = read_info(dev.pid, conn)
+    except Exception:
+        planner.record(dev.pid, None, connection_type, perf_counter() - start, True)
+        raise
+    planner.record(dev.pid, info.version, connection_type, perf_counter() - start)
+    return info
+
+
+def _read_device_info(dev: YkmanDevice, connection_type) -> DeviceInfo:
+    with dev.open_connection(connection_type) as conn:
+        return _timed_read_info(dev, connection_type, conn)
+
+
+def _read_all_device_info(
+    devs: List[YkmanDevice], connection_type, max_workers: int, timeout: float
+) -> List[Tuple[Optional[DeviceInfo], Optional[Exception]]]:
+    """Reads device info from each device concurrently, giving (info, error) pairs.
+
+    Devices are read by at most max_workers daemon threads. A device not done within
+    timeout seconds of being started is given up on, and a new thread replaces the
+    one stuck with it. The stuck thread is abandoned rather than joined, as there is no
+    way to interrupt it. It exits without reading other devices if the device
+    eventually responds, and otherwise doesn't keep the process from exiting.
+    """
+    results: List[Tuple[Optional[DeviceInfo], Optional[Exception]]] = [
+        (None, None)
+    ] * len(devs)
+    started: List[Optional[float]] = [None] * len(devs)
+    done = [Event() for _ in devs]
+    abandoned = [False] * len(devs)
+    queue = deque(range(len(devs)))
+    lock = Lock()
+
+    def worker():
+        with lock:
+            if not queue:
+                return
+            i = queue.popleft()
+        while True:
+            started[i] = monotonic()
+            try:
+                results[i] = (_read_device_info(devs[i], connection_type), None)
+            except Exception as e:
+                results[i] = (None, e)
+            with lock:
+                done[i].set()
+                # A replacement was started, so this thread must not continue
+                if abandoned[i] or not queue:
+                    return
+                i = queue.popleft()
+
+    def start_worker():
+        Thread(target=worker, name="read_device_info", daemon=True).start()
+
+    for _ in range(min(max_workers, len(devs))):
+        start_worker()
+
+    collected = []
+    for i in range(len(devs)):
+        while not done[i].wait(0.05):
+            start = started[i]
+            if start is not None and monotonic() - start > timeout:
+                break
+        with lock:
+            abandoned[i] = not done[i].is_set()
+        if not abandoned[i]:
+            collected.append(results[i])
+        else:
+            collected.append((None, TimeoutError(f"No response in {timeout} s")))
+            logger.debug(f"Abandoning thread reading {devs[i]}")
+            start_worker()  # Replace the thread stuck on this device
+    return collected
+
+
+def list_all_devices(
+    max_workers: int = 8, timeout: float = 10.0
+) -> List[Tuple[YkmanDevice, DeviceInfo]]:
     """Connects to all attached YubiKeys and reads device info from them.
 
+    Devices of each connection type are read concurrently, by up to max_workers
+    threads. A device which doesn't respond within timeout seconds is skipped.
+
+    Connection types are tried in order, and devices with a PID which was read over
+    one connection type, successfully or not, are skipped for later connection types.
+
+    Each YubiKey is returned once, with the device it was first read from. The other
+    interfaces of the same YubiKey are not merged into its record.
+
     Returns a list of (device, info) tuples for each connected device.
     """
-    handled_pids = set()
-    pids: Dict[PID, bool] = {}
+    handled_pids: Set[Optional[PID]] = set()
     devices = []
+    found: List[Tuple[Type[Connection], YkmanDevice, DeviceInfo]] = []
 
-    for connection_type, list_devs in CONNECTION_LIST_MAPPING.items():
+    for connection_type in CONNECTION_LIST_MAPPING:
         try:
-            devs = list_devs()
+            devs = _list_devices(connection_type)
         except Exception as e:
             logger.error("Unable to list devices for connection", exc_info=e)
             devs = []
 
-        for dev in devs:
-            if dev.pid not in handled_pids and pids.get(dev.pid, True):
-                try:
-                    with dev.open_connection(connection_type) as conn:
-                        info = read_info(dev.pid, conn)
-                    pids[dev.pid] = True
-                    devices.append((dev, info))
-                except Exception as e:
-                    pids[dev.pid] = False
-                    logger.error("Failed opening device", exc_info=e)
-        handled_pids.update({pid for pid, handled in pids.items() if handled})
+        devs = [dev for dev in devs if dev.pid not in handled_pids]
+        results = _read_all_device_info(devs, connection_type, max_workers, timeout)
+        for dev, (info, error) in zip(devs, results):
+            if info is None:
+                logger.error("Failed opening device", exc_info=error)
+                continue
+            devices.append((dev, info))
+            found.append((connection_type, dev, info))
+        handled_pids.update({dev.pid for dev in devs})
 
+    _update_device_index(found)
+    planner.save()
     return devices
 
 
+def _load_device_index() -> AppData:
+    return AppData(DEVICE_INDEX)
+
+
+def _update_device_index(
+    found: Iterable[Tuple[Type[Connection], YkmanDevice, DeviceInfo]],
+) -> None:
+    """Remember which device each serial was found on, for connect_to_device."""
+    try:
+        with _app_data_lock:
+            index = _load_device_index()
+            serials = index.setdefault("serials", {})
+            changed = False
+            for connection_type, dev, info in found:
+                if info.serial is None:
+                    continue
+                entry = {
+                    "fingerprint": str(dev.fingerprint),
+                    "pid": dev.pid,
+                    "version": list(info.version),
+                }
+                entries = serials.setdefault(str(info.serial), {})
+                if entries.get(connection_type.__name__) != entry:
+                    entries[connection_type.__name__] = entry
+                    changed = True
+            if changed:
+                index.write()
+    except Exception as e:
+        logger.debug("Unable to update device index", exc_info=e)
+
+
+def _connect_indexed(
+    serial: int, connection_types: Iterable[Type[Connection]]
+) -> Optional[Tuple[Connection, YkmanDevice, DeviceInfo]]:
+    """Connect to the device the serial was last found on, if it's still there."""
+    try:
+        with _app_data_lock:
+            index = _load_device_index()
+        entries = index.get("serials", {}).get(str(serial), {})
+    except Exception as e:
+        logger.debug("Unable to read device index", exc_info=e)
+        return None
+
+    for connection_type in connection_types:
+        entry = entries.get(connection_type.__name__)
+        if not entry:
+            continue
+        try:
+            devs = _list_devices(connection_type)
+            dev = next(
+                d
+                for d in devs
+                if str(d.fingerprint) == entry["fingerprint"] and d.pid == entry["pid"]
+            )
+        except Exception as e:
+            logger.debug("Indexed device not found", exc_info=e)
+            continue
+        try:
+            conn = dev.open_connection(connection_type)
+        except Exception as e:
+            logger.debug("Unable to connect to indexed device", exc_info=e)
+            continue
+        try:
+            info = _timed_read_info(dev, connection_type, conn)
+            if info.serial == serial:
+                return conn, dev, info
+        except Exception as e:
+            logger.debug("Unable to read info from indexed device", exc_info=e)
+        conn.close()
+    return None
+
+
 def connect_to_device(
     serial: Optional[int] = None,
     connection_types: Iterable[Type[Connection]] = CONNECTION_LIST_MAPPING.keys(),
 ) -> Tuple[Connection, YkmanDevice, DeviceInfo]:
     """Looks for a YubiKey to connect to.
 
+    When looking for a serial, the device where that serial was last seen is tried
+    first, before connecting to each device in turn. Connection types are tried in
+    the order the interface planner expects to be fastest, for the attached devices.
+
     :param serial: Used to filter devices by serial number, if present.
     :param connection_types: Filter connection types.
     :return: An open connection to the device, the device reference, and the device
         information read from the device.
     """
+    found: List[Tuple[Type[Connection], YkmanDevice, DeviceInfo]] = []
+    # The devices listed to order the connection types are the ones connected to
+    with reuse_listings():
+        connection_types = planner.order(
+            connection_types, _attached_pids(connection_types)
+        )
+        try:
+            if serial:
+                indexed = _connect_indexed(serial, connection_types)
+                if indexed:
+                    return indexed
+            return _scan_connect(serial, connection_types, found)
+        finally:
+            _update_device_index(found)
+            planner.save()
+
+
+def _attached_pids(
+    connection_types: Iterable[Type[Connection]],
+) -> Set[Optional[PID]]:
+    pids: Set[Optional[PID]] = set()
+    for connection_type in connection_types:
+        try:
+            pids.update(d.pid for d in _list_devices(connection_type))
+        except Exception as e:
+            logger.debug(f"Unable to list {connection_type}", exc_info=e)
+    return pids
+
+
+def wait_for_reappearance(
+    serial: Optional[int],
+    timeout: float = 10.0,
+    interfaces: Optional[USB_INTERFACE] = None,
+    connection_types: Iterable[Type[Connection]] = CONNECTION_LIST_MAPPING.keys(),
+) -> Tuple[YkmanDevice, DeviceInfo]:
+    """Waits for a YubiKey to come back after rebooting, or being re-inserted.
+
+    This is meant to be called right after a command which makes the YubiKey reboot,
+    such as changing its USB interfaces. Devices which are attached when the call
+    starts are only considered once they have been detached, as they may not have
+    rebooted yet. Returns as soon as the YubiKey has been read over one of the
+    connection types.
+
+    :param serial: The serial of the YubiKey, or None to accept any YubiKey.
+    :param timeout: How long to wait, in seconds.
+    :param interfaces: The USB interfaces the YubiKey is expected to have.
+    :param connection_types: Filter connection types.
+    :return: The device reference, and the device information read from it.
+    """
+    deadline = monotonic() + timeout
+    connection_types = planner.order(connection_types, _attached_pids(connection_types))
+    stale: Dict[Type[Connection], Set[Hashable]] = {}
+    for connection_type in connection_types:
+        try:
+            stale[connection_type] = set(_list_by_fingerprint(connection_type))
+        except Exception as e:
+            logger.debug(f"Unable to list {connection_type}", exc_info=e)
+            stale[connection_type] = set()
+    checked: Dict[Type[Connection], Set[Hashable]] = {
+        t: set() for t in connection_types
+    }
+    found: List[Tuple[Type[Connection], YkmanDevice, DeviceInfo]] = []
+    try:
+        with DeviceMonitor() as monitor:
+            while True:
+                retry = False
+                for connection_type in connection_types:
+                    try:
+                        devs = _list_by_fingerprint(connection_type)
+                    except Exception as e:
+                        logger.debug(f"Unable to list {connection_type}", exc_info=e)
+                        continue
+                    # Forget detached devices, so they are read if they come back
+                    stale[connection_type] &= devs.keys()
+                    checked[connection_type] &= devs.keys()
+                    for fingerprint, dev in devs.items():
+                        if fingerprint in stale[connection_type]:
+                            continue
+                        if fingerprint in checked[connection_type]:
+                            continue
+                        if interfaces is not None and (
+                            dev.pid is None or dev.pid.get_interfaces() != interfaces
+                        ):
+                            continue
+                        try:
+                            with dev.open_connection(connection_type) as conn:
+                                info = _timed_read_info(dev, connection_type, conn)
+                        except Exception as e:
+                            # The device may not be ready yet
+                            logger.debug(
+                                "Unable to read device, will retry", exc_info=e
+                            )
+                            retry = True
+                            continue
+                        checked[connection_type].add(fingerprint)
+                        found.append((connection_type, dev, info))
+                        if serial is None or info.serial == serial:
+                            return dev, info
+
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("Timed out waiting for YubiKey to reappear")
+                if retry:
+                    monitor.wait(min(remaining, 0.25))
+                else:
+                    monitor.wait(remaining)
+    finally:
+        _update_device_index(found)
+        planner.save()
+
+
+def _scan_connect(
+    serial: Optional[int],
+    connection_types: List[Type[Connection]],
+    found: List[Tuple[Type[Connection], YkmanDevice, DeviceInfo]],
+) -> Tuple[Connection, YkmanDevice, DeviceInfo]:
     failed_connections = set()
-    retry_ccid = []
+    retry_ccid: List[Tuple[YkmanDevice, Type[Connection]]] = []
     for connection_type in connection_types:
         try:
-            devs = CONNECTION_LIST_MAPPING[connection_type]()
+            devs = _list_devices(connection_type)
         except Exception as e:
             logger.error(
                 f"Error listing connection of type {connection_type}", exc_info=e
@@ -215,10 +713,11 @@ def connect_to_device(
             try:
                 conn = dev.open_connection(connection_type)
             except NoCardException:
-                retry_ccid.append(dev)
+                retry_ccid.append((dev, connection_type))
                 logger.debug("CCID No card present, will retry")
                 continue
-            info = read_info(dev.pid, conn)
+            info = _timed_read_info(dev, connection_type, conn)
+            found.append((connection_type, dev, info))
             if serial and info.serial != serial:
                 conn.close()
             else:
@@ -228,21 +727,26 @@ def connect_to_device(
         raise ConnectionNotAvailableException(connection_types)
 
     # NEO ejects the card when other interfaces are used, and returns it after ~3s.
-    for _ in range(6):
-        if not retry_ccid:
-            break
-        sleep(0.5)
-        for dev in retry_ccid[:]:
-            try:
-                conn = dev.open_connection(SmartCardConnection)
-            except NoCardException:
-                continue
-            retry_ccid.remove(dev)
-            info = read_info(dev.pid, conn)
-            if serial and info.serial != serial:
-                conn.close()
-            else:
-                return conn, dev, info
+    if retry_ccid:
+        with DeviceMonitor(0.5) as monitor:
+            deadline = monotonic() + 3.0
+            while True:
+                for dev, connection_type in retry_ccid[:]:
+                    try:
+                        conn = dev.open_connection(connection_type)
+                    except NoCardException:
+                        continue
+                    retry_ccid.remove((dev, connection_type))
+                    info = _timed_read_info(dev, connection_type, conn)
+                    found.append((connection_type, dev, info))
+                    if serial and info.serial != serial:
+                        conn.close()
+                    else:
+                        return conn, dev, info
+                remaining = deadline - monotonic()
+                if not retry_ccid or remaining <= 0:
+                    break
+                monitor.wait(remaining)
 
     if serial:
         raise ValueError("YubiKey with given serial not found")
@@ -272,6 +776,64 @@ SCAN_APPLETS = {
 }
 
 
+def _probe_capabilities(conn: SmartCardConnection) -> CAPABILITY:
+    capabilities = CAPABILITY(0)
+    protocol = SmartCardProtocol(conn)
+    for aid, code in SCAN_APPLETS.items():
+        try:
+            logger.debug("Check for %s", code)
+            protocol.select(aid)
+            capabilities |= code
+            logger.debug("Found applet: aid: %s, capability: %s", aid, code)
+        except ApplicationNotAvailableError:
+            logger.debug("Missing applet: aid: %s, capability: %s", aid, code)
+        except Exception as e:
+            logger.error(
+                "Error selecting aid: %s, capability: %s",
+                aid,
+                code,
+                exc_info=e,
+            )
+    return capabilities
+
+
+def _probe_key(conn, key_type, interfaces, version, serial) -> Optional[str]:
+    # Identifies a device by serial, or by reader for USB devices without one. The
+    # key changes with the firmware version and enabled USB interfaces.
+    if serial is None:
+        if key_type is None:
+            return None  # NFC reader, the card may be any device
+        serial = getattr(conn, "reader_name", None)
+        if serial is None:
+            return None
+    model = key_type.name if key_type else "NFC"
+    return f"{model}/{int(interfaces):x}/{version}/{serial}"
+
+
+def _load_probed_capabilities(probe_key: Optional[str]) -> Optional[CAPABILITY]:
+    if probe_key is None:
+        return None
+    try:
+        with _app_data_lock:
+            value = AppData(PROBE_CACHE).get(probe_key)
+    except Exception as e:
+        logger.debug("Unable to read probed capabilities", exc_info=e)
+        return None
+    return None if value is None else CAPABILITY(value)
+
+
+def _save_probed_capabilities(probe_key: Optional[str], capabilities: CAPABILITY):
+    if probe_key is None:
+        return
+    try:
+        with _app_data_lock:
+            cache = AppData(PROBE_CACHE)
+            cache[probe_key] = int(capabilities)
+            cache.write()
+    except Exception as e:
+        logger.debug("Unable to store probed capabilities", exc_info=e)
+
+
 def _read_info_ccid(conn, key_type, interfaces):
     version: Optional[Version] = None
     try:
@@ -282,6 +844,7 @@ def _read_info_ccid(conn, key_type, interfaces):
         except NotSupportedError:
             # Workaround to "de-select" the Management Applet needed for NEO
             conn.send_and_receive(b"\xa4\x04\x00\x08")
+            conn.reset_selection()
     except ApplicationNotAvailableError:
         logger.debug("Unable to select Management application, use fallback.")
 
@@ -301,23 +864,13 @@ def _read_info_ccid(conn, key_type, interfaces):
     if version is None:
         version = Version(3, 0, 0)  # Guess, no way to know
 
-    # Scan for remaining capabilities
-    protocol = SmartCardProtocol(conn)
-    for aid, code in SCAN_APPLETS.items():
-        try:
-            logger.debug("Check for %s", code)
-            protocol.select(aid)
-            capabilities |= code
-            logger.debug("Found applet: aid: %s, capability: %s", aid, code)
-        except ApplicationNotAvailableError:
-            logger.debug("Missing applet: aid: %s, capability: %s", aid, code)
-        except Exception as e:
-            logger.error(
-                "Error selecting aid: %s, capability: %s",
-                aid,
-                code,
-                exc_info=e,
-            )
+    # Scan for remaining capabilities, unless they are known from an earlier scan
+    probe_key = _probe_key(conn, key_type, interfaces, version, serial)
+    probed = _load_probed_capabilities(probe_key)
+    if probed is None:
+        probed = _probe_capabilities(conn)
+        _save_probed_capabilities(probe_key, probed)
+    capabilities |= probed
 
     # Assume U2F on devices >= 3.3.0
     if USB_INTERFACE.FIDO in interfaces or version >= (3, 3, 0):
@@ -1,8 +1,13 @@
 from . import __version__ as ckman_version
 from .logging_setup import log_sys_info
-from .pcsc import list_readers, list_devices as list_ccid_devices
+from .pcsc import (
+    ScardSmartCardConnection,
+    list_readers,
+    list_devices as list_ccid_devices,
+)
 from .hid import list_otp_devices, list_ctap_devices
 from .device import read_info, get_name
+from .planner import planner
 from .piv import get_piv_info
 from .openpgp import OpenPgpController, get_openpgp_info
 
@@ -71,9 +76,7 @@ def ccid_info():
         lines.append("Detected PC/SC readers:")
         for reader in readers:
             try:
-                c = reader.createConnection()
-                c.connect()
-                c.disconnect()
+                ScardSmartCardConnection(reader.name).close()
                 result = "Success"
             except Exception as e:
                 result = e.__class__.__name__
@@ -171,6 +174,14 @@ def fido_info():
     return lines
 
 
+def planner_info():
+    lines = []
+    lines.append("Interface statistics:")
+    lines.extend(f"\t{ln}" for ln in planner.format().splitlines())
+    lines.append("")
+    return lines
+
+
 def get_diagnostics():
     lines = []
     lines.append(f"ckman: {ckman_version}")
@@ -180,6 +191,7 @@ def get_diagnostics():
     lines.extend(ccid_info())
     lines.extend(otp_info())
     lines.extend(fido_info())
+    lines.extend(planner_info())
     lines.append("End of diagnostics")
 
     return "\n".join(lines)
@@ -0,0 +1,1021 @@
+# Copyright (c) 2020 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""In-process software emulation of YubiKeys.
+
+An EmulatedYubiKey holds the state of a single device, implementing the Management,
+OATH, PIV and YubiOTP applications. It is accessed through EmulatedSmartCardConnection
+and EmulatedOtpConnection, which behave like the connections to a physical device, or
+through EmulatedYubiKeyDevice references, which can stand in for enumerated devices.
+
+The emulation covers what canokit uses, it is not a complete implementation of the
+applications. Operations requiring touch are always granted immediately.
+"""
+
+from canokit.core import (
+    AID,
+    TRANSPORT,
+    Version,
+    Tlv,
+    bytes2int,
+    int2bytes,
+)
+from canokit.core.otp import (
+    OtpConnection,
+    calculate_crc,
+    check_crc,
+    FEATURE_RPT_DATA_SIZE,
+    FRAME_SIZE,
+    SLOT_DATA_SIZE,
+    RESP_PENDING_FLAG,
+    SLOT_WRITE_FLAG,
+    SEQUENCE_MASK,
+)
+from canokit.core.smartcard import SmartCardConnection, SW
+from canokit.management import (
+    CAPABILITY,
+    USB_INTERFACE,
+    FORM_FACTOR,
+    DEVICE_FLAG,
+    TAG_USB_SUPPORTED,
+    TAG_SERIAL,
+    TAG_USB_ENABLED,
+    TAG_FORM_FACTOR,
+    TAG_VERSION,
+    TAG_AUTO_EJECT_TIMEOUT,
+    TAG_CHALRESP_TIMEOUT,
+    TAG_DEVICE_FLAGS,
+    TAG_CONFIG_LOCK,
+    TAG_UNLOCK,
+    TAG_NFC_SUPPORTED,
+    TAG_NFC_ENABLED,
+)
+from canokit.yubiotp import CONFIG_SLOT, CFGFLAG, TKTFLAG, EXTFLAG, CFGSTATE
+from canokit import oath, piv
+from .base import YUBIKEY, YkmanDevice
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import rsa, ec, utils
+from cryptography.hazmat.primitives.ciphers import Cipher, modes
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+from cryptography.hazmat.backends import default_backend
+
+from dataclasses import dataclass
+from threading import RLock
+from time import sleep
+from typing import Dict, List, Optional, Type, Union
+import hashlib
+import hmac
+import os
+import struct
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# ATR of a YubiKey 5, indicating support for extended APDUs
+ATR_EXTENDED = bytes.fromhex("3bfd1300008131fe158073c021c057597562694b657940")
+# ATR of a YubiKey NEO, short APDUs only
+ATR_SHORT = bytes.fromhex("3bfc1300008131fe15597562696b65794e454f7233e1")
+
+SUPPORTED_CAPABILITIES = CAPABILITY.OTP | CAPABILITY.OATH | CAPABILITY.PIV
+
+INS_OTP_CONFIG = 0x01
+INS_READ_VERSION = 0x31
+INS_MGMT_READ_CONFIG = 0x1D
+INS_MGMT_WRITE_CONFIG = 0x1C
+INS_MGMT_SET_MODE = 0x16
+
+OATH_MAX_CREDENTIALS = 32
+OATH_ALGORITHM_TAG = 0x7B
+
+PIV_DEFAULT_PIN = b"123456"
+PIV_DEFAULT_PUK = b"12345678"
+PIV_DEFAULT_DISCOVERY = bytes.fromhex("7e124f0ba0000003080000100001005f2f024000")
+
+OTP_CONFIG_SIZE = 52
+OTP_ACC_CODE_SIZE = 6
+OTP_PAYLOAD_SIZE = OTP_CONFIG_SIZE + OTP_ACC_CODE_SIZE
+
+
+class _StatusError(Exception):
+    """Aborts processing of a command, responding with the given status word."""
+
+    def __init__(self, sw: int):
+        self.sw = sw
+
+
+def _require(condition, sw=SW.SECURITY_CONDITION_NOT_SATISFIED):
+    if not condition:
+        raise _StatusError(sw)
+
+
+def _pad_pin(value: bytes) -> bytes:
+    return value.ljust(piv.PIN_LEN, b"\xff")
+
+
+class _Applet:
+    """Base class for emulated smart card applications."""
+
+    # INS used to read the remainder of a long response
+    ins_send_remaining = 0xC0
+
+    def __init__(self, key: "EmulatedYubiKey"):
+        self.key = key
+
+    def select(self) -> bytes:
+        """Called when the application is selected, returns the SELECT response."""
+        return b""
+
+    def process(self, ins: int, p1: int, p2: int, data: bytes) -> bytes:
+        raise _StatusError(SW.INVALID_INSTRUCTION)
+
+
+class _ManagementApplet(_Applet):
+    def select(self):
+        return self.key.version_string.encode()
+
+    def process(self, ins, p1, p2, data):
+        if ins == INS_READ_VERSION:
+            return self.key.version_string.encode()
+        if ins == INS_MGMT_READ_CONFIG and self.key.version >= (4, 1, 0):
+            return self.key.get_device_info()
+        if ins == INS_MGMT_WRITE_CONFIG and self.key.version >= (5, 0, 0):
+            self.key.write_device_config(data)
+            return b""
+        if ins == INS_MGMT_SET_MODE:
+            return b""
+        return super().process(ins, p1, p2, data)
+
+
+@dataclass
+class _OathCredential:
+    oath_type: oath.OATH_TYPE
+    hash_algorithm: oath.HASH_ALGORITHM
+    digits: int
+    secret: bytes
+    touch: bool
+    counter: int = 0
+
+    def calculate(self, challenge: bytes) -> bytes:
+        if self.oath_type == oath.OATH_TYPE.HOTP:
+            challenge = struct.pack(">Q", self.counter)
+            self.counter += 1
+        name = self.hash_algorithm.name.lower()
+        return hmac.new(self.secret, challenge, name).digest()
+
+    def truncate(self, digest: bytes) -> bytes:
+        offset = digest[-1] & 0x0F
+        return bytes([self.digits]) + digest[offset : offset + 4]
+
+
+def _parse_oath_put(data):
+    # TAG_PROPERTY is written as a tag followed by a single byte, without a length
+    values = {}
+    while data:
+        if data[0] == oath.TAG_PROPERTY:
+            values[oath.TAG_PROPERTY], data = data[1:2], data[2:]
+        else:
+            tlv, data = Tlv.parse_from(data)
+            values[tlv.tag] = tlv.value
+    return values
+
+
+class _OathApplet(_Applet):
+    ins_send_remaining = oath.INS_SEND_REMAINING
+
+    def __init__(self, key):
+        super().__init__(key)
+        self.credentials: Dict[bytes, _OathCredential] = {}
+        self._reset()
+
+    def _reset(self):
+        self.credentials.clear()
+        self._salt = os.urandom(8)
+        self._access_key: Optional[bytes] = None
+        self._challenge = b""
+        self._unlocked = True
+
+    def select(self):
+        response = Tlv(oath.TAG_VERSION, bytes(self.key.version)) + Tlv(
+            oath.TAG_NAME, self._salt
+        )
+        self._unlocked = self._access_key is None
+        if not self._unlocked:
+            self._challenge = os.urandom(oath.CHALLENGE_LEN)
+            response += Tlv(oath.TAG_CHALLENGE, self._challenge) + Tlv(
+                OATH_ALGORITHM_TAG, bytes([oath.HASH_ALGORITHM.SHA1])
+            )
+        return response
+
+    def process(self, ins, p1, p2, data):
+        if ins == oath.INS_RESET:
+            _require(p1 == 0xDE and p2 == 0xAD, SW.WRONG_PARAMETERS_P1P2)
+            self._reset()
+            return b""
+        if ins == oath.INS_VALIDATE:
+            return self._validate(data)
+        _require(self._unlocked)
+
+        if ins == oath.INS_PUT:
+            return self._put(_parse_oath_put(data))
+        if ins == oath.INS_DELETE:
+            name = Tlv.unpack(oath.TAG_NAME, data)
+            _require(self.credentials.pop(name, None) is not None, SW.DATA_INVALID)
+            return b""
+        if ins == oath.INS_RENAME and self.key.version >= (5, 3, 1):
+            old, new = (tlv.value for tlv in Tlv.parse_list(data))
+            _require(old in self.credentials, SW.DATA_INVALID)
+            _require(new not in self.credentials, SW.CONDITIONS_NOT_SATISFIED)
+            self.credentials = {
+                new if k == old else k: v for k, v in self.credentials.items()
+            }
+            return b""
+        if ins == oath.INS_LIST:
+            return b"".join(
+                Tlv(
+                    oath.TAG_NAME_LIST,
+                    bytes([cred.oath_type | cred.hash_algorithm]) + name,
+                )
+                for name, cred in self.credentials.items()
+            )
+        if ins == oath.INS_CALCULATE:
+            values = Tlv.parse_dict(data)
+            cred = self.credentials.get(values.get(oath.TAG_NAME, b""))
+            if cred is None:
+                raise _StatusError(SW.DATA_INVALID)
+            digest = cred.calculate(values.get(oath.TAG_CHALLENGE, b""))
+            if p2 == 0x01:
+                return Tlv(oath.TAG_TRUNCATED, cred.truncate(digest))
+            return Tlv(oath.TAG_RESPONSE, bytes([cred.digits]) + digest)
+        if ins == oath.INS_CALCULATE_ALL:
+            challenge = Tlv.unpack(oath.TAG_CHALLENGE, data)
+            response = b""
+            for name, cred in self.credentials.items():
+                response += Tlv(oath.TAG_NAME, name)
+                if cred.oath_type == oath.OATH_TYPE.HOTP:
+                    response += Tlv(oath.TAG_HOTP, bytes([cred.digits]))
+                elif cred.touch:
+                    response += Tlv(oath.TAG_TOUCH, bytes([cred.digits]))
+                else:
+                    digest = cred.calculate(challenge)
+                    response += Tlv(oath.TAG_TRUNCATED, cred.truncate(digest))
+            return response
+        if ins == oath.INS_SET_CODE:
+            return self._set_code(Tlv.parse_dict(data))
+        return super().process(ins, p1, p2, data)
+
+    def _put(self, values):
+        name = values[oath.TAG_NAME]
+        key = values[oath.TAG_KEY]
+        _require(
+            name in self.credentials or len(self.credentials) < OATH_MAX_CREDENTIALS,
+            SW.NO_SPACE,
+        )
+        prop = values.get(oath.TAG_PROPERTY, b"\0")[0]
+        cred = _OathCredential(
+            oath.OATH_TYPE(key[0] & oath.MASK_TYPE),
+            oath.HASH_ALGORITHM(key[0] & oath.MASK_ALGO),
+            key[1],
+            key[2:],
+            bool(prop & oath.PROP_REQUIRE_TOUCH),
+            bytes2int(values.get(oath.TAG_IMF, b"\0")),
+        )
+        self.credentials[name] = cred
+        return b""
+
+    def _validate(self, data):
+        values = Tlv.parse_dict(data)
+        _require(self._access_key is not None, SW.DATA_INVALID)
+        expected = oath._hmac_sha1(self._access_key, self._challenge)
+        _require(hmac.compare_digest(expected, values[oath.TAG_RESPONSE]))
+        self._unlocked = True
+        response = oath._hmac_sha1(self._access_key, values[oath.TAG_CHALLENGE])
+        return Tlv(oath.TAG_RESPONSE, response)
+
+    def _set_code(self, values):
+        key = values[oath.TAG_KEY]
+        if not key:
+            self._access_key = None
+            return b""
+        access_key = key[1:]
+        expected = oath._hmac_sha1(access_key, values[oath.TAG_CHALLENGE])
+        _require(
+            hmac.compare_digest(expected, values[oath.TAG_RESPONSE]), SW.DATA_INVALID
+        )
+        self._access_key = access_key
+        return b""
+
+
+_PrivateKey = Union[rsa.RSAPrivateKey, ec.EllipticCurvePrivateKey]
+
+
+@dataclass
+class _PivKey:
+    key_type: piv.KEY_TYPE
+    private_key: _PrivateKey
+    pin_policy: piv.PIN_POLICY
+    touch_policy: piv.TOUCH_POLICY
+    origin: int
+
+    def encode_public_key(self) -> bytes:
+        public_key = self.private_key.public_key()
+        if isinstance(public_key, rsa.RSAPublicKey):
+            numbers = public_key.public_numbers()
+            return Tlv(0x81, int2bytes(numbers.n)) + Tlv(0x82, int2bytes(numbers.e))
+        return Tlv(
+            0x86, public_key.public_bytes(Encoding.X962, PublicFormat.UncompressedPoint)
+        )
+
+
+_CURVES = {
+    piv.KEY_TYPE.ECCP256: (ec.SECP256R1, hashes.SHA256),
+    piv.KEY_TYPE.ECCP384: (ec.SECP384R1, hashes.SHA384),
+}
+
+
+def _default_pin_policy(slot):
+    if slot == piv.SLOT.SIGNATURE:
+        return piv.PIN_POLICY.ALWAYS
+    if slot == piv.SLOT.CARD_AUTH:
+        return piv.PIN_POLICY.NEVER
+    return piv.PIN_POLICY.ONCE
+
+
+class _PivApplet(_Applet):
+    def __init__(self, key):
+        super().__init__(key)
+        self._reset()
+
+    def _reset(self):
+        self.objects: Dict[int, bytes] = {}
+        self.keys: Dict[int, _PivKey] = {}
+        self._references = {
+            piv.PIN_P2: _pad_pin(PIV_DEFAULT_PIN),
+            piv.PUK_P2: _pad_pin(PIV_DEFAULT_PUK),
+        }
+        self._retries = {piv.PIN_P2: [3, 3], piv.PUK_P2: [3, 3]}
+        self._management_key_type = piv.MANAGEMENT_KEY_TYPE.TDES
+        self._management_key = piv.DEFAULT_MANAGEMENT_KEY
+        self._management_touch = piv.TOUCH_POLICY.NEVER
+        self.select()
+
+    def select(self):
+        self._pin_verified = False
+        self._authenticated = False
+        self._witness: Optional[bytes] = None
+        return Tlv(0x61, Tlv(0x4F, AID.PIV[5:]) + Tlv(0x79, Tlv(0x4F, AID.PIV)))
+
+    def process(self, ins, p1, p2, data):
+        if ins == piv.INS_GET_VERSION:
+            return bytes(self.key.version)
+        if ins == piv.INS_VERIFY:
+            return self._verify(p2, data)
+        if ins in (piv.INS_CHANGE_REFERENCE, piv.INS_RESET_RETRY):
+            return self._change_reference(ins, p2, data)
+        if ins == piv.INS_GET_DATA:
+            return self._get_data(Tlv.unpack(piv.TAG_OBJ_ID, data))
+        if ins == piv.INS_AUTHENTICATE:
+            return self._authenticate(p1, p2, Tlv.unpack(piv.TAG_DYN_AUTH, data))
+        if ins == piv.INS_GET_METADATA and self.key.version >= (5, 3, 0):
+            return self._get_metadata(p2)
+        if ins == piv.INS_RESET:
+            _require(
+                not any(remaining for _, remaining in self._retries.values()),
+                SW.CONDITIONS_NOT_SATISFIED,
+            )
+            self._reset()
+            return b""
+
+        # Remaining commands require management key authentication
+        if ins in (
+            piv.INS_PUT_DATA,
+            piv.INS_GENERATE_ASYMMETRIC,
+            piv.INS_IMPORT_KEY,
+            piv.INS_SET_MGMKEY,
+            piv.INS_SET_PIN_RETRIES,
+        ):
+            _require(self._authenticated)
+        if ins == piv.INS_PUT_DATA:
+            values = Tlv.parse_dict(data)
+            object_id = bytes2int(values[piv.TAG_OBJ_ID])
+            if values.get(piv.TAG_OBJ_DATA):
+                self.objects[object_id] = values[piv.TAG_OBJ_DATA]
+            else:
+                self.objects.pop(object_id, None)
+            return b""
+        if ins == piv.INS_GENERATE_ASYMMETRIC:
+            return self._generate(p2, Tlv.parse_dict(Tlv.unpack(0xAC, data)))
+        if ins == piv.INS_IMPORT_KEY:
+            return self._import(p1, p2, Tlv.parse_dict(data))
+        if ins == piv.INS_SET_MGMKEY:
+            key_type = piv.MANAGEMENT_KEY_TYPE(data[0])
+            management_key = Tlv.unpack(piv.SLOT_CARD_MANAGEMENT, data[1:])
+            _require(len(management_key) == key_type.key_len, SW.INCORRECT_PARAMETERS)
+            self._management_key_type = key_type
+            self._management_key = management_key
+            self._management_touch = (
+                piv.TOUCH_POLICY.ALWAYS if p2 == 0xFE else piv.TOUCH_POLICY.NEVER
+            )
+            return b""
+        if ins == piv.INS_SET_PIN_RETRIES:
+            _require(self._pin_verified)
+            self._references[piv.PIN_P2] = _pad_pin(PIV_DEFAULT_PIN)
+            self._references[piv.PUK_P2] = _pad_pin(PIV_DEFAULT_PUK)
+            self._retries = {piv.PIN_P2: [p1, p1], piv.PUK_P2: [p2, p2]}
+            return b""
+        return super().process(ins, p1, p2, data)
+
+    def _check_reference(self, p2, value):
+        retries = self._retries[p2]
+        _require(retries[1] > 0, SW.AUTH_METHOD_BLOCKED)
+        if not hmac.compare_digest(self._references[p2], value):
+            retries[1] -= 1
+            if p2 == piv.PIN_P2:
+                self._pin_verified = False
+            raise _StatusError(SW.VERIFY_FAIL_NO_RETRY | retries[1])
+        retries[1] = retries[0]
+
+    def _verify(self, p2, data):
+        _require(p2 == piv.PIN_P2, SW.REFERENCE_DATA_NOT_FOUND)
+        if not data:
+            if self._pin_verified:
+                return b""
+            remaining = self._retries[p2][1]
+            _require(remaining > 0, SW.AUTH_METHOD_BLOCKED)
+            raise _StatusError(SW.VERIFY_FAIL_NO_RETRY | remaining)
+        self._check_reference(p2, data)
+        self._pin_verified = True
+        return b""
+
+    def _change_reference(self, ins, p2, data):
+        _require(len(data) == 2 * piv.PIN_LEN, SW.WRONG_LENGTH)
+        old, new = data[: piv.PIN_LEN], data[piv.PIN_LEN :]
+        if ins == piv.INS_RESET_RETRY:
+            _require(p2 == piv.PIN_P2, SW.REFERENCE_DATA_NOT_FOUND)
+            self._check_reference(piv.PUK_P2, old)
+            self._retries[piv.PIN_P2][1] = self._retries[piv.PIN_P2][0]
+        else:
+            _require(p2 in self._references, SW.REFERENCE_DATA_NOT_FOUND)
+            self._check_reference(p2, old)
+        self._references[p2] = new
+        return b""
+
+    def _get_data(self, object_id):
+        if bytes2int(object_id) == piv.OBJECT_ID.DISCOVERY:
+            return PIV_DEFAULT_DISCOVERY
+        value = self.objects.get(bytes2int(object_id))
+        _require(value is not None, SW.FILE_NOT_FOUND)
+        return Tlv(piv.TAG_OBJ_DATA, value)
+
+    def _cipher(self):
+        key_type = self._management_key_type
+        cipher_key = piv._parse_management_key(key_type, self._management_key)
+        return Cipher(cipher_key, modes.ECB(), default_backend())  # nosec
+
+    def _authenticate(self, p1, p2, data):
+        values = Tlv.parse_dict(data)
+        if p2 == piv.SLOT_CARD_MANAGEMENT:
+            _require(p1 == self._management_key_type, SW.INCORRECT_PARAMETERS)
+            if piv.TAG_AUTH_CHALLENGE not in values:  # Step 1, send a witness
+                self._authenticated = False
+                self._witness = os.urandom(self._management_key_type.challenge_len)
+                encryptor = self._cipher().encryptor()
+                encrypted = encryptor.update(self._witness) + encryptor.finalize()
+                return Tlv(piv.TAG_DYN_AUTH, Tlv(piv.TAG_AUTH_WITNESS, encrypted))
+            witness, self._witness = self._witness, None
+            _require(
+                witness is not None
+                and hmac.compare_digest(witness, values[piv.TAG_AUTH_WITNESS])
+            )
+            self._authenticated = True
+            encryptor = self._cipher().encryptor()
+            response = (
+                encryptor.update(values[piv.TAG_AUTH_CHALLENGE]) + encryptor.finalize()
+            )
+            return Tlv(piv.TAG_DYN_AUTH, Tlv(piv.TAG_AUTH_RESPONSE, response))
+
+        key = self.keys.get(p2)
+        if key is None or key.key_type != p1:
+            raise _StatusError(SW.INCORRECT_PARAMETERS)
+        if key.pin_policy != piv.PIN_POLICY.NEVER:
+            _require(self._pin_verified)
+            if key.pin_policy == piv.PIN_POLICY.ALWAYS:
+                self._pin_verified = False
+
+        private_key = key.private_key
+        if isinstance(private_key, rsa.RSAPrivateKey):
+            numbers = private_key.private_numbers()
+            n = numbers.public_numbers.n
+            message = bytes2int(values[piv.TAG_AUTH_CHALLENGE])
+            response = int2bytes(pow(message, numbers.d, n), key.key_type.bit_len // 8)
+        elif piv.TAG_AUTH_EXPONENTIATION in values:
+            curve = _CURVES[key.key_type][0]
+            peer = ec.EllipticCurvePublicKey.from_encoded_point(
+                curve(), values[piv.TAG_AUTH_EXPONENTIATION]
+            )
+            response = private_key.exchange(ec.ECDH(), peer)
+        else:
+            hash_algorithm = _CURVES[key.key_type][1]()
+            response = private_key.sign(
+                values[piv.TAG_AUTH_CHALLENGE],
+                ec.ECDSA(utils.Prehashed(hash_algorithm)),
+            )
+        return Tlv(piv.TAG_DYN_AUTH, Tlv(piv.TAG_AUTH_RESPONSE, response))
+
+    def _store_key(self, slot, key_type, private_key, values, origin):
+        _require(slot in piv.SLOT.__members__.values(), SW.INCORRECT_PARAMETERS)
+        pin_policy = piv.PIN_POLICY(values.get(piv.TAG_PIN_POLICY, b"\0")[0])
+        touch_policy = piv.TOUCH_POLICY(values.get(piv.TAG_TOUCH_POLICY, b"\0")[0])
+        key = _PivKey(
+            key_type,
+            private_key,
+            pin_policy or _default_pin_policy(slot),
+            touch_policy or piv.TOUCH_POLICY.NEVER,
+            origin,
+        )
+        self.keys[slot] = key
+        return key
+
+    def _generate(self, slot, values):
+        key_type = piv.KEY_TYPE(values[piv.TAG_GEN_ALGORITHM][0])
+        private_key: _PrivateKey
+        if key_type.algorithm == piv.ALGORITHM.RSA:
+            private_key = rsa.generate_private_key(
+                65537, key_type.bit_len, default_backend()
+            )
+        else:
+            private_key = ec.generate_private_key(
+                _CURVES[key_type][0](), default_backend()
+            )
+        key = self._store_key(slot, key_type, private_key, values, piv.ORIGIN_GENERATED)
+        return Tlv(0x7F49, key.encode_public_key())
+
+    def _import(self, key_type, slot, values):
+        key_type = piv.KEY_TYPE(key_type)
+        private_key: _PrivateKey
+        if key_type.algorithm == piv.ALGORITHM.RSA:
+            p, q, dmp1, dmq1, iqmp = (bytes2int(values[t]) for t in range(1, 6))
+            e = 65537
+            d = pow(e, -1, (p - 1) * (q - 1))
+            public_numbers = rsa.RSAPublicNumbers(e, p * q)
+            private_key = rsa.RSAPrivateNumbers(
+                p, q, d, dmp1, dmq1, iqmp, public_numbers
+            ).private_key(default_backend())
+        else:
+            private_key = ec.derive_private_key(
+                bytes2int(values[0x06]), _CURVES[key_type][0](), default_backend()
+            )
+        self._store_key(slot, key_type, private_key, values, piv.ORIGIN_IMPORTED)
+        return b""
+
+    def _get_metadata(self, p2):
+        if p2 in self._references:
+            default = PIV_DEFAULT_PIN if p2 == piv.PIN_P2 else PIV_DEFAULT_PUK
+            is_default = self._references[p2] == _pad_pin(default)
+            return Tlv(piv.TAG_METADATA_IS_DEFAULT, bytes([is_default])) + Tlv(
+                piv.TAG_METADATA_RETRIES, bytes(self._retries[p2])
+            )
+        if p2 == piv.SLOT_CARD_MANAGEMENT:
+            is_default = self._management_key == piv.DEFAULT_MANAGEMENT_KEY
+            return (
+                Tlv(piv.TAG_METADATA_ALGO, bytes([self._management_key_type]))
+                + Tlv(piv.TAG_METADATA_POLICY, bytes([0, self._management_touch]))
+                + Tlv(piv.TAG_METADATA_IS_DEFAULT, bytes([is_default]))
+            )
+        key = self.keys.get(p2)
+        if key is None:
+            raise _StatusError(SW.REFERENCE_DATA_NOT_FOUND)
+        return (
+            Tlv(piv.TAG_METADATA_ALGO, bytes([key.key_type]))
+            + Tlv(piv.TAG_METADATA_POLICY, bytes([key.pin_policy, key.touch_policy]))
+            + Tlv(piv.TAG_METADATA_ORIGIN, bytes([key.origin]))
+            + Tlv(piv.TAG_METADATA_PUBLIC_KEY, key.encode_public_key())
+        )
+
+
+def _with_crc(data: bytes) -> bytes:
+    return data + struct.pack("<H", 0xFFFF & ~calculate_crc(data))
+
+
+class _OtpApplet(_Applet):
+    """The YubiOTP application, shared by the OTP HID interface and CCID."""
+
+    def __init__(self, key):
+        super().__init__(key)
+        self.slots: List[Optional[bytes]] = [None, None]
+        self.ndef: List[Optional[bytes]] = [None, None]
+        self.prog_seq = 0
+
+    def select(self):
+        return self.status()
+
+    def process(self, ins, p1, p2, data):
+        if ins == INS_OTP_CONFIG:
+            response = self.command(p1, data)
+            return self.status() if response is None else response
+        return super().process(ins, p1, p2, data)
+
+    def status(self) -> bytes:
+        """Version, programming sequence and touch level."""
+        touch_level = 0
+        for i, config in enumerate(self.slots):
+            if config:
+                touch_level |= (CFGSTATE.SLOT1_VALID, CFGSTATE.SLOT2_VALID)[i]
+                if not config[46] & TKTFLAG.CHAL_RESP:
+                    touch_level |= (CFGSTATE.SLOT1_TOUCH, CFGSTATE.SLOT2_TOUCH)[i]
+        return bytes(self.key.version) + struct.pack("<BH", self.prog_seq, touch_level)
+
+    def _updated(self):
+        self.prog_seq = (self.prog_seq + 1) & 0xFF if any(self.slots) else 0
+
+    def _check_access_code(self, index, payload):
+        config = self.slots[index]
+        if config and any(config[38:44]):
+            acc_code = payload[OTP_CONFIG_SIZE:OTP_PAYLOAD_SIZE]
+            return hmac.compare_digest(config[38:44], acc_code)
+        return True
+
+    def command(self, slot: int, payload: bytes) -> Optional[bytes]:
+        """Handles a command to a slot.
+
+        Returns the response data, or None for commands which only update the status.
+        A command which is rejected leaves the programming sequence unchanged.
+        """
+        if slot in (CONFIG_SLOT.CONFIG_1, CONFIG_SLOT.CONFIG_2):
+            index = slot == CONFIG_SLOT.CONFIG_2
+            config = payload[:OTP_CONFIG_SIZE]
+            if self._check_access_code(index, payload):
+                if not any(config):
+                    self.slots[index] = None
+                    self._updated()
+                elif check_crc(config):
+                    self.slots[index] = config
+                    self._updated()
+        elif slot in (CONFIG_SLOT.UPDATE_1, CONFIG_SLOT.UPDATE_2):
+            index = slot == CONFIG_SLOT.UPDATE_2
+            current = self.slots[index]
+            if (
+                current
+                and current[45] & EXTFLAG.ALLOW_UPDATE
+                and self._check_access_code(index, payload)
+            ):
+                # Updates replace the access code and flags only
+                self.slots[index] = (
+                    current[:38]
+                    + payload[38:44]
+                    + current[44:45]
+                    + (payload[45:48] + current[48:])
+                )
+                self._updated()
+        elif slot == CONFIG_SLOT.SWAP:
+            self.slots.reverse()
+            self._updated()
+        elif slot in (CONFIG_SLOT.NDEF_1, CONFIG_SLOT.NDEF_2):
+            self.ndef[slot == CONFIG_SLOT.NDEF_2] = payload
+            self._updated()
+        elif slot == CONFIG_SLOT.SCAN_MAP:
+            if self.key.version[0] != 3:  # The NEO probe expects this to be rejected
+                self._updated()
+        elif slot == CONFIG_SLOT.DEVICE_CONFIG:
+            self._updated()
+        elif slot == CONFIG_SLOT.YK4_SET_DEVICE_INFO:
+            try:
+                self.key.write_device_config(payload)
+                self._updated()
+            except _StatusError:
+                pass
+        elif slot == CONFIG_SLOT.DEVICE_SERIAL:
+            return int2bytes(self.key.serial, 4)
+        elif slot == CONFIG_SLOT.YK4_CAPABILITIES:
+            if self.key.version >= (4, 1, 0):
+                return self.key.get_device_info()
+        elif slot in (CONFIG_SLOT.CHAL_HMAC_1, CONFIG_SLOT.CHAL_HMAC_2):
+            hmac_config = self.slots[slot == CONFIG_SLOT.CHAL_HMAC_2]
+            if (
+                hmac_config
+                and hmac_config[46] & TKTFLAG.CHAL_RESP
+                and hmac_config[47] & CFGFLAG.CHAL_HMAC == CFGFLAG.CHAL_HMAC
+            ):
+                challenge = payload[:SLOT_DATA_SIZE]
+                if hmac_config[47] & CFGFLAG.HMAC_LT64:
+                    challenge = challenge.rstrip(challenge[-1:])
+                secret = hmac_config[22:38] + hmac_config[16:20]
+                return hmac.new(secret, challenge, hashlib.sha1).digest()
+        return None
+
+
+class EmulatedYubiKey:
+    """A software YubiKey, holding the state of its applications.
+
+    All connections to the same EmulatedYubiKey share this state. Each command is
+    delayed by latency seconds, to approximate the round-trip time of a device.
+    """
+
+    def __init__(
+        self,
+        serial: int,
+        version: Version = Version(5, 4, 3),
+        form_factor: FORM_FACTOR = FORM_FACTOR.USB_A_KEYCHAIN,
+        nfc: bool = False,
+        latency: float = 0.0,
+    ):
+        self.serial = serial
+        self.version = version
+        self.form_factor = form_factor
+        self.latency = latency
+        self.supported_capabilities = {TRANSPORT.USB: SUPPORTED_CAPABILITIES}
+        if nfc:
+            self.supported_capabilities[TRANSPORT.NFC] = SUPPORTED_CAPABILITIES
+        self.enabled_capabilities = dict(self.supported_capabilities)
+        self.auto_eject_timeout = 0
+        self.challenge_response_timeout = 15
+        self.device_flags = DEVICE_FLAG(0)
+        self.lock_code: Optional[bytes] = None
+
+        self.management = _ManagementApplet(self)
+        self.oath = _OathApplet(self)
+        self.piv = _PivApplet(self)
+        self.otp = _OtpApplet(self)
+        self._lock = RLock()
+
+    def __repr__(self):
+        return f"{type(self).__name__}(serial={self.serial})"
+
+    @property
+    def version_string(self) -> str:
+        return "%d.%d.%d" % self.version
+
+    @property
+    def usb_interfaces(self) -> USB_INTERFACE:
+        return USB_INTERFACE.for_capabilities(self.enabled_capabilities[TRANSPORT.USB])
+
+    @property
+    def pid(self):
+        return YUBIKEY.YK4.get_pid(self.usb_interfaces)
+
+    def get_applet(self, aid: bytes) -> Optional[_Applet]:
+        """Get the application for an AID, if it is enabled."""
+        enabled = self.enabled_capabilities[TRANSPORT.USB]
+        if aid == AID.MANAGEMENT:
+            return self.management
+        if aid == AID.OATH and CAPABILITY.OATH in enabled:
+            return self.oath
+        if aid == AID.PIV and CAPABILITY.PIV in enabled:
+            return self.piv
+        if aid == AID.OTP and CAPABILITY.OTP in enabled:
+            return self.otp
+        return None
+
+    def get_device_info(self) -> bytes:
+        """Encodes the device info, as read by ManagementSession."""
+        usb_supported = self.supported_capabilities[TRANSPORT.USB]
+        data = (
+            Tlv(TAG_USB_SUPPORTED, int2bytes(usb_supported, 2))
+            + Tlv(TAG_SERIAL, int2bytes(self.serial, 4))
+            + Tlv(
+                TAG_USB_ENABLED, int2bytes(self.enabled_capabilities[TRANSPORT.USB], 2)
+            )
+            + Tlv(TAG_FORM_FACTOR, int2bytes(self.form_factor))
+            + Tlv(TAG_VERSION, bytes(self.version))
+            + Tlv(TAG_AUTO_EJECT_TIMEOUT, int2bytes(self.auto_eject_timeout, 2))
+            + Tlv(TAG_CHALRESP_TIMEOUT, int2bytes(self.challenge_response_timeout))
+            + Tlv(TAG_DEVICE_FLAGS, int2bytes(self.device_flags))
+            + Tlv(TAG_CONFIG_LOCK, b"\1" if self.lock_code else b"\0")
+        )
+        if TRANSPORT.NFC in self.supported_capabilities:
+            nfc_supported = self.supported_capabilities[TRANSPORT.NFC]
+            nfc_enabled = self.enabled_capabilities[TRANSPORT.NFC]
+            data += Tlv(TAG_NFC_SUPPORTED, int2bytes(nfc_supported, 2)) + Tlv(
+                TAG_NFC_ENABLED, int2bytes(nfc_enabled, 2)
+            )
+        return int2bytes(len(data)) + data
+
+    def write_device_config(self, data: bytes) -> None:
+        """Applies an encoded DeviceConfig, as written by ManagementSession."""
+        _require(data and len(data) > data[0], SW.WRONG_LENGTH)
+        values = Tlv.parse_dict(data[1 : 1 + data[0]])
+        if self.lock_code:
+            unlock = values.get(TAG_UNLOCK, b"")
+            _require(hmac.compare_digest(unlock, self.lock_code))
+        for tag, transport in (
+            (TAG_USB_ENABLED, TRANSPORT.USB),
+            (TAG_NFC_ENABLED, TRANSPORT.NFC),
+        ):
+            if tag in values and transport in self.supported_capabilities:
+                supported = self.supported_capabilities[transport]
+                self.enabled_capabilities[transport] = CAPABILITY(
+                    bytes2int(values[tag]) & supported
+                )
+        if TAG_AUTO_EJECT_TIMEOUT in values:
+            self.auto_eject_timeout = bytes2int(values[TAG_AUTO_EJECT_TIMEOUT])
+        if TAG_CHALRESP_TIMEOUT in values:
+            self.challenge_response_timeout = bytes2int(values[TAG_CHALRESP_TIMEOUT])
+        if TAG_DEVICE_FLAGS in values:
+            self.device_flags = DEVICE_FLAG(bytes2int(values[TAG_DEVICE_FLAGS]))
+        if TAG_CONFIG_LOCK in values:
+            lock_code = values[TAG_CONFIG_LOCK]
+            self.lock_code = lock_code if any(lock_code) else None
+
+
+def _parse_apdu(apdu):
+    cla, ins, p1, p2 = apdu[:4]
+    if len(apdu) > 6 and apdu[4] == 0:  # Extended
+        lc = bytes2int(apdu[5:7])
+        return cla, ins, p1, p2, apdu[7 : 7 + lc], True
+    if len(apdu) > 4:
+        return cla, ins, p1, p2, apdu[5 : 5 + apdu[4]], False
+    return cla, ins, p1, p2, b"", False
+
+
+class EmulatedSmartCardConnection(SmartCardConnection):
+    """A SmartCardConnection to an EmulatedYubiKey.
+
+    Handles command chaining, and splits long responses to short APDUs using 61XX.
+    """
+
+    def __init__(self, key: EmulatedYubiKey, transport: TRANSPORT = TRANSPORT.USB):
+        self.key = key
+        self._transport = transport
+        self._applet: Optional[_Applet] = None
+        self._command = bytearray()
+        self._remaining = b""
+
+    @property
+    def transport(self):
+        return self._transport
+
+    @property
+    def atr(self):
+        return ATR_EXTENDED if self.key.version >= (4, 0, 0) else ATR_SHORT
+
+    def send_and_receive(self, apdu):
+        if self.key.latency:
+            sleep(self.key.latency)
+        with self.key._lock:
+            try:
+                return self._process(bytes(apdu))
+            except _StatusError as e:
+                self._command.clear()
+                return b"", e.sw
+
+    def _process(self, apdu):
+        cla, ins, p1, p2, data, extended = _parse_apdu(apdu)
+        applet = self._applet
+        if applet and ins == applet.ins_send_remaining and self._remaining:
+            return self._respond(self._remaining, extended)
+        self._remaining = b""
+
+        if cla & 0x10:  # Command chaining
+            self._command += data
+            return b"", SW.OK
+        if self._command:
+            data, self._command = bytes(self._command + data), bytearray()
+
+        if cla == 0 and ins == 0xA4 and p1 == 0x04:  # SELECT
+            self._applet = self.key.get_applet(data)
+            if self._applet is None:
+                raise _StatusError(SW.FILE_NOT_FOUND)
+            return self._respond(self._applet.select(), extended)
+        _require(applet is not None, SW.INVALID_INSTRUCTION)
+        try:
+            response = applet.process(ins, p1, p2, data)  # type: ignore
+        except (ValueError, KeyError, IndexError) as e:
+            logger.debug("Malformed command data", exc_info=e)
+            raise _StatusError(SW.WRONG_LENGTH)
+        return self._respond(response, extended)
+
+    def _respond(self, data, extended):
+        size = 0x10000 if extended else 0x100
+        response, self._remaining = data[:size], data[size:]
+        if self._remaining:
+            return response, 0x6100 | min(len(self._remaining), 0xFF)
+        return response, SW.OK
+
+
+class EmulatedOtpConnection(OtpConnection):
+    """An OtpConnection to the YubiOTP application of an EmulatedYubiKey.
+
+    Implements the feature report framing used by OtpProtocol. Each command frame is
+    delayed by the latency of the EmulatedYubiKey.
+    """
+
+    def __init__(self, key: EmulatedYubiKey):
+        self.key = key
+        self._frame = bytearray(FRAME_SIZE)
+        self._reports: List[bytes] = []
+
+    def receive(self):
+        with self.key._lock:
+            if self._reports:
+                return self._reports.pop(0)
+            return b"\0" + self.key.otp.status() + b"\0"
+
+    def send(self, data):
+        data = bytes(data)
+        status_byte = data[FEATURE_RPT_DATA_SIZE]
+        seq = status_byte & SEQUENCE_MASK
+        offset = seq * FEATURE_RPT_DATA_SIZE
+        if not status_byte & SLOT_WRITE_FLAG or offset >= FRAME_SIZE:
+            self._reports = []  # Dummy report, or reset after reading
+            return
+        if seq == 0:
+            self._frame[:] = bytes(FRAME_SIZE)
+            self._reports = []
+        self._frame[offset : offset + FEATURE_RPT_DATA_SIZE] = data[
+            :FEATURE_RPT_DATA_SIZE
+        ]
+        if offset + FEATURE_RPT_DATA_SIZE >= FRAME_SIZE:
+            self._process()
+
+    def _process(self):
+        payload = bytes(self._frame[:SLOT_DATA_SIZE])
+        slot, crc = struct.unpack(
+            "<BH", self._frame[SLOT_DATA_SIZE : SLOT_DATA_SIZE + 3]
+        )
+        if self.key.latency:
+            sleep(self.key.latency)
+        if crc != calculate_crc(payload):
+            return  # Rejected, status is unchanged
+        with self.key._lock:
+            response = self.key.otp.command(slot, payload)
+        if response is not None:
+            response = _with_crc(response)
+            response += b"\0" * (-len(response) % FEATURE_RPT_DATA_SIZE)
+            for i in range(0, len(response), FEATURE_RPT_DATA_SIZE):
+                self._reports.append(
+                    response[i : i + FEATURE_RPT_DATA_SIZE]
+                    + bytes([RESP_PENDING_FLAG | i // FEATURE_RPT_DATA_SIZE])
+                )
+            # Sequence number 0 marks the end of the response
+            self._reports.append(
+                bytes(FEATURE_RPT_DATA_SIZE) + bytes([RESP_PENDING_FLAG])
+            )
+
+
+_CONNECTION_TYPES = {
+    SmartCardConnection: EmulatedSmartCardConnection,
+    OtpConnection: EmulatedOtpConnection,
+}
+
+
+class EmulatedYubiKeyDevice(YkmanDevice):
+    """Reference to one USB interface of an EmulatedYubiKey."""
+
+    def __init__(self, key: EmulatedYubiKey, connection_type: Type):
+        super(EmulatedYubiKeyDevice, self).__init__(
+            TRANSPORT.USB, (key.serial, connection_type.__name__), key.pid
+        )
+        self.key = key
+        self._connection_cls = _CONNECTION_TYPES[connection_type]
+
+    def supports_connection(self, connection_type):
+        return issubclass(self._connection_cls, connection_type)
+
+    def open_connection(self, connection_type):
+        if self.supports_connection(connection_type):
+            return self._connection_cls(self.key)
+        return super(EmulatedYubiKeyDevice, self).open_connection(connection_type)
+
+
+def list_devices(
+    keys: List[EmulatedYubiKey], connection_type: Type
+) -> List[EmulatedYubiKeyDevice]:
+    """List the devices with the given connection type enabled, out of keys.
+
+    This can take the place of the functions in ckman.device.CONNECTION_LIST_MAPPING.
+    """
+    return [
+        EmulatedYubiKeyDevice(key, connection_type)
+        for key in keys
+        if key.usb_interfaces.supports_connection(connection_type)
+    ]
+
+
+def create_keys(count: int, first_serial: int = 10000000, **kwargs):
+    """Creates count EmulatedYubiKeys with consecutive serial numbers."""
+    return [EmulatedYubiKey(first_serial + i, **kwargs) for i in range(count)]
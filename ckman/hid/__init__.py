@@ -54,6 +54,17 @@ else:
 list_otp_devices: Callable[[], List[OtpYubiKeyDevice]] = backend.list_devices
 
 
+def open_hid_monitor():
+    """Open a monitor for HID devices being added or removed.
+
+    Returns None on platforms where this isn't supported, and changes must be polled
+    for instead.
+    """
+    if hasattr(backend, "HidrawMonitor"):
+        return backend.HidrawMonitor()
+    return None
+
+
 try:
     from fido2.hid import list_descriptors, open_connection, CtapHidDevice
 
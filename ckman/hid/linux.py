@@ -28,8 +28,12 @@
 from canokit.core.otp import OtpConnection
 from .base import OtpYubiKeyDevice, YUBICO_VID, USAGE_OTP
 
-import glob
+from time import monotonic
+from typing import Dict, Optional, Tuple
+import os
 import fcntl
+import ctypes
+import select
 import struct
 import logging
 
@@ -39,28 +43,40 @@ logger = logging.getLogger(__name__)
 USB_GET_REPORT = 0xC0094807
 USB_SET_REPORT = 0xC0094806
 
+# Where hidraw devices are listed, and where their device nodes are
+SYSFS_HIDRAW = "/sys/class/hidraw"
+DEV_DIR = "/dev"
+
 # hidraw.h
 HIDIOCGRAWINFO = 0x80084803
 HIDIOCGRDESCSIZE = 0x80044801
 HIDIOCGRDESC = 0x90044802
 
+# inotify.h
+IN_ATTRIB = 0x00000004
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+_INOTIFY_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len, followed by name
+
 
 class HidrawConnection(OtpConnection):
     def __init__(self, path):
         self.handle = open(path, "wb")
+        # Report ID followed by the report, reused for each ioctl
+        self._buffer = bytearray(1 + 8)
+        self._report = memoryview(self._buffer)[1:]
 
     def close(self):
         self.handle.close()
 
     def receive(self):
-        buf = bytearray(1 + 8)
-        fcntl.ioctl(self.handle, USB_GET_REPORT, buf, True)
-        return buf[1:]
+        fcntl.ioctl(self.handle, USB_GET_REPORT, self._buffer, True)
+        return bytes(self._report)
 
     def send(self, data):
-        buf = bytearray([0])  # Prepend the report ID.
-        buf.extend(data)
-        fcntl.ioctl(self.handle, USB_SET_REPORT, buf, True)
+        self._buffer[0] = 0  # Report ID
+        self._report[:] = data
+        fcntl.ioctl(self.handle, USB_SET_REPORT, self._buffer, True)
 
 
 def get_info(dev):
@@ -78,8 +94,9 @@ def get_descriptor(dev):
     return buf[4:]
 
 
-def get_usage(dev):
-    buf = get_descriptor(dev)
+def parse_usage(descriptor):
+    """Get the first (usage page, usage) pair of a HID report descriptor."""
+    buf = descriptor
     usage, usage_page = (None, None)
     while buf:
         head, buf = buf[0], buf[1:]
@@ -95,21 +112,124 @@ def get_usage(dev):
                 return usage_page, usage
 
 
+def get_usage(dev):
+    return parse_usage(get_descriptor(dev))
+
+
+def _read_sysfs_info(sysfs_path):
+    """Read the VID, PID and usage of a hidraw device from sysfs.
+
+    The usage is only read for Yubico devices, and is None for others.
+    """
+    with open(os.path.join(sysfs_path, "device", "uevent")) as f:
+        for line in f:
+            key, _, value = line.strip().partition("=")
+            if key == "HID_ID":  # bus:vid:pid, in hex
+                _, vid, pid = (int(x, 16) for x in value.split(":"))
+                break
+        else:
+            raise ValueError("No HID_ID in uevent")
+    usage = None
+    if vid == YUBICO_VID:
+        with open(os.path.join(sysfs_path, "device", "report_descriptor"), "rb") as f:
+            usage = parse_usage(f.read())
+    return vid, pid, usage
+
+
+# Parsed (vid, pid, usage) per hidraw node name, with the (inode, mtime) it was for
+_info_cache: Dict[str, Tuple[Tuple[int, int], Tuple[int, int, Optional[Tuple]]]] = {}
+
+
 def list_devices():
+    """List YubiKey OTP HID devices, using sysfs, without opening any devices.
+
+    The device information is cached for each device node, and read again if the
+    node is re-created.
+    """
     devices = []
-    return devices
-    for hidraw in glob.glob("/dev/hidraw*"):
-        usage = None
+    try:
+        names = os.listdir(SYSFS_HIDRAW)
+    except FileNotFoundError:
+        logger.debug("No hidraw devices in sysfs")
+        names = []
+
+    for name in names:
+        path = os.path.join(DEV_DIR, name)
         try:
-            with open(hidraw, "rb") as f:
-                bustype, vid, pid = get_info(f)
-                if vid == YUBICO_VID:
-                    usage = get_usage(f)
+            st = os.stat(path)
+            key = (st.st_ino, st.st_mtime_ns)
+            cached = _info_cache.get(name)
+            if cached and cached[0] == key:
+                info = cached[1]
+            else:
+                info = _read_sysfs_info(os.path.join(SYSFS_HIDRAW, name))
+                _info_cache[name] = (key, info)
         except Exception as e:
-            logger.debug("Failed opening HID device", exc_info=e)
+            logger.debug("Failed reading HID device info", exc_info=e)
             continue
 
-        if usage == USAGE_OTP:
-            devices.append(OtpYubiKeyDevice(hidraw, pid, HidrawConnection))
+        vid, pid, usage = info
+        if vid == YUBICO_VID and usage == USAGE_OTP:
+            try:
+                devices.append(OtpYubiKeyDevice(path, pid, HidrawConnection))
+            except ValueError:
+                logger.debug(f"Unsupported Yubico device with PID: {pid:02x}")
+
+    for name in set(_info_cache) - set(names):
+        del _info_cache[name]
 
     return devices
+
+
+class HidrawMonitor:
+    """Waits for hidraw devices to be added or removed, using inotify on /dev.
+
+    IN_ATTRIB is watched as well, as udev may only make a new device node
+    accessible after creating it.
+    """
+
+    def __init__(self, path: str = DEV_DIR):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_CREATE | IN_DELETE | IN_ATTRIB
+        if libc.inotify_add_watch(self._fd, os.fsencode(path), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, "inotify_add_watch failed")
+        self._cancel_r, self._cancel_w = os.pipe()
+
+    def _read_names(self):
+        try:
+            data = os.read(self._fd, 4096)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            _, _, _, size = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            yield data[offset : offset + size].rstrip(b"\0")
+            offset += size
+
+    def wait(self, timeout: float) -> bool:
+        """Wait up to timeout seconds for a change, returning True if there was one.
+
+        Returns early with False if the monitor is cancelled.
+        """
+        deadline = monotonic() + timeout
+        fds = [self._fd, self._cancel_r]
+        while True:
+            ready, _, _ = select.select(fds, [], [], max(deadline - monotonic(), 0))
+            if self._fd not in ready or self._cancel_r in ready:
+                return False
+            if any(name.startswith(b"hidraw") for name in self._read_names()):
+                return True
+
+    def cancel(self) -> None:
+        """Make a call to wait, ongoing or later, return as soon as possible."""
+        os.write(self._cancel_w, b"\0")
+
+    def close(self) -> None:
+        for fd in (self._fd, self._cancel_r, self._cancel_w):
+            os.close(fd)
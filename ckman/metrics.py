@@ -0,0 +1,185 @@
+# Copyright (c) 2020 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""Aggregation of per-command statistics, reported by the protocol observers."""
+
+from canokit.core import (
+    AID,
+    CommandEvent,
+    add_command_observer,
+    remove_command_observer,
+)
+
+from bisect import bisect_left
+from threading import Lock
+from typing import Dict, Optional, Sequence, Tuple
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10)
+
+
+def application_name(application: Optional[bytes]) -> str:
+    """Get a readable name for an application AID."""
+    if application is None:
+        return "NONE"
+    try:
+        return AID(application).name
+    except ValueError:
+        return application.hex()
+
+
+class LatencyHistogram:
+    """Counts of durations, in buckets with fixed upper bounds."""
+
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # Last bucket is unbounded
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q: float) -> float:
+        """Estimate a percentile (0-100), as the upper bound of its bucket."""
+        rank = q / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self) -> dict:
+        buckets = {str(b): c for b, c in zip(self.bounds, self.counts)}
+        buckets["inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "max": self.max,
+            "buckets": buckets,
+        }
+
+
+class CommandStatistics:
+    """Totals and latency distribution for one application and INS."""
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.errors = 0
+        self.sent = 0
+        self.received = 0
+        self.segments = 0
+        self.wait = 0.0
+
+    def add(self, event: CommandEvent) -> None:
+        self.latency.add(event.duration)
+        if event.error is not None:
+            self.errors += 1
+        self.sent += event.sent
+        self.received += event.received
+        self.segments += event.segments
+        if event.wait is not None:
+            self.wait += event.wait
+
+    def as_dict(self) -> dict:
+        return {
+            "errors": self.errors,
+            "sent": self.sent,
+            "received": self.received,
+            "segments": self.segments,
+            "wait": self.wait,
+            "latency": self.latency.as_dict(),
+        }
+
+
+class CommandMetrics:
+    """Collects CommandEvents, keeping statistics per application and INS.
+
+    An instance is a command observer, and can be registered on a single protocol
+    using its add_observer method, or for all protocols using install().
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._stats: Dict[Tuple[str, int], CommandStatistics] = {}
+
+    def __call__(self, event: CommandEvent) -> None:
+        key = (application_name(event.application), event.ins)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = CommandStatistics()
+            stats.add(event)
+
+    def install(self) -> None:
+        """Start collecting events from all protocols."""
+        add_command_observer(self)
+
+    def uninstall(self) -> None:
+        remove_command_observer(self)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+    def get(self, application: str, ins: int) -> Optional[CommandStatistics]:
+        return self._stats.get((application, ins))
+
+    def snapshot(self) -> Dict[str, Dict[str, dict]]:
+        """Get all statistics, as a JSON serializable dict.
+
+        The dict is keyed by application name, then by INS formatted as hex.
+        """
+        with self._lock:
+            result: Dict[str, Dict[str, dict]] = {}
+            for (application, ins), stats in sorted(self._stats.items()):
+                result.setdefault(application, {})[f"0x{ins:02x}"] = stats.as_dict()
+            return result
+
+    def format(self) -> str:
+        """Format a summary table of the collected statistics."""
+        lines = ["APPLICATION  INS    COUNT  ERRORS    MEAN ms     P95 ms     MAX ms"]
+        with self._lock:
+            for (application, ins), stats in sorted(self._stats.items()):
+                latency = stats.latency
+                lines.append(
+                    f"{application:<12} 0x{ins:02x} {latency.count:>7} "
+                    f"{stats.errors:>7} {latency.mean * 1000:>10.2f} "
+                    f"{latency.percentile(95) * 1000:>10.2f} "
+                    f"{latency.max * 1000:>10.2f}"
+                )
+        return "\n".join(lines)
@@ -28,6 +28,7 @@
 from canokit.core import (
     AID,
     Tlv,
+    TlvWriter,
     NotSupportedError,
     require_version,
     int2bytes,
@@ -194,45 +195,47 @@ def _get_key_attributes(key, key_slot):
 
 
 def _get_key_template(key, key_slot, crt=False):
-    def _pack_tlvs(tlvs):
-        header = b""
-        body = b""
-        for tlv in tlvs:
-            header += tlv[: -tlv.length]
-            body += tlv.value
-        return Tlv(0x7F48, header) + Tlv(0x5F48, body)
-
-    values: Tuple[Tlv, ...]
+    values: Tuple[Tuple[int, bytes], ...]
 
     if isinstance(key, rsa.RSAPrivateKeyWithSerialization):
         rsa_numbers = key.private_numbers()
         ln = (key.key_size // 8) // 2
 
-        e = Tlv(0x91, b"\x01\x00\x01")  # e=65537
-        p = Tlv(0x92, int2bytes(rsa_numbers.p, ln))
-        q = Tlv(0x93, int2bytes(rsa_numbers.q, ln))
-        values = (e, p, q)
+        values = (
+            (0x91, b"\x01\x00\x01"),  # e=65537
+            (0x92, int2bytes(rsa_numbers.p, ln)),
+            (0x93, int2bytes(rsa_numbers.q, ln)),
+        )
         if crt:
-            dp = Tlv(0x94, int2bytes(rsa_numbers.dmp1, ln))
-            dq = Tlv(0x95, int2bytes(rsa_numbers.dmq1, ln))
-            qinv = Tlv(0x96, int2bytes(rsa_numbers.iqmp, ln))
-            n = Tlv(0x97, int2bytes(rsa_numbers.public_numbers.n, 2 * ln))
-            values += (dp, dq, qinv, n)
+            values += (
+                (0x94, int2bytes(rsa_numbers.dmp1, ln)),
+                (0x95, int2bytes(rsa_numbers.dmq1, ln)),
+                (0x96, int2bytes(rsa_numbers.iqmp, ln)),
+                (0x97, int2bytes(rsa_numbers.public_numbers.n, 2 * ln)),
+            )
 
     elif isinstance(key, ec.EllipticCurvePrivateKeyWithSerialization):
         ec_numbers = key.private_numbers()
         ln = key.key_size // 8
 
-        privkey = Tlv(0x92, int2bytes(ec_numbers.private_value, ln))
-        values = (privkey,)
+        values = ((0x92, int2bytes(ec_numbers.private_value, ln)),)
 
     elif _get_curve_name(key) in ("ed25519", "x25519"):
-        privkey = Tlv(
-            0x92, key.private_bytes(Encoding.Raw, PrivateFormat.Raw, NoEncryption())
+        values = (
+            (0x92, key.private_bytes(Encoding.Raw, PrivateFormat.Raw, NoEncryption())),
         )
-        values = (privkey,)
 
-    return Tlv(0x4D, key_slot.crt + _pack_tlvs(values))
+    # Tags and lengths go in the header, followed by the concatenated values
+    writer = TlvWriter()
+    with writer.constructed(0x4D):
+        writer.add_raw(key_slot.crt)
+        with writer.constructed(0x7F48):
+            for tag, value in values:
+                writer.add_header(tag, len(value))
+        with writer.constructed(0x5F48):
+            for _, value in values:
+                writer.add_raw(value)
+    return writer.get_bytes()
 
 
 @unique
@@ -25,18 +25,26 @@
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
-from canokit.core import TRANSPORT
-from canokit.core.smartcard import SmartCardConnection
+from canokit.core import TRANSPORT, TimeoutError
+from canokit.core.smartcard import SmartCardConnection, CardResetError
+from canokit.core.trace import trace
 from canokit.management import USB_INTERFACE
 from ..base import YUBIKEY, YkmanDevice
 
-from smartcard import System
-from smartcard.Exceptions import CardConnectionException
-from smartcard.pcsc.PCSCExceptions import ListReadersException
-from smartcard.pcsc.PCSCContext import PCSCContext
+from smartcard import scard
+from smartcard.Exceptions import CardConnectionException, NoCardException
+from smartcard.pcsc.PCSCExceptions import (
+    EstablishContextException,
+    ListReadersException,
+)
+from smartcard.pcsc.PCSCReader import PCSCReader
 
 from fido2.pcsc import CtapPcscDevice
+from contextlib import contextmanager
+from queue import Queue
+from threading import Event, Lock, Thread
 from time import sleep
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 import subprocess  # nosec
 import logging
 
@@ -47,6 +55,202 @@ YK_READER_NAME = "yubico yubikey"
 CK_READER_NAME = "canokey"
 
 
+# Results indicating that the context is no longer usable, and must be re-established
+_CONTEXT_LOST = frozenset(
+    (
+        scard.SCARD_E_SERVICE_STOPPED,
+        scard.SCARD_E_NO_SERVICE,
+        scard.SCARD_E_INVALID_HANDLE,
+    )
+)
+_NO_CARD = frozenset((scard.SCARD_E_NO_SMARTCARD, scard.SCARD_W_REMOVED_CARD))
+
+
+def _connection_error(message, hresult):
+    if hresult in _NO_CARD:
+        return NoCardException(message, hresult)
+    return CardConnectionException(
+        f"{message}: {scard.SCardGetErrorMessage(hresult)}", hresult
+    )
+
+
+class ScardContext:
+    """A PC/SC context, shared by all readers and connections of the process.
+
+    The context is established on first use, and only re-established if the PC/SC
+    service has been stopped or the context has otherwise become invalid.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._hcontext = None
+
+    def _get(self):
+        with self._lock:
+            if self._hcontext is None:
+                hresult, hcontext = scard.SCardEstablishContext(scard.SCARD_SCOPE_USER)
+                if hresult != scard.SCARD_S_SUCCESS:
+                    raise EstablishContextException(hresult)
+                self._hcontext = hcontext
+            return self._hcontext
+
+    def _call(self, func, *args):
+        """Calls func(hcontext, *args), retrying once with a new context if lost."""
+        hcontext = self._get()
+        result = func(hcontext, *args)
+        if result[0] in _CONTEXT_LOST:
+            logger.debug("PC/SC context lost, re-establishing")
+            self.release(hcontext)
+            result = func(self._get(), *args)
+        return result
+
+    def release(self, hcontext=None) -> None:
+        """Release the context, a new one will be established when next needed."""
+        with self._lock:
+            if self._hcontext is not None and hcontext in (None, self._hcontext):
+                scard.SCardReleaseContext(self._hcontext)
+                self._hcontext = None
+
+    def list_readers(self) -> List[str]:
+        hresult, readers = self._call(scard.SCardListReaders, [])
+        if hresult == scard.SCARD_E_NO_READERS_AVAILABLE:
+            return []
+        if hresult != scard.SCARD_S_SUCCESS:
+            raise ListReadersException(hresult)
+        return list(readers)
+
+    def connect(self, reader_name: str) -> Tuple[int, int]:
+        """Connect to the card in a reader, returning the card handle and protocol."""
+        hresult, hcard, protocol = self._call(
+            scard.SCardConnect,
+            reader_name,
+            scard.SCARD_SHARE_SHARED,
+            scard.SCARD_PROTOCOL_T0 | scard.SCARD_PROTOCOL_T1,
+        )
+        if hresult != scard.SCARD_S_SUCCESS:
+            raise _connection_error("Unable to connect to card", hresult)
+        return hcard, protocol
+
+
+_context = ScardContext()
+
+
+class ScardReader:
+    """A PC/SC reader, identified by its name."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def createConnection(self):
+        """Create a pyscard CardConnection, for APIs which require one."""
+        return PCSCReader(self.name).createConnection()
+
+    def __repr__(self):
+        return f"ScardReader({self.name!r})"
+
+
+# Pseudo reader, used to be notified of readers being added or removed
+PNP_NOTIFICATION = "\\\\?PnP?\\Notification"
+
+# Polling interval, used when the PC/SC service doesn't support PNP_NOTIFICATION
+_READER_POLL_INTERVAL = 0.25
+
+
+class ScardMonitor:
+    """Waits for PC/SC readers to be added or removed, or cards to be inserted or
+    removed.
+
+    The monitor uses a context of its own, so that waiting doesn't hold up other
+    PC/SC calls, and so that cancel() only affects the monitor.
+    """
+
+    def __init__(self):
+        hresult, self._hcontext = scard.SCardEstablishContext(scard.SCARD_SCOPE_USER)
+        if hresult != scard.SCARD_S_SUCCESS:
+            raise EstablishContextException(hresult)
+        self._states: Dict[str, int] = {}
+        self._pnp = True
+        self._cancelled = Event()
+        self._refresh(self._list_readers())
+
+    def _list_readers(self) -> List[str]:
+        hresult, readers = scard.SCardListReaders(self._hcontext, [])
+        if hresult == scard.SCARD_E_NO_READERS_AVAILABLE:
+            return []
+        if hresult != scard.SCARD_S_SUCCESS:
+            raise ListReadersException(hresult)
+        return list(readers)
+
+    def _get_status_change(self, timeout: float, states):
+        hresult, new_states = scard.SCardGetStatusChange(
+            self._hcontext, int(timeout * 1000), states
+        )
+        if hresult in (scard.SCARD_E_TIMEOUT, scard.SCARD_E_CANCELLED):
+            return []
+        if hresult != scard.SCARD_S_SUCCESS:
+            raise _connection_error("Unable to get status change", hresult)
+        return new_states
+
+    def _refresh(self, readers: List[str]) -> None:
+        # Reads the current state of each reader, without waiting
+        states = [(r, self._states.get(r, scard.SCARD_STATE_UNAWARE)) for r in readers]
+        self._states = {}
+        if states:
+            for reader, state, _ in self._get_status_change(0, states):
+                self._states[reader] = state & ~scard.SCARD_STATE_CHANGED
+
+    def wait(self, timeout: float) -> bool:
+        """Wait up to timeout seconds for a change, returning True if there was one.
+
+        Returns early with False if the monitor is cancelled.
+        """
+        if self._cancelled.is_set():
+            return False
+        readers = self._list_readers()
+        if set(readers) != set(self._states):
+            self._refresh(readers)
+            return True
+
+        states = list(self._states.items())
+        if self._pnp:
+            # pcsc-lite compares the reader count in the high word to its own
+            states.append((PNP_NOTIFICATION, len(readers) << 16))
+        else:
+            timeout = min(timeout, _READER_POLL_INTERVAL)
+        if not states:
+            self._cancelled.wait(timeout)
+            return False
+
+        changed = False
+        for reader, state, _ in self._get_status_change(timeout, states):
+            if reader == PNP_NOTIFICATION:
+                if state & scard.SCARD_STATE_UNKNOWN:
+                    logger.debug("PC/SC reader notifications not supported, polling")
+                    self._pnp = False
+                elif state & scard.SCARD_STATE_CHANGED:
+                    changed = True
+            elif state & scard.SCARD_STATE_CHANGED:
+                self._states[reader] = state & ~scard.SCARD_STATE_CHANGED
+                changed = True
+
+        if not self._cancelled.is_set():
+            readers = self._list_readers()
+            if set(readers) != set(self._states):
+                self._refresh(readers)
+                changed = True
+        return changed
+
+    def cancel(self) -> None:
+        """Make a call to wait, ongoing or later, return as soon as possible."""
+        self._cancelled.set()
+        scard.SCardCancel(self._hcontext)
+
+    def close(self) -> None:
+        if self._hcontext is not None:
+            scard.SCardReleaseContext(self._hcontext)
+            self._hcontext = None
+
+
 # Figure out what the PID should be based on the reader name
 def _pid_from_name(name):
     name = name.lower()
@@ -98,33 +302,150 @@ class ScardYubiKeyDevice(YkmanDevice):
 
     def _open_smartcard_connection(self) -> SmartCardConnection:
         try:
-            return ScardSmartCardConnection(self.reader.createConnection())
+            return ScardSmartCardConnection(self.reader.name)
         except CardConnectionException as e:
             if kill_scdaemon():
-                return ScardSmartCardConnection(self.reader.createConnection())
+                return ScardSmartCardConnection(self.reader.name)
             raise e
 
 
+class _TransactionWaiter:
+    """Begins transactions on a card from a single thread, reused for the connection.
+
+    SCardBeginTransaction blocks until the card is available, so it is called from
+    this thread, letting the caller give up after a timeout. A transaction granted
+    after its caller gave up is ended right away.
+    """
+
+    def __init__(self, hcard: Optional[int]):
+        self._hcard = hcard
+        self._lock = Lock()
+        self._requests: "Queue[Optional[List[Any]]]" = Queue()
+        Thread(target=self._run, name="scard_transaction", daemon=True).start()
+
+    def _run(self) -> None:
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            hresult = scard.SCardBeginTransaction(self._hcard)
+            done, results, abandoned = request
+            with self._lock:
+                if not abandoned:
+                    results.append(hresult)
+                    done.set()
+                elif hresult == scard.SCARD_S_SUCCESS:
+                    scard.SCardEndTransaction(self._hcard, scard.SCARD_LEAVE_CARD)
+
+    def begin(self, timeout: float) -> int:
+        """Begin a transaction, returning the result of SCardBeginTransaction."""
+        done = Event()
+        results: List[int] = []
+        abandoned: List[bool] = []
+        self._requests.put([done, results, abandoned])
+        done.wait(timeout)
+        with self._lock:
+            if not results:
+                abandoned.append(True)
+                raise TimeoutError("Timed out waiting for exclusive access to card")
+        return results[0]
+
+    def close(self) -> None:
+        """Stop the thread, once it is done with any transaction it is waiting for."""
+        self._requests.put(None)
+
+
 class ScardSmartCardConnection(SmartCardConnection):
-    def __init__(self, connection):
-        self.connection = connection
-        connection.connect()
-        atr = connection.getATR()
-        self._transport = TRANSPORT.USB if atr[1] & 0xF0 == 0xF0 else TRANSPORT.NFC
+    """A connection to a card, using the PC/SC API directly."""
+
+    def __init__(self, reader_name: str):
+        self.reader_name = reader_name
+        self._transaction_depth = 0
+        self._waiter: Optional[_TransactionWaiter] = None
+        self._hcard: Optional[int]
+        self._hcard, protocol = _context.connect(reader_name)
+        self._pci = (
+            scard.SCARD_PCI_T0
+            if protocol == scard.SCARD_PROTOCOL_T0
+            else scard.SCARD_PCI_T1
+        )
+        hresult, _, _, _, atr = scard.SCardStatus(self._hcard)
+        if hresult != scard.SCARD_S_SUCCESS:
+            self.close()
+            raise _connection_error("Unable to read ATR", hresult)
+        self._atr = bytes(atr)
+        self._transport = (
+            TRANSPORT.USB if self._atr[1] & 0xF0 == 0xF0 else TRANSPORT.NFC
+        )
 
     @property
     def transport(self):
         return self._transport
 
+    @property
+    def atr(self):
+        return self._atr
+
     def close(self):
-        self.connection.disconnect()
+        if self._waiter is not None:
+            self._waiter.close()
+            self._waiter = None
+        if self._hcard is not None:
+            scard.SCardDisconnect(self._hcard, scard.SCARD_UNPOWER_CARD)
+            self._hcard = None
+
+    def is_present(self) -> bool:
+        """Check that the card is still present, and hasn't been reset."""
+        if self._hcard is None:
+            return False
+        return scard.SCardStatus(self._hcard)[0] == scard.SCARD_S_SUCCESS
 
     def send_and_receive(self, apdu):
         """Sends a command APDU and returns the response data and sw"""
-        logger.debug("SEND: %s", apdu.hex())
-        data, sw1, sw2 = self.connection.transmit(list(apdu))
-        logger.debug("RECV: %s SW=%02x%02x", bytes(data).hex(), sw1, sw2)
-        return bytes(data), sw1 << 8 | sw2
+        hresult, resp = scard.SCardTransmit(self._hcard, self._pci, list(apdu))
+        if hresult != scard.SCARD_S_SUCCESS:
+            if hresult == scard.SCARD_W_RESET_CARD:
+                raise self._card_reset()
+            raise _connection_error("Failed to transmit", hresult)
+        if len(resp) < 2:
+            raise CardConnectionException("Invalid response, missing status word")
+        data, sw = bytes(resp[:-2]), resp[-2] << 8 | resp[-1]
+        trace.record_apdu(apdu, data, sw, id(self))
+        return data, sw
+
+    def _card_reset(self) -> CardResetError:
+        # Acknowledge the reset, so that the handle can be used again
+        scard.SCardReconnect(
+            self._hcard,
+            scard.SCARD_SHARE_SHARED,
+            scard.SCARD_PROTOCOL_T0 | scard.SCARD_PROTOCOL_T1,
+            scard.SCARD_LEAVE_CARD,
+        )
+        self.reset_selection()
+        return CardResetError("The card was reset by another application")
+
+    @contextmanager
+    def transaction(self, timeout: float = 10.0) -> Iterator[None]:
+        if self._transaction_depth == 0:
+            self._begin_transaction(timeout)
+        self._transaction_depth += 1
+        try:
+            yield
+        finally:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0 and self._hcard is not None:
+                scard.SCardEndTransaction(self._hcard, scard.SCARD_LEAVE_CARD)
+
+    def _begin_transaction(self, timeout):
+        if self._waiter is None:
+            self._waiter = _TransactionWaiter(self._hcard)
+        hresult = self._waiter.begin(timeout)
+        if hresult == scard.SCARD_W_RESET_CARD:
+            raise self._card_reset()
+        if hresult != scard.SCARD_S_SUCCESS:
+            raise _connection_error("Unable to begin transaction", hresult)
+        # Other applications may have selected something else since our last command
+        self.reset_selection()
 
 
 def kill_scdaemon():
@@ -154,14 +475,7 @@ def kill_scdaemon():
 
 
 def list_readers():
-    try:
-        return System.readers()
-    except ListReadersException:
-        # If the PCSC system has restarted the context might be stale, try
-        # forcing a new context (This happens on Windows if the last reader is
-        # removed):
-        PCSCContext.instance = None
-        return System.readers()
+    return [ScardReader(name) for name in _context.list_readers()]
 
 
 def list_devices(name_filter=None):
@@ -26,7 +26,7 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 
-from canokit.core import Tlv, BadResponseError, NotSupportedError
+from canokit.core import Tlv, TlvWriter, BadResponseError, NotSupportedError
 from canokit.core.smartcard import ApduError, SW
 from canokit.piv import (
     PivSession,
@@ -261,65 +261,69 @@ def pivman_set_mgm_key(
     store_on_device: bool = False,
 ) -> None:
     """Set a new management key, while keeping PivmanData in sync."""
-    pivman = get_pivman_data(session)
-    pivman_prot = None
+    with session.protocol.connection.transaction():
+        pivman = get_pivman_data(session)
+        pivman_prot = None
 
-    if store_on_device or (not store_on_device and pivman.has_stored_key):
-        # Ensure we have access to protected data before overwriting key
-        try:
-            pivman_prot = get_pivman_protected_data(session)
-        except Exception as e:
-            logger.debug("Failed to initialize protected pivman data", exc_info=e)
-            if store_on_device:
-                raise
+        if store_on_device or (not store_on_device and pivman.has_stored_key):
+            # Ensure we have access to protected data before overwriting key
+            try:
+                pivman_prot = get_pivman_protected_data(session)
+            except Exception as e:
+                logger.debug("Failed to initialize protected pivman data", exc_info=e)
+                if store_on_device:
+                    raise
 
-    # Set the new management key
-    session.set_management_key(algorithm, new_key, touch)
+        # Set the new management key
+        session.set_management_key(algorithm, new_key, touch)
 
-    if pivman.has_derived_key:
-        # Clear salt for old derived keys.
-        pivman.salt = None
-
-    # Set flag for stored or not stored key.
-    pivman.mgm_key_protected = store_on_device
-
-    # Update readable pivman data
-    session.put_object(OBJECT_ID_PIVMAN_DATA, pivman.get_bytes())
-
-    if pivman_prot is not None:
-        if store_on_device:
-            # Store key in protected pivman data
-            pivman_prot.key = new_key
-            session.put_object(OBJECT_ID_PIVMAN_PROTECTED_DATA, pivman_prot.get_bytes())
-        elif pivman_prot.key:
-            # If new key should not be stored and there is an old stored key,
-            # try to clear it.
-            try:
-                pivman_prot.key = None
+        if pivman.has_derived_key:
+            # Clear salt for old derived keys.
+            pivman.salt = None
+
+        # Set flag for stored or not stored key.
+        pivman.mgm_key_protected = store_on_device
+
+        # Update readable pivman data
+        session.put_object(OBJECT_ID_PIVMAN_DATA, pivman.get_bytes())
+
+        if pivman_prot is not None:
+            if store_on_device:
+                # Store key in protected pivman data
+                pivman_prot.key = new_key
                 session.put_object(
-                    OBJECT_ID_PIVMAN_PROTECTED_DATA,
-                    pivman_prot.get_bytes(),
+                    OBJECT_ID_PIVMAN_PROTECTED_DATA, pivman_prot.get_bytes()
                 )
-            except ApduError as e:
-                logger.debug("No PIN provided, can't clear key...", exc_info=e)
+            elif pivman_prot.key:
+                # If new key should not be stored and there is an old stored key,
+                # try to clear it.
+                try:
+                    pivman_prot.key = None
+                    session.put_object(
+                        OBJECT_ID_PIVMAN_PROTECTED_DATA,
+                        pivman_prot.get_bytes(),
+                    )
+                except ApduError as e:
+                    logger.debug("No PIN provided, can't clear key...", exc_info=e)
 
 
 def pivman_change_pin(session: PivSession, old_pin: str, new_pin: str) -> None:
     """Change the PIN, while keeping PivmanData in sync."""
-    session.change_pin(old_pin, new_pin)
-
-    pivman = get_pivman_data(session)
-    if pivman.has_derived_key:
-        session.authenticate(
-            MANAGEMENT_KEY_TYPE.TDES,
-            derive_management_key(old_pin, cast(bytes, pivman.salt)),
-        )
-        session.verify_pin(new_pin)
-        new_salt = os.urandom(16)
-        new_key = derive_management_key(new_pin, new_salt)
-        session.set_management_key(MANAGEMENT_KEY_TYPE.TDES, new_key)
-        pivman.salt = new_salt
-        session.put_object(OBJECT_ID_PIVMAN_DATA, pivman.get_bytes())
+    with session.protocol.connection.transaction():
+        session.change_pin(old_pin, new_pin)
+
+        pivman = get_pivman_data(session)
+        if pivman.has_derived_key:
+            session.authenticate(
+                MANAGEMENT_KEY_TYPE.TDES,
+                derive_management_key(old_pin, cast(bytes, pivman.salt)),
+            )
+            session.verify_pin(new_pin)
+            new_salt = os.urandom(16)
+            new_key = derive_management_key(new_pin, new_salt)
+            session.set_management_key(MANAGEMENT_KEY_TYPE.TDES, new_key)
+            pivman.salt = new_salt
+            session.put_object(OBJECT_ID_PIVMAN_DATA, pivman.get_bytes())
 
 
 def list_certificates(session: PivSession) -> Mapping[SLOT, Optional[x509.Certificate]]:
@@ -394,30 +398,34 @@ def generate_chuid() -> bytes:
     EXPIRY = b"\x32\x30\x33\x30\x30\x31\x30\x31"
 
     return (
-        Tlv(0x30, FASC_N)
-        + Tlv(0x34, os.urandom(16))
-        + Tlv(0x35, EXPIRY)
-        + Tlv(0x3E)
-        + Tlv(TAG_LRC)
+        TlvWriter()
+        .add(0x30, FASC_N)
+        .add(0x34, os.urandom(16))
+        .add(0x35, EXPIRY)
+        .add(0x3E)
+        .add(TAG_LRC)
+        .get_bytes()
     )
 
 
 def generate_ccc() -> bytes:
     """Generates a CCC (Card Capability Container)."""
     return (
-        Tlv(0xF0, b"\xa0\x00\x00\x01\x16\xff\x02" + os.urandom(14))
-        + Tlv(0xF1, b"\x21")
-        + Tlv(0xF2, b"\x21")
-        + Tlv(0xF3)
-        + Tlv(0xF4, b"\x00")
-        + Tlv(0xF5, b"\x10")
-        + Tlv(0xF6)
-        + Tlv(0xF7)
-        + Tlv(0xFA)
-        + Tlv(0xFB)
-        + Tlv(0xFC)
-        + Tlv(0xFD)
-        + Tlv(TAG_LRC)
+        TlvWriter()
+        .add(0xF0, b"\xa0\x00\x00\x01\x16\xff\x02" + os.urandom(14))
+        .add(0xF1, b"\x21")
+        .add(0xF2, b"\x21")
+        .add(0xF3)
+        .add(0xF4, b"\x00")
+        .add(0xF5, b"\x10")
+        .add(0xF6)
+        .add(0xF7)
+        .add(0xFA)
+        .add(0xFB)
+        .add(0xFC)
+        .add(0xFD)
+        .add(TAG_LRC)
+        .get_bytes()
     )
 
 
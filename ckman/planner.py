@@ -0,0 +1,260 @@
+# Copyright (c) 2020 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""Ordering of connection types, by how well reading device info works over them.
+
+The time taken by read_info, and whether it failed, is recorded for each interface of
+each device model (PID) and firmware version. The statistics are kept in the
+"interfaces" AppData file, so that they carry over between invocations, and are used
+by connect_to_device to try the interfaces expected to be fastest first.
+"""
+
+from canokit.core import Connection, Version
+from .base import PID
+from .settings import AppData
+
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Tuple, Type
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Name of the AppData file holding the statistics
+PLANNER_DATA = "interfaces"
+
+# Expected time (in seconds) to read device info over an interface without statistics
+DEFAULT_COST = 1.0
+
+# Time (in seconds) added to the expected cost, per failure rate
+FAILURE_COST = 5.0
+
+# Statistics are only written back once the expected cost of an interface has moved
+# by more than this fraction since it was last read or written
+SAVE_THRESHOLD = 0.1
+
+
+class InterfaceStatistics:
+    """Counts and durations of reading device info over one interface."""
+
+    def __init__(self, count: int = 0, failures: int = 0, total: float = 0.0):
+        self.count = count
+        self.failures = failures
+        self.total = total  # Time spent on successful reads
+
+    def add(self, duration: float, failed: bool = False) -> None:
+        self.count += 1
+        if failed:
+            self.failures += 1
+        else:
+            self.total += duration
+
+    def merge(self, other: "InterfaceStatistics") -> None:
+        self.count += other.count
+        self.failures += other.failures
+        self.total += other.total
+
+    @property
+    def mean(self) -> float:
+        """The mean duration of successful reads."""
+        successes = self.count - self.failures
+        return self.total / successes if successes else 0.0
+
+    @property
+    def failure_rate(self) -> float:
+        return self.failures / self.count if self.count else 0.0
+
+    def cost(self) -> float:
+        """The expected time to read device info, penalizing failures."""
+        if not self.count:
+            return DEFAULT_COST
+        mean = self.mean if self.count > self.failures else DEFAULT_COST
+        return mean + self.failure_rate * FAILURE_COST
+
+    def as_dict(self) -> dict:
+        return {"count": self.count, "failures": self.failures, "total": self.total}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "InterfaceStatistics":
+        return cls(data["count"], data["failures"], data["total"])
+
+
+_Key = Tuple[str, str, str]  # PID name, firmware version, connection type name
+
+
+def _pid_name(pid: Optional[PID]) -> str:
+    return pid.name if pid is not None else "NFC"
+
+
+def _version_string(version: Optional[Version]) -> str:
+    return "%d.%d.%d" % version if version else "unknown"
+
+
+class InterfacePlanner:
+    """Keeps statistics of reading device info, and orders connection types by them.
+
+    :param name: The name of the AppData file to keep statistics in, or None to only
+        keep them in memory.
+    """
+
+    def __init__(self, name: Optional[str] = PLANNER_DATA):
+        self.name = name
+        self._lock = Lock()
+        self._stats: Dict[_Key, InterfaceStatistics] = {}
+        self._saved_costs: Dict[_Key, float] = {}
+        self._loaded = False
+        self._dirty = False
+
+    def _load(self) -> None:
+        # Called with the lock held
+        if self._loaded:
+            return
+        self._loaded = True
+        if self.name is None:
+            return
+        try:
+            data = AppData(self.name)
+            for pid, versions in data.items():
+                for version, interfaces in versions.items():
+                    for connection_type, stats in interfaces.items():
+                        key = (pid, version, connection_type)
+                        self._stats[key] = InterfaceStatistics.from_dict(stats)
+        except Exception as e:
+            logger.debug("Unable to read interface statistics", exc_info=e)
+        self._saved_costs = {k: s.cost() for k, s in self._stats.items()}
+
+    def reset(self) -> None:
+        """Forget statistics in memory, they are read from the file when next used."""
+        with self._lock:
+            self._stats.clear()
+            self._saved_costs.clear()
+            self._loaded = False
+            self._dirty = False
+
+    def record(
+        self,
+        pid: Optional[PID],
+        version: Optional[Version],
+        connection_type: Type[Connection],
+        duration: float,
+        failed: bool = False,
+    ) -> None:
+        """Record reading device info over an interface of a device."""
+        key = (_pid_name(pid), _version_string(version), connection_type.__name__)
+        with self._lock:
+            self._load()
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = InterfaceStatistics()
+            stats.add(duration, failed)
+            saved = self._saved_costs.get(key)
+            if saved is None or abs(stats.cost() - saved) > saved * SAVE_THRESHOLD:
+                self._dirty = True
+
+    def get(
+        self, pid: Optional[PID], connection_type: Type[Connection]
+    ) -> InterfaceStatistics:
+        """Get the statistics for an interface of a device model, for all firmware."""
+        pid_name, type_name = _pid_name(pid), connection_type.__name__
+        result = InterfaceStatistics()
+        with self._lock:
+            self._load()
+            for (p, _, t), stats in self._stats.items():
+                if p == pid_name and t == type_name:
+                    result.merge(stats)
+        return result
+
+    def order(
+        self,
+        connection_types: Iterable[Type[Connection]],
+        pids: Iterable[Optional[PID]],
+    ) -> List[Type[Connection]]:
+        """Order connection types by their expected cost for the given device models.
+
+        Connection types with the same cost keep their given order.
+        """
+        pids = list(pids)
+
+        def cost(connection_type):
+            stats = InterfaceStatistics()
+            for pid in pids:
+                stats.merge(self.get(pid, connection_type))
+            return stats.cost()
+
+        return sorted(connection_types, key=cost)
+
+    def save(self) -> None:
+        """Write the statistics to the AppData file, if they changed significantly.
+
+        Recorded reads which moved no interface's expected cost by more than
+        SAVE_THRESHOLD are kept in memory, and written along with the next change.
+        """
+        with self._lock:
+            if not self._dirty or self.name is None:
+                return
+            try:
+                data = AppData(self.name)
+                data.clear()
+                for (pid, version, type_name), stats in self._stats.items():
+                    interfaces = data.setdefault(pid, {}).setdefault(version, {})
+                    interfaces[type_name] = stats.as_dict()
+                data.write()
+                self._saved_costs = {k: s.cost() for k, s in self._stats.items()}
+                self._dirty = False
+            except Exception as e:
+                logger.debug("Unable to write interface statistics", exc_info=e)
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, dict]]]:
+        """Get all statistics, as a JSON serializable dict.
+
+        The dict is keyed by PID name, then firmware version, then connection type.
+        """
+        result: Dict[str, Dict[str, Dict[str, dict]]] = {}
+        with self._lock:
+            self._load()
+            for (pid, version, type_name), stats in sorted(self._stats.items()):
+                interfaces = result.setdefault(pid, {}).setdefault(version, {})
+                interfaces[type_name] = stats.as_dict()
+        return result
+
+    def format(self) -> str:
+        """Format a summary table of the statistics."""
+        lines = [
+            "PID             FIRMWARE  INTERFACE            COUNT  FAILED  MEAN ms"
+        ]
+        with self._lock:
+            self._load()
+            for (pid, version, type_name), stats in sorted(self._stats.items()):
+                lines.append(
+                    f"{pid:<15} {version:<9} {type_name:<20} {stats.count:>5} "
+                    f"{stats.failures:>7} {stats.mean * 1000:>8.1f}"
+                )
+        return "\n".join(lines)
+
+
+# The planner used by connect_to_device
+planner = InterfacePlanner()
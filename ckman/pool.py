@@ -0,0 +1,368 @@
+# Copyright (c) 2020 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""Reuse of open connections, for long running processes.
+
+A ConnectionPool keeps connections open after use, keyed by the fingerprint of the
+device (reader name or HID path) and the connection type. Connections are leased out,
+and returned to the pool instead of being closed:
+
+    pool = ConnectionPool()
+    with pool.lease(device, SmartCardConnection) as connection:
+        session = OathSession(connection)
+        ...
+"""
+
+from canokit.core import Connection, CommandError, TimeoutError
+from canokit.core.fido import FidoConnection
+from canokit.core.otp import OtpConnection
+from canokit.core.smartcard import SmartCardConnection
+from canokit.management import DeviceInfo
+from .base import YkmanDevice
+from .device import connect_to_device
+from .pcsc import ScardSmartCardConnection
+from fido2.hid import CtapHidDevice
+
+from contextlib import contextmanager
+from threading import Condition
+from time import monotonic
+from typing import (
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    cast,
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def check_connection(connection: Connection) -> bool:
+    """Check that an idle connection can still be used, without side effects.
+
+    Smart card connections check that the card is still present, OTP connections read
+    the status report, and FIDO HID connections send a CTAPHID PING. Other
+    connections are not validated.
+    """
+    try:
+        if isinstance(connection, ScardSmartCardConnection):
+            return connection.is_present()
+        if isinstance(connection, OtpConnection):
+            connection.receive()  # Reads the status report
+        if isinstance(connection, CtapHidDevice):
+            return connection.ping(b"ping") == b"ping"
+        return True
+    except Exception as e:
+        logger.debug("Pooled connection failed health check", exc_info=e)
+        return False
+
+
+_Key = Tuple[Hashable, type]
+
+# FidoConnection is only registered as a virtual subclass of Connection
+_CONNECTION_TYPES = cast(
+    List[Type[Connection]], [SmartCardConnection, OtpConnection, FidoConnection]
+)
+
+
+class ConnectionPool:
+    """A pool of open connections to YubiKeys, keyed by device and connection type.
+
+    :param max_connections: The maximum number of open connections, leased or idle.
+    :param idle_timeout: Idle connections older than this (in seconds) are closed.
+    :param health_check: Called on idle connections before they are leased out again.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 16,
+        idle_timeout: float = 60.0,
+        health_check: Callable[[Connection], bool] = check_connection,
+    ):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.health_check = health_check
+        self._condition = Condition()
+        self._idle: Dict[_Key, List[Tuple[Connection, float]]] = {}
+        self._leased: Dict[int, Tuple[_Key, Connection]] = {}
+        self._devices: Dict[Tuple[int, type], Tuple[YkmanDevice, DeviceInfo]] = {}
+        self._closed = False
+
+    @property
+    def open_connections(self) -> int:
+        with self._condition:
+            return len(self._leased) + sum(len(c) for c in self._idle.values())
+
+    def _take_idle(self, key: _Key) -> Optional[Connection]:
+        idle = self._idle.get(key)
+        if idle:
+            connection, _ = idle.pop()
+            if not idle:
+                del self._idle[key]
+            return connection
+        return None
+
+    def _evict(self, max_age: float) -> List[Connection]:
+        # Removes idle connections unused for longer than max_age, returns them
+        now = monotonic()
+        evicted = []
+        for key in list(self._idle):
+            keep = []
+            for connection, last_used in self._idle[key]:
+                if now - last_used > max_age:
+                    evicted.append(connection)
+                else:
+                    keep.append((connection, last_used))
+            if keep:
+                self._idle[key] = keep
+            else:
+                del self._idle[key]
+        return evicted
+
+    def _evict_oldest(self) -> Optional[Connection]:
+        oldest = None
+        for key, idle in self._idle.items():
+            for i, (_, last_used) in enumerate(idle):
+                if oldest is None or last_used < oldest[2]:
+                    oldest = (key, i, last_used)
+        if oldest is None:
+            return None
+        key, i, _ = oldest
+        connection = self._idle[key].pop(i)[0]
+        if not self._idle[key]:
+            del self._idle[key]
+        return connection
+
+    @staticmethod
+    def _close(connections: Iterable[Connection]) -> None:
+        for connection in connections:
+            try:
+                connection.close()
+            except Exception as e:
+                logger.debug("Failed closing pooled connection", exc_info=e)
+
+    def checkout(
+        self,
+        device: YkmanDevice,
+        connection_type: Type[Connection],
+        timeout: Optional[float] = None,
+    ) -> Connection:
+        """Get an open connection to a device, reusing an idle one if possible.
+
+        The connection must be given back using checkin, and not closed.
+
+        :param timeout: How long to wait when max_connections are leased, in seconds.
+            If None, wait indefinitely.
+        """
+        key = (device.fingerprint, connection_type)
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._condition:
+            if self._closed:
+                raise ValueError("Connection pool is closed")
+            to_close = self._evict(self.idle_timeout)
+            while True:
+                connection = self._take_idle(key)
+                if connection is not None:
+                    break
+                if self.open_connections < self.max_connections:
+                    break
+                oldest = self._evict_oldest()
+                if oldest is not None:
+                    to_close.append(oldest)
+                    continue
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._close(to_close)
+                    raise TimeoutError("No connection available in pool")
+                self._condition.wait(remaining)
+            # Hold the slot while checking or opening the connection
+            slot = object()
+            self._leased[id(slot)] = (key, slot)  # type: ignore
+        self._close(to_close)
+
+        try:
+            if connection is not None and not self.health_check(connection):
+                self._close([connection])
+                connection = None
+            if isinstance(connection, SmartCardConnection):
+                # Another application may have selected a different applet since
+                connection.reset_selection()
+            if connection is None:
+                connection = device.open_connection(connection_type)
+        finally:
+            with self._condition:
+                del self._leased[id(slot)]
+                if connection is not None:
+                    self._leased[id(connection)] = (key, connection)
+                else:
+                    self._condition.notify()
+        return connection
+
+    def checkin(self, connection: Connection, discard: bool = False) -> None:
+        """Give back a leased connection, to be reused or closed if discard is set.
+
+        Connections given back after the pool is closed are closed.
+        """
+        with self._condition:
+            key, _ = self._leased.pop(id(connection))
+            discard = discard or self._closed
+            if not discard:
+                self._idle.setdefault(key, []).append((connection, monotonic()))
+            self._condition.notify()
+        if discard:
+            self._close([connection])
+
+    @contextmanager
+    def _leased_block(self, connection: Connection) -> Iterator[None]:
+        # Closes the connection if the block fails with anything but a CommandError
+        try:
+            yield
+        except CommandError:
+            self.checkin(connection)
+            raise
+        except BaseException:
+            self.checkin(connection, discard=True)
+            raise
+        else:
+            self.checkin(connection)
+
+    @contextmanager
+    def lease(
+        self,
+        device: YkmanDevice,
+        connection_type: Type[Connection],
+        timeout: Optional[float] = None,
+    ) -> Iterator[Connection]:
+        """Lease a connection for the duration of a with block.
+
+        If the block fails with anything other than a CommandError from the device,
+        the state of the connection is unknown, and it is closed instead of reused.
+        """
+        connection = self.checkout(device, connection_type, timeout)
+        with self._leased_block(connection):
+            yield connection
+
+    def _reserve(self, deadline: Optional[float]) -> object:
+        # Holds a slot for a connection about to be opened, evicting idle connections
+        # or waiting for a slot to become available. Called with the lock held.
+        to_close = []
+        try:
+            while self.open_connections >= self.max_connections:
+                oldest = self._evict_oldest()
+                if oldest is not None:
+                    to_close.append(oldest)
+                    continue
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("No connection available in pool")
+                self._condition.wait(remaining)
+            slot = object()
+            self._leased[id(slot)] = ((None, object), slot)  # type: ignore
+            return slot
+        finally:
+            self._close(to_close)
+
+    def _find(self, serial, connection_types, timeout):
+        deadline = None if timeout is None else monotonic() + timeout
+        for connection_type in connection_types:
+            with self._condition:
+                known = self._devices.get((serial, connection_type))
+            if known:
+                device, info = known
+                try:
+                    return self.checkout(device, connection_type, timeout), device, info
+                except TimeoutError:
+                    raise  # The pool is full, connecting anew would exceed it
+                except Exception as e:
+                    logger.debug("Remembered device not available", exc_info=e)
+                    with self._condition:
+                        if self._devices.get((serial, connection_type)) is known:
+                            del self._devices[(serial, connection_type)]
+
+        with self._condition:
+            slot = self._reserve(deadline)
+        connection = None
+        try:
+            connection, device, info = connect_to_device(serial, connection_types)
+        finally:
+            with self._condition:
+                del self._leased[id(slot)]
+                if connection is not None:
+                    connection_type = next(
+                        t for t in connection_types if isinstance(connection, t)
+                    )
+                    self._leased[id(connection)] = (
+                        (device.fingerprint, connection_type),
+                        connection,
+                    )
+                    if serial and not self._closed:
+                        self._devices[(serial, connection_type)] = (device, info)
+                else:
+                    self._condition.notify()
+        return connection, device, info
+
+    @contextmanager
+    def connect(
+        self,
+        serial: Optional[int] = None,
+        connection_types: Iterable[Type[Connection]] = _CONNECTION_TYPES,
+        timeout: Optional[float] = None,
+    ) -> Iterator[Tuple[Connection, YkmanDevice, DeviceInfo]]:
+        """Lease a connection to a YubiKey, found like connect_to_device does.
+
+        When a serial is given, the device it was found on is remembered, so that
+        later calls can reuse its connections without enumerating devices. The
+        DeviceInfo is the one read when the device was first found.
+        """
+        connection, device, info = self._find(serial, list(connection_types), timeout)
+        with self._leased_block(connection):
+            yield connection, device, info
+
+    def evict_idle(self, max_age: Optional[float] = None) -> None:
+        """Close idle connections unused for max_age seconds (default idle_timeout)."""
+        with self._condition:
+            to_close = self._evict(self.idle_timeout if max_age is None else max_age)
+        self._close(to_close)
+
+    def close(self) -> None:
+        """Close all idle connections. Leased connections are closed on checkin."""
+        with self._condition:
+            self._closed = True
+            self._devices.clear()
+        self.evict_idle(-1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        self.close()
@@ -0,0 +1,326 @@
+# Copyright (c) 2020 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Programming Yubico OTP credentials to many YubiKeys.
+
+A YubiOtpProvisioner programs a slot of each YubiKey attached, or hot-plugged, with a
+Yubico OTP credential. The public ID is derived from the serial number, and the
+private ID and AES key are random. Keys are programmed in parallel, and each
+credential is written to a CSV or JSON Lines file once programmed:
+
+    with RecordWriter("credentials.csv") as writer:
+        provisioner = YubiOtpProvisioner(SLOT.ONE, writer)
+        programmed, failed = provisioner.run()
+"""
+
+from canokit.core import Connection
+from canokit.core.otp import OtpConnection, modhex_encode
+from canokit.yubiotp import SLOT, YubiOtpSession, YubiOtpSlotConfiguration
+from .base import YkmanDevice
+from .device import watch
+
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Full
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import (
+    Callable,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    TextIO,
+    Tuple,
+    Type,
+)
+import json
+import os
+import struct
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def serial_public_id(serial: int) -> bytes:
+    """Get the 6 byte public ID derived from a serial number."""
+    return b"\xff\x00" + struct.pack(">I", serial)
+
+
+class YubiOtpRecord(NamedTuple):
+    """A Yubico OTP credential programmed to a YubiKey."""
+
+    serial: int
+    public_id: bytes
+    private_id: bytes
+    key: bytes
+
+    def as_row(self) -> List[str]:
+        """The fields as written to a file: the public ID in modhex, the rest in hex."""
+        return [
+            str(self.serial),
+            modhex_encode(self.public_id),
+            self.private_id.hex(),
+            self.key.hex(),
+        ]
+
+
+class UnrecordedCredentialError(Exception):
+    """A YubiKey was programmed, but writing its record failed.
+
+    The slot has been overwritten, and the credential is only kept in record.
+    """
+
+    def __init__(self, record: YubiOtpRecord):
+        super().__init__(f"YubiKey {record.serial} programmed, but not recorded")
+        self.record = record
+
+
+class RecordWriter:
+    """Appends YubiOtpRecords to a file, syncing them to disk in batches.
+
+    Each record is flushed to the OS as it is written, and the file is synced to
+    disk every sync_count records, or when a record is written sync_interval seconds
+    after the last sync, and when closed.
+
+    :param fname: The file to append to. If it ends with .jsonl, one JSON object is
+        written per record, otherwise a line of comma separated values.
+    """
+
+    def __init__(self, fname: str, sync_count: int = 16, sync_interval: float = 1.0):
+        self.jsonl = fname.endswith(".jsonl")
+        self.sync_count = sync_count
+        self.sync_interval = sync_interval
+        self._file: TextIO = open(fname, "a")
+        self._lock = Lock()
+        self._pending = 0
+        self._synced = monotonic()
+
+    def write(self, record: YubiOtpRecord) -> None:
+        serial, public_id, private_id, key = record.as_row()
+        if self.jsonl:
+            line = json.dumps(
+                {
+                    "serial": record.serial,
+                    "public_id": public_id,
+                    "private_id": private_id,
+                    "key": key,
+                }
+            )
+        else:
+            line = ",".join((serial, public_id, private_id, key))
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self._pending += 1
+            if (
+                self._pending >= self.sync_count
+                or monotonic() - self._synced >= self.sync_interval
+            ):
+                self._sync()
+
+    def _sync(self) -> None:
+        # Called with the lock held
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._synced = monotonic()
+
+    def sync(self) -> None:
+        """Sync all written records to disk."""
+        with self._lock:
+            if self._pending:
+                self._sync()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._pending:
+                self._sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        self.close()
+
+
+def _random_credential() -> Tuple[bytes, bytes]:
+    # A private ID and AES key
+    return os.urandom(6), os.urandom(16)
+
+
+class _CredentialSource:
+    """Generates random private IDs and keys ahead of use, in a background thread."""
+
+    def __init__(self, size: int = 64):
+        self._queue: Queue = Queue(size)
+        self._stopped = Event()
+        self._thread = Thread(target=self._generate, daemon=True)
+        self._thread.start()
+
+    def _generate(self):
+        while not self._stopped.is_set():
+            credential = _random_credential()
+            while not self._stopped.is_set():
+                try:
+                    self._queue.put(credential, timeout=0.1)
+                    break
+                except Full:
+                    pass
+
+    def get(self) -> Tuple[bytes, bytes]:
+        """Get a (private ID, key) pair."""
+        return self._queue.get()
+
+    def close(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+
+ProvisioningResult = Tuple[List[YubiOtpRecord], List[Tuple[YkmanDevice, Exception]]]
+
+
+class YubiOtpProvisioner:
+    """Programs a Yubico OTP credential to a slot of many YubiKeys, in parallel.
+
+    A failure to program one YubiKey doesn't affect the others. Each YubiKey is
+    programmed at most once, identified by its serial number.
+
+    :param slot: The slot to program, overwriting any existing configuration.
+    :param writer: Where to write the programmed credentials.
+    :param access_code: The access code of the slot, kept for the new configuration.
+    :param append_cr: Send an Enter keystroke after emitting the OTP.
+    :param workers: The number of YubiKeys to program at the same time.
+    :param connection_type: The type of connection to program the YubiKeys over.
+    :param on_done: Called with each YubiKey, and its record or the error raised.
+    """
+
+    def __init__(
+        self,
+        slot: SLOT,
+        writer: RecordWriter,
+        access_code: Optional[bytes] = None,
+        append_cr: bool = True,
+        workers: int = 8,
+        connection_type: Type[Connection] = OtpConnection,
+        on_done: Optional[
+            Callable[[YkmanDevice, Optional[YubiOtpRecord], Optional[Exception]], None]
+        ] = None,
+    ):
+        self.slot = slot
+        self.writer = writer
+        self.access_code = access_code
+        self.append_cr = append_cr
+        self.workers = workers
+        self.connection_type = connection_type
+        self.on_done = on_done
+        self._serials: Set[int] = set()
+        self._lock = Lock()
+
+    def program(
+        self, device: YkmanDevice, credentials: Optional[_CredentialSource] = None
+    ) -> YubiOtpRecord:
+        """Program a single YubiKey, and write its record.
+
+        If writing the record fails, UnrecordedCredentialError is raised.
+        """
+        with device.open_connection(self.connection_type) as connection:
+            session = YubiOtpSession(connection)
+            serial = session.get_serial()
+            with self._lock:
+                if serial in self._serials:
+                    raise ValueError(f"YubiKey {serial} has already been programmed")
+                self._serials.add(serial)
+            private_id, key = credentials.get() if credentials else _random_credential()
+            record = YubiOtpRecord(serial, serial_public_id(serial), private_id, key)
+            try:
+                session.put_configuration(
+                    self.slot,
+                    YubiOtpSlotConfiguration(
+                        record.public_id, private_id, key
+                    ).append_cr(self.append_cr),
+                    self.access_code,
+                    self.access_code,
+                )
+            except Exception:
+                with self._lock:
+                    self._serials.discard(serial)
+                raise
+        try:
+            self.writer.write(record)
+        except Exception as e:
+            raise UnrecordedCredentialError(record) from e
+        return record
+
+    def run(
+        self,
+        timeout: Optional[float] = 0,
+        devices: Optional[Iterable[YkmanDevice]] = None,
+    ) -> ProvisioningResult:
+        """Program YubiKeys as they are found, until timeout.
+
+        With the default timeout of 0, only the YubiKeys already attached are
+        programmed. With a timeout of None, hot-plugged YubiKeys are programmed until
+        interrupted.
+
+        :param devices: Program these devices, instead of looking for YubiKeys.
+        """
+        programmed: List[YubiOtpRecord] = []
+        failed: List[Tuple[YkmanDevice, Exception]] = []
+        credentials = _CredentialSource()
+
+        def program(device):
+            try:
+                record = self.program(device, credentials)
+            except Exception as e:
+                if isinstance(e, UnrecordedCredentialError):
+                    logger.error(str(e), exc_info=e)
+                else:
+                    logger.debug("Failed programming YubiKey", exc_info=e)
+                failed.append((device, e))
+                if self.on_done:
+                    self.on_done(device, None, e)
+            else:
+                programmed.append(record)
+                if self.on_done:
+                    self.on_done(device, record, None)
+
+        if devices is None:
+            devices = (
+                event.device
+                for event in watch(timeout, [self.connection_type])
+                if event.attached
+            )
+        try:
+            with ThreadPoolExecutor(self.workers) as executor:
+                for device in devices:
+                    executor.submit(program, device)
+        finally:
+            credentials.close()
+            self.writer.sync()
+        return programmed, failed
@@ -0,0 +1,256 @@
+# Copyright (c) 2020 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""Recording and replaying of raw device traffic.
+
+The Recording*Connection classes wrap an open connection and write every exchange to
+a file. The Replay*Connection classes read such a file back, and act as a device which
+responds exactly as the recorded one did, optionally with the recorded latency.
+"""
+
+from canokit.core import TRANSPORT
+from canokit.core.otp import OtpConnection
+from canokit.core.smartcard import SmartCardConnection
+
+from time import perf_counter, sleep
+from typing import BinaryIO, List, NamedTuple, Optional, Tuple, Union
+import struct
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC = b"CKREC\x01"
+
+KIND_INFO = 0  # sent: transport, received: ATR (if any)
+KIND_APDU = 1  # sent: command APDU, received: response data, sw: status word
+KIND_OTP_SEND = 2  # sent: feature report
+KIND_OTP_RECEIVE = 3  # received: feature report
+
+# kind, timestamp, duration, len(sent), len(received), sw
+_HEADER = struct.Struct("<BddIIH")
+
+
+class Record(NamedTuple):
+    """A single recorded exchange, timestamps are in seconds since recording start."""
+
+    kind: int
+    timestamp: float
+    duration: float
+    sent: bytes
+    received: bytes
+    sw: int = 0
+
+
+def read_records(fd: BinaryIO) -> List[Record]:
+    """Read all records from a recording."""
+    if fd.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a recording file")
+    records: List[Record] = []
+    while True:
+        header = fd.read(_HEADER.size)
+        if not header:
+            return records
+        if len(header) != _HEADER.size:
+            raise ValueError("Truncated recording")
+        kind, timestamp, duration, n_sent, n_received, sw = _HEADER.unpack(header)
+        sent = fd.read(n_sent)
+        received = fd.read(n_received)
+        if len(sent) + len(received) != n_sent + n_received:
+            raise ValueError("Truncated recording")
+        records.append(Record(kind, timestamp, duration, sent, received, sw))
+
+
+def load_records(fname: str) -> List[Record]:
+    """Read all records from a recording file."""
+    with open(fname, "rb") as fd:
+        return read_records(fd)
+
+
+class _Recorder:
+    def __init__(self, fname: str):
+        self._fd = open(fname, "wb")
+        self._fd.write(MAGIC)
+        self._start = perf_counter()
+
+    def write(self, kind, start, sent=b"", received=b"", sw=0):
+        end = perf_counter()
+        self._fd.write(
+            _HEADER.pack(
+                kind, start - self._start, end - start, len(sent), len(received), sw
+            )
+        )
+        self._fd.write(sent)
+        self._fd.write(received)
+
+    def close(self):
+        self._fd.close()
+
+
+class _Player:
+    def __init__(self, source: Union[str, List[Record]], latency: bool):
+        self.records = load_records(source) if isinstance(source, str) else source
+        self._latency = latency
+        self._index = 0
+
+    def info(self) -> Tuple[TRANSPORT, Optional[bytes]]:
+        if not self.records or self.records[0].kind != KIND_INFO:
+            raise ValueError("Recording has no connection info")
+        info = self.records[0]
+        self._index = 1
+        return TRANSPORT(info.sent.decode()), info.received or None
+
+    def next(self, kind: int, sent: bytes = b"") -> Record:
+        if self._index >= len(self.records):
+            raise ValueError("No more recorded exchanges")
+        record = self.records[self._index]
+        if record.kind != kind or record.sent != bytes(sent):
+            raise ValueError(
+                f"Exchange {self._index} differs from recording: "
+                f"expected {record.kind}:{record.sent.hex()}, "
+                f"got {kind}:{bytes(sent).hex()}"
+            )
+        self._index += 1
+        if self._latency:
+            sleep(record.duration)
+        return record
+
+    @property
+    def done(self) -> bool:
+        return self._index >= len(self.records)
+
+
+class RecordingSmartCardConnection(SmartCardConnection):
+    """Wraps a SmartCardConnection, recording all APDUs to a file."""
+
+    def __init__(self, connection: SmartCardConnection, fname: str):
+        self.connection = connection
+        self._recorder = _Recorder(fname)
+        self._recorder.write(
+            KIND_INFO,
+            perf_counter(),
+            connection.transport.value.encode(),
+            connection.atr or b"",
+        )
+
+    @property
+    def transport(self):
+        return self.connection.transport
+
+    @property
+    def atr(self):
+        return self.connection.atr
+
+    def close(self):
+        try:
+            self.connection.close()
+        finally:
+            self._recorder.close()
+
+    def send_and_receive(self, apdu):
+        start = perf_counter()
+        response, sw = self.connection.send_and_receive(apdu)
+        self._recorder.write(KIND_APDU, start, bytes(apdu), response, sw)
+        return response, sw
+
+
+class ReplaySmartCardConnection(SmartCardConnection):
+    """Responds to APDUs as given by a recording.
+
+    Each command must match the recorded one, or ValueError is raised. If latency is
+    True, each response is delayed by the time the recorded device took.
+    """
+
+    def __init__(self, source: Union[str, List[Record]], latency: bool = False):
+        self._player = _Player(source, latency)
+        self._transport, self._atr = self._player.info()
+
+    @property
+    def transport(self):
+        return self._transport
+
+    @property
+    def atr(self):
+        return self._atr
+
+    @property
+    def done(self) -> bool:
+        """True if all recorded exchanges have been replayed."""
+        return self._player.done
+
+    def send_and_receive(self, apdu):
+        record = self._player.next(KIND_APDU, apdu)
+        return record.received, record.sw
+
+
+class RecordingOtpConnection(OtpConnection):
+    """Wraps an OtpConnection, recording all feature reports to a file."""
+
+    def __init__(self, connection: OtpConnection, fname: str):
+        self.connection = connection
+        self._recorder = _Recorder(fname)
+        self._recorder.write(KIND_INFO, perf_counter(), TRANSPORT.USB.value.encode())
+
+    def close(self):
+        try:
+            self.connection.close()
+        finally:
+            self._recorder.close()
+
+    def receive(self):
+        start = perf_counter()
+        report = self.connection.receive()
+        self._recorder.write(KIND_OTP_RECEIVE, start, received=bytes(report))
+        return report
+
+    def send(self, data):
+        start = perf_counter()
+        self.connection.send(data)
+        self._recorder.write(KIND_OTP_SEND, start, sent=bytes(data))
+
+
+class ReplayOtpConnection(OtpConnection):
+    """Responds to feature report reads and writes as given by a recording.
+
+    Each written report must match the recorded one, or ValueError is raised. If
+    latency is True, each operation is delayed by the time the recorded device took.
+    """
+
+    def __init__(self, source: Union[str, List[Record]], latency: bool = False):
+        self._player = _Player(source, latency)
+        self._player.info()
+
+    @property
+    def done(self) -> bool:
+        """True if all recorded exchanges have been replayed."""
+        return self._player.done
+
+    def receive(self):
+        return self._player.next(KIND_OTP_RECEIVE).received
+
+    def send(self, data):
+        self._player.next(KIND_OTP_SEND, data)
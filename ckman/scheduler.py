@@ -0,0 +1,181 @@
+# Copyright (c) 2020 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Running operations on one YubiKey over several USB interfaces.
+
+Switching from one USB interface of a YubiKey to another can hit its reclaim window,
+during which the new interface is unavailable (up to ~3 seconds on a NEO). An
+InterfaceScheduler takes a batch of operations, each needing a connection of some
+type, and runs them grouped by connection type, with one connection open per group.
+A job mixing OTP, CCID and FIDO operations thus switches interfaces at most once per
+interface:
+
+    scheduler = InterfaceScheduler(serial)
+    otp_status = scheduler.add(OtpConnection, read_otp_status)
+    oath_status = scheduler.add(SmartCardConnection, read_oath_status)
+    scheduler.run()
+    otp_status.result()
+"""
+
+from canokit.core import Connection
+from canokit.management import DeviceInfo
+from .device import connect_to_device, scan_devices
+
+from time import perf_counter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+    cast,
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+T = TypeVar("T")
+
+
+class ScheduledOperation(Generic[T]):
+    """An operation added to an InterfaceScheduler, holding its outcome once run."""
+
+    def __init__(self, connection_type: type, operation: Callable[[Any], T]):
+        self.connection_type = connection_type
+        self.operation = operation
+        self.done = False
+        self._result: Optional[T] = None
+        self._error: Optional[Exception] = None
+
+    def _run(self, connection: Any) -> None:
+        try:
+            self._result = self.operation(connection)
+        except Exception as e:
+            self._error = e
+        self.done = True
+
+    def _fail(self, error: Exception) -> None:
+        self._error = error
+        self.done = True
+
+    def result(self) -> T:
+        """Get the value returned by the operation, or raise the error it raised."""
+        if not self.done:
+            raise ValueError("Operation has not been run")
+        if self._error is not None:
+            raise self._error
+        return self._result  # type: ignore
+
+
+class InterfaceScheduler:
+    """Runs operations on one YubiKey, grouped by the connection type they need.
+
+    Groups run in the order their first operation was added, and operations within a
+    group in the order they were added. An operation failing doesn't stop the others,
+    its error is raised by its result().
+
+    :param serial: The serial number of the YubiKey. If None, the single YubiKey
+        attached is used.
+    """
+
+    def __init__(self, serial: Optional[int] = None):
+        self.serial = serial
+        self.info: Optional[DeviceInfo] = None
+        # Time taken to connect, including any reclaim, for each connection type
+        self.switch_delays: Dict[type, float] = {}
+        self._operations: List[ScheduledOperation] = []
+
+    def add(
+        self, connection_type: type, operation: Callable[[Any], T]
+    ) -> ScheduledOperation[T]:
+        """Add an operation to run with a connection of the given type.
+
+        The connection types are abstract, and FidoConnection is only a virtual
+        subclass of Connection, so they can't be expressed as Type[Connection].
+        """
+        scheduled = ScheduledOperation(connection_type, operation)
+        self._operations.append(scheduled)
+        return scheduled
+
+    def _groups(self) -> List[Tuple[type, List[ScheduledOperation]]]:
+        groups: Dict[type, List[ScheduledOperation]] = {}
+        for scheduled in self._operations:
+            groups.setdefault(scheduled.connection_type, []).append(scheduled)
+        return list(groups.items())
+
+    def _check_single_device(self) -> None:
+        # Without a serial, each group could connect to a different YubiKey. Devices
+        # are only counted here, the serial is read from the first connection.
+        devices, _ = scan_devices()
+        if sum(devices.values()) > 1:
+            raise ValueError("Multiple YubiKeys attached, a serial must be given")
+
+    def run(self) -> None:
+        """Run all added operations.
+
+        If no serial was given, it is read from the first connection opened, and used
+        for the following groups. If more than one YubiKey is attached, all operations
+        fail.
+        """
+        groups, self._operations = self._groups(), []
+        if self.serial is None:
+            try:
+                self._check_single_device()
+            except Exception as e:
+                for _, operations in groups:
+                    for scheduled in operations:
+                        scheduled._fail(e)
+                return
+        for connection_type, operations in groups:
+            start = perf_counter()
+            try:
+                connection, _, info = connect_to_device(
+                    self.serial, [cast(Type[Connection], connection_type)]
+                )
+            except Exception as e:
+                logger.debug(f"Unable to connect over {connection_type.__name__}")
+                for scheduled in operations:
+                    scheduled._fail(e)
+                continue
+            delay = perf_counter() - start
+            self.switch_delays[connection_type] = delay
+            logger.debug(
+                f"Connected over {connection_type.__name__} in {delay:.3f}s, "
+                f"running {len(operations)} operations"
+            )
+            self.info = info
+            if self.serial is None:
+                self.serial = info.serial
+            with connection:
+                for scheduled in operations:
+                    scheduled._run(connection)
@@ -1,4 +1,24 @@
+from ckman.settings import AppData
+from ckman.planner import planner
+import pytest
+
+
 def pytest_addoption(parser):
     parser.addoption("--device", action="store", type=int)
     parser.addoption("--reader", action="store")
     parser.addoption("--no-serial", action="store_true")
+
+
+@pytest.fixture(autouse=True)
+def app_data(monkeypatch, tmp_path):
+    # Keep tests from reading or writing the user's ckman data
+    monkeypatch.setattr(AppData, "_config_dir", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture(autouse=True)
+def interface_planner(app_data):
+    # Statistics are read from the per-test AppData directory
+    planner.reset()
+    yield planner
+    planner.reset()
@@ -595,6 +595,17 @@ class TestSlotCalculate:
         output = ckman_cli("otp", "calculate", "2", "-T", "-d", "8").output
         assert 8 == len(output.strip())
 
+    def test_calculate_batch(self, ckman_cli):
+        ckman_cli("otp", "chalresp", "2", "abba", "-f")
+        output = ckman_cli(
+            "otp", "calculate", "2", "--batch", "-", input="abba\n\nabba\n"
+        ).output
+        assert output.split() == ["f8de2586056d89d8b961a072d1245a495d2155e1"] * 2
+        output = ckman_cli(
+            "otp", "calculate", "2", "-T", "-b", "-", input="999\n999\n"
+        ).output
+        assert output.split() == ["533486", "533486"]
+
 
 class TestFipsMode:
     @pytest.fixture(autouse=True)
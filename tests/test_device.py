@@ -1,14 +1,41 @@
-from ckman.device import get_name
+from ckman.device import (
+    get_name,
+    read_info,
+    list_all_devices,
+    connect_to_device,
+    scan_devices,
+    watch,
+    wait_for_reappearance,
+    CONNECTION_LIST_MAPPING,
+    DeviceMonitor,
+    reuse_listings,
+    SCAN_APPLETS,
+)
+from ckman import device
 from ckman.base import YUBIKEY
-from canokit.core import TRANSPORT
+from ckman.emulator import (
+    EmulatedYubiKey,
+    EmulatedYubiKeyDevice,
+    EmulatedSmartCardConnection,
+    create_keys,
+    list_devices,
+)
+from canokit.core import TRANSPORT, TimeoutError
+from canokit.core.fido import FidoConnection
+from canokit.core.otp import OtpConnection
+from canokit.core.smartcard import SmartCardConnection
 from canokit.management import (
+    USB_INTERFACE,
     CAPABILITY,
     FORM_FACTOR,
     DeviceInfo,
     DeviceConfig,
     Version,
 )
+from threading import Event, Lock, Thread, Timer
+from time import monotonic, sleep
 from typing import cast
+import pytest
 
 
 def info(form_factor):
@@ -89,3 +116,373 @@ def test_yk5_fips_formfactors():
     assert get_name(fips(info(FORM_FACTOR.USB_C_BIO)), kt) == "YubiKey C Bio FIPS"
     assert get_name(fips(info(FORM_FACTOR.UNKNOWN)), kt) == "YubiKey 5 FIPS"
     assert get_name(fips(info_nfc(FORM_FACTOR.UNKNOWN)), kt) == "YubiKey 5 NFC FIPS"
+
+
+@pytest.fixture
+def attached(monkeypatch):
+    def attach(ccid, otp=()):
+        monkeypatch.setitem(CONNECTION_LIST_MAPPING, SmartCardConnection, lambda: ccid)
+        monkeypatch.setitem(CONNECTION_LIST_MAPPING, OtpConnection, lambda: list(otp))
+        monkeypatch.setitem(CONNECTION_LIST_MAPPING, FidoConnection, lambda: [])
+
+    return attach
+
+
+class WedgedDevice(EmulatedYubiKeyDevice):
+    def __init__(self, key, connection_type, event):
+        super().__init__(key, connection_type)
+        self.event = event
+
+    def open_connection(self, connection_type):
+        self.event.wait()
+        raise OSError("Wedged")
+
+
+class CountingDevice(EmulatedYubiKeyDevice):
+    """Counts opened connections, and is fingerprinted by reader like PC/SC."""
+
+    opened = 0
+
+    def __init__(self, key, connection_type, reader):
+        super().__init__(key, connection_type)
+        self._fingerprint = reader
+
+    def open_connection(self, connection_type):
+        CountingDevice.opened += 1
+        return super().open_connection(connection_type)
+
+
+def test_list_all_devices_dedupe(attached):
+    keys = create_keys(20)
+    attached(list_devices(keys, SmartCardConnection), list_devices(keys, OtpConnection))
+    devices = list_all_devices()
+    assert [info.serial for _, info in devices] == [key.serial for key in keys]
+    assert all(dev.fingerprint[1] == "SmartCardConnection" for dev, _ in devices)
+
+
+def test_list_all_devices_timeout(attached):
+    keys = create_keys(4)
+    wedged = Event()
+    ccid = list_devices(keys, SmartCardConnection)
+    ccid[1] = WedgedDevice(keys[1], SmartCardConnection, wedged)
+    attached(ccid, list_devices(keys, OtpConnection))
+    try:
+        start = monotonic()
+        devices = list_all_devices(max_workers=1, timeout=0.2)
+        assert monotonic() - start < 2
+    finally:
+        wedged.set()
+
+    # The PID was read over CCID, so it isn't read again over OTP
+    assert [info.serial for _, info in devices] == [
+        k.serial for k in keys if k is not keys[1]
+    ]
+    assert all(dev.fingerprint[1] == "SmartCardConnection" for dev, _ in devices)
+
+
+class SlowDevice(EmulatedYubiKeyDevice):
+    """Takes a while to open, keeping track of how many are opened at once."""
+
+    lock = Lock()
+    active = 0
+    max_active = 0
+
+    def open_connection(self, connection_type):
+        with SlowDevice.lock:
+            SlowDevice.active += 1
+            SlowDevice.max_active = max(SlowDevice.max_active, SlowDevice.active)
+        sleep(0.1)
+        with SlowDevice.lock:
+            SlowDevice.active -= 1
+        return super().open_connection(connection_type)
+
+
+def test_list_all_devices_abandoned_worker(attached):
+    keys = create_keys(5)
+    wedged = Event()
+    ccid = [WedgedDevice(keys[0], SmartCardConnection, wedged)] + [
+        SlowDevice(k, SmartCardConnection) for k in keys[1:]
+    ]
+    attached(ccid)
+    Timer(0.3, wedged.set).start()  # Responds after being given up on
+
+    devices = list_all_devices(max_workers=1, timeout=0.2)
+    assert [info.serial for _, info in devices] == [k.serial for k in keys[1:]]
+    assert SlowDevice.max_active == 1
+
+
+def test_list_all_devices_without_serial(attached):
+    keys = [EmulatedYubiKey(0)] + create_keys(1)
+    failed = Event()
+    failed.set()
+    ccid = list_devices(keys, SmartCardConnection)
+    ccid[1] = WedgedDevice(keys[1], SmartCardConnection, failed)
+    attached(ccid, list_devices(keys, OtpConnection))
+
+    # Another device of the same PID failed, the one without serial is listed once
+    devices = list_all_devices()
+    assert [info.serial for _, info in devices] == [None]
+
+
+def test_connect_to_device_index(attached):
+    keys = create_keys(10)
+    attached([CountingDevice(k, SmartCardConnection, i) for i, k in enumerate(keys)])
+    conn, _, info = connect_to_device(keys[-1].serial, [SmartCardConnection])
+    conn.close()
+    assert info.serial == keys[-1].serial
+
+    # All keys seen by the scan are now indexed, and opened directly
+    CountingDevice.opened = 0
+    for key in keys:
+        conn, _, info = connect_to_device(key.serial, [SmartCardConnection])
+        conn.close()
+        assert info.serial == key.serial
+    assert CountingDevice.opened == len(keys)
+
+
+def test_connect_to_device_index_miss(attached):
+    keys = create_keys(3)
+    attached([CountingDevice(k, SmartCardConnection, i) for i, k in enumerate(keys)])
+    list_all_devices()
+
+    # The keys moved to other readers, so the index is stale
+    keys.reverse()
+    attached([CountingDevice(k, SmartCardConnection, i) for i, k in enumerate(keys)])
+    CountingDevice.opened = 0
+    conn, dev, info = connect_to_device(keys[0].serial, [SmartCardConnection])
+    conn.close()
+    assert info.serial == keys[0].serial
+    assert dev.key is keys[0]
+    assert CountingDevice.opened == 2  # The stale entry, then the first scanned
+
+
+class FakeMonitor:
+    """Stands in for ScardMonitor, signalling changes when notify is called."""
+
+    def __init__(self):
+        self.changed = Event()
+        self.closed = False
+
+    def notify(self):
+        self.changed.set()
+
+    def wait(self, timeout):
+        changed = self.changed.wait(timeout)
+        self.changed.clear()
+        return changed
+
+    def cancel(self):
+        self.changed.set()
+
+    def close(self):
+        self.closed = True
+
+
+def test_watch(attached, monkeypatch):
+    monitor = FakeMonitor()
+    monkeypatch.setattr(device, "ScardMonitor", lambda: monitor)
+    monkeypatch.setattr(device, "open_hid_monitor", FakeMonitor)
+    keys = create_keys(2)
+    ccid = list_devices(keys[:1], SmartCardConnection)
+    attached(ccid)
+
+    events = watch(timeout=5)
+    event = next(events)
+    assert event.attached and event.device is ccid[0]
+    assert event.connection_type is SmartCardConnection
+
+    def attach():
+        ccid.extend(list_devices(keys[1:], SmartCardConnection))
+        monitor.notify()
+
+    Timer(0.05, attach).start()
+    start = monotonic()
+    event = next(events)
+    assert monotonic() - start < 0.2  # Less than the polling interval
+    assert event.attached and event.device is ccid[1]
+
+    removed = ccid.pop(0)
+    monitor.notify()
+    event = next(events)
+    assert not event.attached and event.device is removed
+
+    events.close()
+    assert monitor.closed
+
+
+def test_listings_reused(attached, monkeypatch):
+    keys = create_keys(3)
+    listed = []
+
+    def list_ccid():
+        listed.append(SmartCardConnection)
+        return list_devices(keys, SmartCardConnection)
+
+    attached([])
+    monkeypatch.setitem(CONNECTION_LIST_MAPPING, SmartCardConnection, list_ccid)
+
+    with reuse_listings():
+        # Like "ckman list", and "ckman info" with a single key
+        assert len(list_all_devices()) == 3
+        devices, _ = scan_devices(reuse=True)
+        assert sum(devices.values()) == 3
+        connect_to_device(keys[1].serial, [SmartCardConnection])[0].close()
+        assert listed == [SmartCardConnection]
+
+        # By default scan_devices lists devices again, to detect changes
+        scan_devices()
+        assert listed == [SmartCardConnection] * 2
+
+    # Outside of reuse_listings, devices are always listed again
+    list_all_devices()
+    assert listed == [SmartCardConnection] * 3
+
+    # connect_to_device lists each connection type once, also to order them
+    connect_to_device(keys[1].serial, [SmartCardConnection])[0].close()
+    assert listed == [SmartCardConnection] * 4
+
+
+def test_listings_dropped_on_change(attached, monkeypatch):
+    monitor = FakeMonitor()
+    monkeypatch.setattr(device, "ScardMonitor", lambda: monitor)
+    monkeypatch.setattr(device, "open_hid_monitor", lambda: None)
+    keys = create_keys(2)
+    ccid = list_devices(keys[:1], SmartCardConnection)
+    attached(ccid)
+
+    with reuse_listings(), DeviceMonitor() as device_monitor:
+        assert len(list_all_devices()) == 1
+        ccid.extend(list_devices(keys[1:], SmartCardConnection))
+        assert len(list_all_devices()) == 1
+
+        monitor.notify()
+        assert device_monitor.wait(1)
+        assert len(list_all_devices()) == 2
+
+
+class SelectCountingConnection(EmulatedSmartCardConnection):
+    selected = 0
+
+    def send_and_receive(self, apdu):
+        if apdu[1] == 0xA4:
+            SelectCountingConnection.selected += 1
+        return super().send_and_receive(apdu)
+
+
+def test_read_info_probe_cached():
+    # Firmware without the READ CONFIG command, its capabilities are probed for
+    key = EmulatedYubiKey(1234, version=Version(3, 4, 0))
+    infos = []
+    for _ in range(2):
+        SelectCountingConnection.selected = 0
+        infos.append(read_info(key.pid, SelectCountingConnection(key)))
+    assert infos[0] == infos[1]
+    assert infos[0].serial == 1234
+    assert infos[0].supported_capabilities[TRANSPORT.USB] == (
+        CAPABILITY.OTP | CAPABILITY.U2F | CAPABILITY.OATH | CAPABILITY.PIV
+    )
+    assert SelectCountingConnection.selected == 3  # Management, and OTP for the serial
+
+    # Probed again after a firmware update
+    key.version = Version(3, 5, 0)
+    SelectCountingConnection.selected = 0
+    read_info(key.pid, SelectCountingConnection(key))
+    assert SelectCountingConnection.selected == 3 + len(SCAN_APPLETS)
+
+
+def test_probed_capabilities_saved_concurrently():
+    keys = [f"NEO/{i}" for i in range(20)]
+    threads = [
+        Thread(target=device._save_probed_capabilities, args=(k, CAPABILITY.OATH))
+        for k in keys
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(device._load_probed_capabilities(k) == CAPABILITY.OATH for k in keys)
+
+
+def test_device_index_updated_concurrently():
+    keys = create_keys(20)
+    devs = list_devices(keys, SmartCardConnection)
+    infos = [read_info(d.pid, d.open_connection(SmartCardConnection)) for d in devs]
+    threads = [
+        Thread(
+            target=device._update_device_index,
+            args=([(SmartCardConnection, dev, info)],),
+        )
+        for dev, info in zip(devs, infos)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    serials = device._load_device_index()["serials"]
+    assert sorted(serials) == sorted(str(k.serial) for k in keys)
+
+
+def test_connect_to_device_planned(attached, interface_planner):
+    keys = create_keys(1)
+    attached(list_devices(keys, SmartCardConnection), list_devices(keys, OtpConnection))
+    conn, _, _ = connect_to_device()
+    conn.close()
+    assert isinstance(conn, SmartCardConnection)
+    assert interface_planner.get(keys[0].pid, SmartCardConnection).count == 1
+
+    interface_planner.record(keys[0].pid, None, SmartCardConnection, 5, failed=True)
+    conn, _, _ = connect_to_device()
+    conn.close()
+    assert isinstance(conn, OtpConnection)
+
+
+@pytest.fixture
+def monitor(monkeypatch):
+    monitor = FakeMonitor()
+    monkeypatch.setattr(device, "ScardMonitor", lambda: monitor)
+    monkeypatch.setattr(device, "open_hid_monitor", FakeMonitor)
+    return monitor
+
+
+def test_wait_for_reappearance(attached, monitor):
+    keys = create_keys(2)
+    ccid = list_devices(keys, SmartCardConnection)
+    attached(ccid)
+    rebooting = ccid[0]
+
+    def detach():
+        ccid.remove(rebooting)
+        monitor.notify()
+
+    def reattach():
+        ccid.append(EmulatedYubiKeyDevice(keys[0], SmartCardConnection))
+        monitor.notify()
+
+    Timer(0.05, detach).start()
+    Timer(0.2, reattach).start()
+    start = monotonic()
+    # The other key is skipped, as it was attached all along
+    dev, info = wait_for_reappearance(None, 5)
+    assert 0.2 <= monotonic() - start < 1
+    assert info.serial == keys[0].serial
+    assert dev is ccid[-1]
+
+
+def test_wait_for_reappearance_interfaces(attached, monitor):
+    keys = create_keys(1)
+    ccid = []
+    attached(ccid)
+
+    def attach():
+        ccid.extend(list_devices(keys, SmartCardConnection))
+        monitor.notify()
+
+    Timer(0.05, attach).start()
+    with pytest.raises(TimeoutError):
+        wait_for_reappearance(keys[0].serial, 0.3, USB_INTERFACE.OTP)
+
+    ccid.clear()
+    Timer(0.05, attach).start()
+    interfaces = keys[0].pid.get_interfaces()
+    _, info = wait_for_reappearance(keys[0].serial, 5, interfaces)
+    assert info.serial == keys[0].serial
@@ -0,0 +1,166 @@
+from canokit.core import TRANSPORT, ApplicationNotAvailableError
+from canokit.core.otp import OtpConnection
+from canokit.core.smartcard import SmartCardConnection, ApduError, ApduFormat
+from canokit.management import ManagementSession, CAPABILITY, DeviceConfig
+from canokit.oath import OathSession, CredentialData, OATH_TYPE, HASH_ALGORITHM
+from canokit.piv import (
+    PivSession,
+    KEY_TYPE,
+    MANAGEMENT_KEY_TYPE,
+    DEFAULT_MANAGEMENT_KEY,
+    OBJECT_ID,
+    SLOT,
+    InvalidPinError,
+)
+from canokit.yubiotp import YubiOtpSession, HmacSha1SlotConfiguration, SLOT as OTP_SLOT
+from ckman.emulator import (
+    EmulatedYubiKey,
+    EmulatedSmartCardConnection,
+    EmulatedOtpConnection,
+    create_keys,
+    list_devices,
+)
+from ckman.device import read_info
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+import hashlib
+import hmac
+import pytest
+
+
+@pytest.fixture
+def key():
+    return EmulatedYubiKey(12345678)
+
+
+def test_read_device_info(key):
+    for conn in (EmulatedSmartCardConnection(key), EmulatedOtpConnection(key)):
+        info = ManagementSession(conn).read_device_info()
+        assert info.serial == 12345678
+        assert info.version == key.version
+        assert info.supported_capabilities[TRANSPORT.USB] == (
+            CAPABILITY.OTP | CAPABILITY.OATH | CAPABILITY.PIV
+        )
+
+
+def test_write_device_config(key):
+    session = ManagementSession(EmulatedSmartCardConnection(key))
+    session.write_device_config(
+        DeviceConfig({TRANSPORT.USB: CAPABILITY.OATH}, 0, 0, None)
+    )
+    assert not list_devices([key], OtpConnection)
+
+    conn = EmulatedSmartCardConnection(key)
+    info = ManagementSession(conn).read_device_info()
+    assert info.config.enabled_capabilities[TRANSPORT.USB] == CAPABILITY.OATH
+    with pytest.raises(ApplicationNotAvailableError):
+        PivSession(conn)
+
+
+def test_oath(key):
+    session = OathSession(EmulatedSmartCardConnection(key))
+    secret = b"12345678901234567890"
+    session.put_credential(
+        CredentialData("totp", OATH_TYPE.TOTP, HASH_ALGORITHM.SHA1, secret)
+    )
+    session.put_credential(
+        CredentialData("hotp", OATH_TYPE.HOTP, HASH_ALGORITHM.SHA1, secret)
+    )
+    assert sorted(c.name for c in session.list_credentials()) == ["hotp", "totp"]
+
+    codes = {c.name: code for c, code in session.calculate_all(59).items()}
+    assert codes["totp"].value == "287082"  # RFC 6238 test vector
+    assert codes["hotp"] is None
+
+    # RFC 4226 test vectors
+    hotp = next(c for c in session.list_credentials() if c.name == "hotp")
+    assert session.calculate_code(hotp).value == "755224"
+    assert session.calculate_code(hotp).value == "287082"
+
+
+def test_oath_access_key(key):
+    session = OathSession(EmulatedSmartCardConnection(key))
+    access_key = session.derive_key("password")
+    session.set_key(access_key)
+
+    session = OathSession(EmulatedSmartCardConnection(key))
+    assert session.locked
+    with pytest.raises(ApduError):
+        session.list_credentials()
+    session.validate(access_key)
+    assert session.list_credentials() == []
+
+
+def test_piv(key):
+    session = PivSession(EmulatedSmartCardConnection(key))
+    assert session.protocol.apdu_format == ApduFormat.EXTENDED
+    with pytest.raises(ApduError):
+        session.put_object(OBJECT_ID.CHUID, b"data")
+
+    session.authenticate(MANAGEMENT_KEY_TYPE.TDES, DEFAULT_MANAGEMENT_KEY)
+    session.put_object(OBJECT_ID.CHUID, b"data" * 200)
+    assert session.get_object(OBJECT_ID.CHUID) == b"data" * 200
+
+    public_key = session.generate_key(SLOT.AUTHENTICATION, KEY_TYPE.ECCP256)
+    assert session.get_slot_metadata(SLOT.AUTHENTICATION).generated
+
+    with pytest.raises(InvalidPinError):
+        session.verify_pin("000000")
+    assert session.get_pin_attempts() == 2
+    session.verify_pin("123456")
+    signature = session.sign(
+        SLOT.AUTHENTICATION, KEY_TYPE.ECCP256, b"message", hashes.SHA256()
+    )
+    public_key.verify(signature, b"message", ec.ECDSA(hashes.SHA256()))
+
+
+def test_piv_short_apdus():
+    key = EmulatedYubiKey(1, version=(3, 4, 0))
+    conn = EmulatedSmartCardConnection(key)
+    session = PivSession(conn)
+    assert session.protocol.apdu_format == ApduFormat.SHORT
+    session.authenticate(MANAGEMENT_KEY_TYPE.TDES, DEFAULT_MANAGEMENT_KEY)
+    session.put_object(OBJECT_ID.CHUID, bytes(range(256)) * 3)
+    assert session.get_object(OBJECT_ID.CHUID) == bytes(range(256)) * 3
+
+
+@pytest.mark.parametrize("connection_type", [OtpConnection, SmartCardConnection])
+def test_yubiotp_hmac_sha1(key, connection_type):
+    conn = list_devices([key], connection_type)[0].open_connection(connection_type)
+    session = YubiOtpSession(conn)
+    assert session.get_serial() == 12345678
+    assert not session.get_config_state().is_configured(OTP_SLOT.TWO)
+
+    secret = b"secret" * 3
+    session.put_configuration(OTP_SLOT.TWO, HmacSha1SlotConfiguration(secret))
+    assert session.get_config_state().is_configured(OTP_SLOT.TWO)
+    assert not session.get_config_state().is_touch_triggered(OTP_SLOT.TWO)
+
+    for challenge in (b"challenge", bytes(range(1, 64))):
+        expected = hmac.new(secret, challenge, hashlib.sha1).digest()
+        assert session.calculate_hmac_sha1(OTP_SLOT.TWO, challenge) == expected
+
+
+@pytest.mark.parametrize("connection_type", [OtpConnection, SmartCardConnection])
+def test_yubiotp_hmac_sha1_many(key, connection_type):
+    conn = list_devices([key], connection_type)[0].open_connection(connection_type)
+    session = YubiOtpSession(conn)
+    secret = b"secret" * 3
+    session.put_configuration(OTP_SLOT.TWO, HmacSha1SlotConfiguration(secret))
+
+    challenges = [bytes([i]) * (i % 64 + 1) for i in range(100)]
+    responses = list(session.calculate_hmac_sha1_many(OTP_SLOT.TWO, iter(challenges)))
+    assert responses == [
+        session.calculate_hmac_sha1(OTP_SLOT.TWO, c) for c in challenges
+    ]
+    assert responses[0] == hmac.new(secret, challenges[0], hashlib.sha1).digest()
+
+
+def test_many_devices():
+    keys = create_keys(200, latency=0.0)
+    devices = list_devices(keys, SmartCardConnection)
+    serials = set()
+    for dev in devices:
+        with dev.open_connection(SmartCardConnection) as conn:
+            serials.add(read_info(dev.pid, conn).serial)
+    assert serials == {key.serial for key in keys}
@@ -0,0 +1,92 @@
+from threading import Timer
+import sys
+import pytest
+
+if not sys.platform.startswith("linux"):
+    pytest.skip("inotify is only available on Linux", allow_module_level=True)
+
+from ckman.base import PID  # noqa: E402
+from ckman.hid import linux  # noqa: E402
+from ckman.hid.linux import HidrawMonitor  # noqa: E402
+import os  # noqa: E402
+
+OTP_DESCRIPTOR = bytes.fromhex("05010906a101")  # Generic desktop, keyboard
+FIDO_DESCRIPTOR = bytes.fromhex("06d0f10901a101")
+
+
+@pytest.fixture
+def monitor(tmp_path):
+    monitor = HidrawMonitor(str(tmp_path))
+    yield monitor
+    monitor.close()
+
+
+def test_hidraw_added_and_removed(tmp_path, monitor):
+    assert not monitor.wait(0)
+    (tmp_path / "hidraw3").touch()
+    assert monitor.wait(1)
+    (tmp_path / "hidraw3").unlink()
+    assert monitor.wait(1)
+    assert not monitor.wait(0)
+
+
+def test_other_devices_ignored(tmp_path, monitor):
+    (tmp_path / "ttyUSB0").touch()
+    assert not monitor.wait(0.05)
+
+
+def test_cancel(monitor):
+    Timer(0.05, monitor.cancel).start()
+    assert not monitor.wait(5)
+
+
+@pytest.fixture
+def sysfs(tmp_path, monkeypatch):
+    sysfs = tmp_path / "sys"
+    dev = tmp_path / "dev"
+    sysfs.mkdir()
+    dev.mkdir()
+    monkeypatch.setattr(linux, "SYSFS_HIDRAW", str(sysfs))
+    monkeypatch.setattr(linux, "DEV_DIR", str(dev))
+    monkeypatch.setattr(linux, "_info_cache", {})
+
+    def add(name, vid, pid, descriptor=None):
+        device = sysfs / name / "device"
+        device.mkdir(parents=True)
+        (device / "uevent").write_text(
+            "DRIVER=hid-generic\n"
+            f"HID_ID=0003:{vid:08X}:{pid:08X}\n"
+            "HID_NAME=Test device\n"
+        )
+        if descriptor is not None:
+            (device / "report_descriptor").write_bytes(descriptor)
+        (dev / name).touch()
+        return device
+
+    return add
+
+
+def test_list_devices(sysfs):
+    sysfs("hidraw0", 0x1050, PID.YK4_OTP_FIDO_CCID, OTP_DESCRIPTOR)
+    sysfs("hidraw1", 0x1050, PID.YK4_OTP_FIDO_CCID, FIDO_DESCRIPTOR)
+    sysfs("hidraw2", 0x046D, 0xC52B)  # Not read, as it isn't a Yubico device
+    sysfs("hidraw3", 0x1050, 0xFFFF, OTP_DESCRIPTOR)  # Unsupported PID
+    devices = linux.list_devices()
+    assert [(os.path.basename(d.path), d.pid) for d in devices] == [
+        ("hidraw0", PID.YK4_OTP_FIDO_CCID)
+    ]
+
+
+def test_list_devices_cached(sysfs, tmp_path):
+    device = sysfs("hidraw0", 0x1050, PID.YK4_OTP, OTP_DESCRIPTOR)
+    assert len(linux.list_devices()) == 1
+
+    (device / "report_descriptor").write_bytes(FIDO_DESCRIPTOR)
+    assert len(linux.list_devices()) == 1
+
+    # The node is re-created for a new device
+    node = tmp_path / "dev" / "hidraw0"
+    node.unlink()
+    node.touch()
+    os.utime(node, ns=(0, 0))
+    assert linux.list_devices() == []
@@ -0,0 +1,65 @@
+from canokit.core import AID, CommandEvent
+from canokit.core.otp import OtpConnection
+from canokit.core.smartcard import SmartCardConnection
+from canokit.management import ManagementSession
+from canokit.yubiotp import YubiOtpSession, HmacSha1SlotConfiguration, SLOT
+from ckman.emulator import EmulatedYubiKey, list_devices
+from ckman.metrics import CommandMetrics, LatencyHistogram, application_name
+import json
+
+
+def test_latency_histogram():
+    histogram = LatencyHistogram((0.01, 0.1, 1))
+    for value in (0.005, 0.01, 0.05, 0.05, 3.0):
+        histogram.add(value)
+    assert histogram.counts == [2, 2, 0, 1]
+    assert histogram.max == 3.0
+    assert histogram.percentile(40) == 0.01
+    assert histogram.percentile(80) == 0.1
+    assert histogram.percentile(100) == 3.0
+
+
+def test_application_name():
+    assert application_name(AID.OATH) == "OATH"
+    assert application_name(b"\x01\x02") == "0102"
+    assert application_name(None) == "NONE"
+
+
+def test_collect_smartcard_and_otp():
+    key = EmulatedYubiKey(12345678)
+    metrics = CommandMetrics()
+    metrics.install()
+    try:
+        for connection_type in (SmartCardConnection, OtpConnection):
+            device = list_devices([key], connection_type)[0]
+            with device.open_connection(connection_type) as conn:
+                ManagementSession(conn).read_device_info()
+        with device.open_connection(OtpConnection) as conn:
+            session = YubiOtpSession(conn)
+            session.put_configuration(SLOT.TWO, HmacSha1SlotConfiguration(b"k" * 20))
+            session.calculate_hmac_sha1(SLOT.TWO, b"challenge")
+    finally:
+        metrics.uninstall()
+
+    assert metrics.get("MANAGEMENT", 0xA4).latency.count == 1
+    assert metrics.get("MANAGEMENT", 0x1D).received > 0
+    stats = metrics.get("OTP", 0x38)  # HMAC-SHA1 in slot 2
+    assert stats.latency.count == 1
+    assert (stats.sent, stats.received, stats.errors) == (64, 28, 0)
+    assert stats.segments > 1
+
+    snapshot = metrics.snapshot()
+    assert snapshot["OTP"]["0x38"]["latency"]["count"] == 1
+    json.dumps(snapshot)
+    assert "MANAGEMENT" in metrics.format()
+
+    metrics.reset()
+    assert metrics.snapshot() == {}
+
+
+def test_errors_counted():
+    metrics = CommandMetrics()
+    metrics(CommandEvent(AID.PIV, 0x20, 8, 0, 1, 0x63C2, 0.01, 0.0, ValueError()))
+    metrics(CommandEvent(AID.PIV, 0x20, 8, 0, 1, 0x9000, 0.02, 0.0))
+    stats = metrics.get("PIV", 0x20)
+    assert (stats.errors, stats.latency.count, stats.sent) == (1, 2, 16)
@@ -1,6 +1,9 @@
 #  vim: set fileencoding=utf-8 :
 
+from canokit.core import TRANSPORT, Tlv
+from canokit.core.smartcard import SmartCardConnection
 from canokit.oath import (
+    OathSession,
     CredentialData,
     OATH_TYPE,
     HASH_ALGORITHM,
@@ -11,6 +14,18 @@ from canokit.oath import (
 import unittest
 
 
+class ScriptedConnection(SmartCardConnection):
+    def __init__(self, *responses):
+        self.responses = list(responses)
+
+    @property
+    def transport(self):
+        return TRANSPORT.USB
+
+    def send_and_receive(self, apdu):
+        return self.responses.pop(0), 0x9000
+
+
 class TestOathFunctions(unittest.TestCase):
     def test_credential_parse_period_and_issuer_and_name(self):
         issuer, name, period = _parse_cred_id(b"20/Issuer:name", OATH_TYPE.TOTP)
@@ -106,3 +121,40 @@ class TestOathFunctions(unittest.TestCase):
         self.assertEqual(7, data.digits)
         self.assertEqual(20, data.period)
         self.assertEqual(5, data.counter)
+
+
+class TestOathSession(unittest.TestCase):
+    def test_calculate_all(self):
+        select = Tlv(0x79, b"\5\4\3") + Tlv(0x71, b"saltsalt")
+        calculated = (
+            Tlv(0x71, b"Issuer:totp")
+            + Tlv(0x76, b"\6\x00\xbc\x61\x4e")
+            + Tlv(0x71, b"hotp")
+            + Tlv(0x77, b"\6")
+            + Tlv(0x71, b"touch")
+            + Tlv(0x7C, b"\6")
+        )
+        session = OathSession(ScriptedConnection(select, calculated))
+        entries = {c.name: (c, code) for c, code in session.calculate_all(0).items()}
+
+        cred, code = entries["totp"]
+        self.assertEqual(b"Issuer:totp", cred.id)
+        self.assertEqual("Issuer", cred.issuer)
+        self.assertEqual("345678", code.value)
+
+        cred, code = entries["hotp"]
+        self.assertEqual(OATH_TYPE.HOTP, cred.oath_type)
+        self.assertIsNone(code)
+
+        cred, code = entries["touch"]
+        self.assertTrue(cred.touch_required)
+        self.assertIsNone(code)
+
+    def test_calculate_all_missing_response(self):
+        select = Tlv(0x79, b"\5\4\3") + Tlv(0x71, b"saltsalt")
+        calculated = Tlv(0x71, b"totp") + Tlv(0x76, b"\6\x00\xbc\x61\x4e")
+        session = OathSession(
+            ScriptedConnection(select, calculated + Tlv(0x71, b"unpaired"))
+        )
+        with self.assertRaises(ValueError):
+            session.calculate_all(0)
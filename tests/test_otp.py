@@ -0,0 +1,119 @@
+from canokit.core import TimeoutError
+from canokit.core.otp import (
+    OtpConnection,
+    OtpProtocol,
+    POLL_INTERVAL_MIN,
+    POLL_INTERVAL_MAX,
+    RESP_PENDING_FLAG,
+    SLOT_WRITE_FLAG,
+    _poll_intervals,
+)
+from itertools import islice
+from threading import Event
+from time import perf_counter
+import pytest
+
+
+class SlowOtpConnection(OtpConnection):
+    """Answers each command after a processing delay, with a one report response."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self._ready_at = None
+        self._reports = []
+        self.log = []
+
+    def receive(self):
+        self.log.append("receive")
+        if self._ready_at is not None:
+            if perf_counter() < self._ready_at:
+                return b"\0\x05\x04\x03\0\0\0" + bytes([SLOT_WRITE_FLAG])
+            self._ready_at = None
+            self._reports = [
+                b"\x01" * 7 + bytes([RESP_PENDING_FLAG]),
+                b"\0" * 7 + bytes([RESP_PENDING_FLAG]),
+            ]
+        if self._reports:
+            return self._reports.pop(0)
+        return b"\0\x05\x04\x03\0\0\0\0"
+
+    def send(self, data):
+        self.log.append("send")
+        if data[7] == 0x80 | 9:  # Last report of the frame
+            self._ready_at = perf_counter() + self.delay
+        elif data[7] == 0xFF:
+            self._reports = []
+
+    def close(self):
+        pass
+
+
+class RecordingEvent(Event):
+    def __init__(self):
+        super().__init__()
+        self.timeouts = []
+
+    def wait(self, timeout=None):
+        self.timeouts.append(timeout)
+        return super().wait(timeout)
+
+
+def test_poll_intervals():
+    assert list(islice(_poll_intervals(), 3)) == [
+        POLL_INTERVAL_MIN,
+        POLL_INTERVAL_MIN * 2,
+        POLL_INTERVAL_MIN * 4,
+    ]
+    assert list(islice(_poll_intervals(), 20))[-1] == POLL_INTERVAL_MAX
+    assert list(islice(_poll_intervals(0.01), 2)) == [
+        pytest.approx(0.009),
+        POLL_INTERVAL_MIN,
+    ]
+
+
+def test_send_frame_status_reads():
+    connection = SlowOtpConnection(0)
+    protocol = OtpProtocol(connection)
+    connection.log.clear()
+    protocol.send_and_receive(0x30, b"x")
+    # The first status read is the write-ready check for the first report
+    assert connection.log[:4] == ["receive", "send", "receive", "send"]
+
+    connection.log.clear()
+    protocol.send_and_receive(0x30, bytes(range(1, 65)))
+    sends = connection.log.count("send")
+    assert sends == 11  # 10 reports, and the reset after reading
+    assert connection.log[: 2 * (sends - 1)] == ["receive", "send"] * (sends - 1)
+
+
+def test_read_frame_backoff():
+    protocol = OtpProtocol(SlowOtpConnection(0.005))
+    event = RecordingEvent()
+    assert protocol.send_and_receive(0x30, b"x", event) == b"\x01" * 7
+    assert event.timeouts[0] == POLL_INTERVAL_MIN
+    assert event.timeouts[1] == POLL_INTERVAL_MIN * 2
+    assert max(event.timeouts) <= POLL_INTERVAL_MAX
+
+
+def test_read_frame_learns_processing_time():
+    protocol = OtpProtocol(SlowOtpConnection(0.01))
+    protocol.send_and_receive(0x30, b"x")
+    assert protocol._processing_times[0x30] >= 0.01
+
+    event = RecordingEvent()
+    protocol.send_and_receive(0x30, b"x", event)
+    assert event.timeouts[0] >= 0.009
+    assert len(event.timeouts) < 10
+
+    # Other slots don't use it
+    event = RecordingEvent()
+    protocol.send_and_receive(0x38, b"x", event)
+    assert event.timeouts[0] == POLL_INTERVAL_MIN
+
+
+def test_read_frame_cancelled():
+    protocol = OtpProtocol(SlowOtpConnection(10))
+    event = Event()
+    event.set()
+    with pytest.raises(TimeoutError):
+        protocol.send_and_receive(0x30, b"x", event)
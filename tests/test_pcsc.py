@@ -0,0 +1,264 @@
+from canokit.core import TimeoutError
+from canokit.core.smartcard import CardResetError
+from ckman import pcsc
+from ckman.pcsc import ScardContext, ScardSmartCardConnection, list_readers
+from smartcard import scard
+from smartcard.Exceptions import NoCardException
+from threading import Event, Timer, enumerate as enumerate_threads
+from time import monotonic, sleep
+import pytest
+
+ATR = bytes.fromhex("3bfd1300008131fe158073c021c057597562694b657940")
+
+
+class FakeScard:
+    def __init__(self, monkeypatch):
+        self.contexts = []
+        self.released = []
+        self.results = []  # hresults to return from the next SCardListReaders calls
+        self.sent = []
+        self.connect_result = scard.SCARD_S_SUCCESS
+        self.transmit_result = scard.SCARD_S_SUCCESS
+        self.begin_result = scard.SCARD_S_SUCCESS
+        self.begin_event = None
+        self.calls = []
+        self.readers = ["Canokeys Canokey [OpenPGP PIV OATH] 00 00"]
+        self.card_states = {}  # reader name -> state, PRESENT unless set
+        self.pnp_supported = True
+        self.status_changed = Event()
+        for name in (
+            "SCardEstablishContext",
+            "SCardReleaseContext",
+            "SCardListReaders",
+            "SCardConnect",
+            "SCardStatus",
+            "SCardTransmit",
+            "SCardDisconnect",
+            "SCardBeginTransaction",
+            "SCardEndTransaction",
+            "SCardReconnect",
+            "SCardGetStatusChange",
+            "SCardCancel",
+        ):
+            monkeypatch.setattr(scard, name, getattr(self, name), raising=False)
+        monkeypatch.setattr(pcsc, "_context", ScardContext())
+
+    def SCardEstablishContext(self, scope):
+        self.contexts.append(len(self.contexts) + 100)
+        return scard.SCARD_S_SUCCESS, self.contexts[-1]
+
+    def SCardReleaseContext(self, hcontext):
+        self.released.append(hcontext)
+        return scard.SCARD_S_SUCCESS
+
+    def SCardListReaders(self, hcontext, groups):
+        assert hcontext == self.contexts[-1]
+        if self.results:
+            return self.results.pop(0), []
+        return scard.SCARD_S_SUCCESS, list(self.readers)
+
+    def SCardConnect(self, hcontext, reader, mode, protocol):
+        return self.connect_result, 1, scard.SCARD_PROTOCOL_T1
+
+    def SCardStatus(self, hcard):
+        return scard.SCARD_S_SUCCESS, "reader", 0, scard.SCARD_PROTOCOL_T1, list(ATR)
+
+    def SCardTransmit(self, hcard, pci, apdu):
+        assert pci == scard.SCARD_PCI_T1
+        self.sent.append(bytes(apdu))
+        if self.transmit_result != scard.SCARD_S_SUCCESS:
+            return self.transmit_result, []
+        return scard.SCARD_S_SUCCESS, list(b"response") + [0x90, 0x00]
+
+    def SCardDisconnect(self, hcard, disposition):
+        return scard.SCARD_S_SUCCESS
+
+    def SCardBeginTransaction(self, hcard):
+        if self.begin_event:
+            self.begin_event.wait()
+        self.calls.append("begin")
+        return self.begin_result
+
+    def SCardEndTransaction(self, hcard, disposition):
+        self.calls.append("end")
+        return scard.SCARD_S_SUCCESS
+
+    def SCardReconnect(self, hcard, mode, protocol, disposition):
+        self.calls.append("reconnect")
+        return scard.SCARD_S_SUCCESS, scard.SCARD_PROTOCOL_T1
+
+    def _status(self, reader):
+        if reader == pcsc.PNP_NOTIFICATION:
+            if not self.pnp_supported:
+                return scard.SCARD_STATE_UNKNOWN
+            return len(self.readers) << 16
+        if reader not in self.readers:
+            return scard.SCARD_STATE_UNKNOWN
+        return self.card_states.get(reader, scard.SCARD_STATE_PRESENT)
+
+    def SCardGetStatusChange(self, hcontext, timeout, states):
+        deadline = monotonic() + timeout / 1000
+        while True:
+            new_states = []
+            changed = False
+            for reader, current in states:
+                state = self._status(reader)
+                if state != current:
+                    changed = True
+                    state |= scard.SCARD_STATE_CHANGED
+                new_states.append((reader, state, []))
+            if changed:
+                return scard.SCARD_S_SUCCESS, new_states
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return scard.SCARD_E_TIMEOUT, []
+            if self.status_changed.wait(remaining):
+                self.status_changed.clear()
+                if "cancel" in self.calls:
+                    return scard.SCARD_E_CANCELLED, []
+
+    def SCardCancel(self, hcontext):
+        self.calls.append("cancel")
+        self.status_changed.set()
+        return scard.SCARD_S_SUCCESS
+
+    def change(self, readers=None, **card_states):
+        if readers is not None:
+            self.readers = readers
+        self.card_states.update(card_states)
+        self.status_changed.set()
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    return FakeScard(monkeypatch)
+
+
+def test_context_shared(fake):
+    for _ in range(3):
+        assert [r.name for r in list_readers()] == [
+            "Canokeys Canokey [OpenPGP PIV OATH] 00 00"
+        ]
+    conn = ScardSmartCardConnection(list_readers()[0].name)
+    conn.close()
+    assert fake.contexts == [100]
+
+
+def test_context_reestablished(fake):
+    list_readers()
+    fake.results = [scard.SCARD_E_SERVICE_STOPPED]
+    assert len(list_readers()) == 1
+    assert fake.contexts == [100, 101]
+    assert fake.released == [100]
+
+    fake.results = [scard.SCARD_E_NO_READERS_AVAILABLE]
+    assert list_readers() == []
+    assert fake.contexts == [100, 101]
+
+
+def test_send_and_receive(fake):
+    conn = ScardSmartCardConnection("reader")
+    assert conn.atr == ATR
+    assert conn.send_and_receive(b"\x00\xa4\x04\x00\x01\x01") == (b"response", 0x9000)
+    assert fake.sent == [b"\x00\xa4\x04\x00\x01\x01"]
+    conn.close()
+
+
+def test_no_card(fake):
+    fake.connect_result = scard.SCARD_E_NO_SMARTCARD
+    with pytest.raises(NoCardException):
+        ScardSmartCardConnection("reader")
+
+
+def test_transaction_nested(fake):
+    conn = ScardSmartCardConnection("reader")
+    with conn.transaction():
+        with conn.transaction():
+            conn.send_and_receive(b"\x00\x01\x00\x00")
+        assert fake.calls == ["begin"]
+    assert fake.calls == ["begin", "end"]
+
+
+def test_card_reset_detected(fake):
+    conn = ScardSmartCardConnection("reader")
+    conn._selected = (b"aid", b"")
+    fake.transmit_result = scard.SCARD_W_RESET_CARD
+    with pytest.raises(CardResetError):
+        conn.send_and_receive(b"\x00\x01\x00\x00")
+    assert fake.calls == ["reconnect"]
+    assert conn._selected is None
+
+    fake.begin_result = scard.SCARD_W_RESET_CARD
+    with pytest.raises(CardResetError):
+        with conn.transaction():
+            pass
+    assert fake.calls == ["reconnect", "begin", "reconnect"]
+
+
+def test_transaction_timeout(fake):
+    conn = ScardSmartCardConnection("reader")
+    fake.begin_event = Event()
+    with pytest.raises(TimeoutError):
+        with conn.transaction(timeout=0.01):
+            pass
+    fake.begin_event.set()
+    for _ in range(100):
+        if fake.calls == ["begin", "end"]:
+            break
+        sleep(0.01)
+    assert fake.calls == ["begin", "end"]  # Released once granted
+
+
+def test_transaction_thread_reused(fake):
+    conn = ScardSmartCardConnection("reader")
+    threads = set()
+    for _ in range(3):
+        before = set(enumerate_threads())
+        with conn.transaction():
+            pass
+        threads |= set(enumerate_threads()) - before
+    assert fake.calls == ["begin", "end"] * 3
+    assert len(threads) == 1
+    conn.close()
+    thread = threads.pop()
+    thread.join(1)
+    assert not thread.is_alive()
+
+
+def test_monitor_card_removed(fake):
+    reader = fake.readers[0]
+    monitor = pcsc.ScardMonitor()
+    assert not monitor.wait(0)
+    Timer(0.05, fake.change, kwargs={reader: scard.SCARD_STATE_EMPTY}).start()
+    start = monotonic()
+    assert monitor.wait(5)
+    assert monotonic() - start < 1
+    assert not monitor.wait(0)
+    monitor.close()
+    assert fake.released == [100]
+
+
+def test_monitor_reader_added(fake):
+    monitor = pcsc.ScardMonitor()
+    Timer(0.05, fake.change, args=(fake.readers + ["Other reader"],)).start()
+    assert monitor.wait(5)
+    assert not monitor.wait(0)
+
+
+def test_monitor_no_pnp(fake):
+    fake.pnp_supported = False
+    monitor = pcsc.ScardMonitor()
+    assert not monitor.wait(0)
+
+    # Reader changes are polled for
+    fake.readers = []
+    start = monotonic()
+    assert monitor.wait(5)
+    assert monotonic() - start < 1
+
+
+def test_monitor_cancel(fake):
+    monitor = pcsc.ScardMonitor()
+    Timer(0.05, monitor.cancel).start()
+    assert not monitor.wait(5)
+    assert not monitor.wait(5)
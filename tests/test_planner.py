@@ -0,0 +1,86 @@
+from canokit.core import Version
+from canokit.core.fido import FidoConnection
+from canokit.core.otp import OtpConnection
+from canokit.core.smartcard import SmartCardConnection
+from ckman.base import PID
+from ckman.planner import InterfacePlanner, InterfaceStatistics, DEFAULT_COST
+import pytest
+
+TYPES = [SmartCardConnection, OtpConnection, FidoConnection]
+PID_ALL = PID.YK4_OTP_FIDO_CCID
+VERSION = Version(5, 4, 3)
+
+
+def test_statistics_cost():
+    stats = InterfaceStatistics()
+    assert stats.cost() == DEFAULT_COST
+    stats.add(0.1)
+    stats.add(0.3)
+    assert stats.mean == pytest.approx(0.2)
+    assert stats.cost() == pytest.approx(0.2)
+    stats.add(10, failed=True)
+    assert stats.mean == pytest.approx(0.2)  # Failures don't count towards the mean
+    assert stats.failure_rate == pytest.approx(1 / 3)
+    assert stats.cost() > 1
+
+
+def test_order_unknown():
+    planner = InterfacePlanner(None)
+    assert planner.order(TYPES, [PID_ALL]) == TYPES
+
+
+def test_order_by_latency():
+    planner = InterfacePlanner(None)
+    planner.record(PID_ALL, VERSION, SmartCardConnection, 0.5)
+    planner.record(PID_ALL, VERSION, OtpConnection, 0.05)
+    assert planner.order(TYPES, [PID_ALL]) == [
+        OtpConnection,
+        SmartCardConnection,
+        FidoConnection,
+    ]
+
+    # Other models are not affected
+    assert planner.order(TYPES, [PID.YK4_OTP_CCID]) == TYPES
+
+
+def test_order_failures():
+    planner = InterfacePlanner(None)
+    for _ in range(3):
+        planner.record(PID_ALL, VERSION, SmartCardConnection, 0.05)
+    planner.record(PID_ALL, None, SmartCardConnection, 3.0, failed=True)
+    planner.record(PID_ALL, VERSION, OtpConnection, 0.2)
+    assert planner.order(TYPES, [PID_ALL])[0] is OtpConnection
+
+
+def test_persisted():
+    planner = InterfacePlanner()
+    planner.record(PID_ALL, VERSION, OtpConnection, 0.05)
+    planner.record(PID_ALL, Version(4, 3, 7), OtpConnection, 0.15)
+    planner.save()
+
+    planner = InterfacePlanner()
+    stats = planner.get(PID_ALL, OtpConnection)
+    assert stats.count == 2
+    assert stats.mean == pytest.approx(0.1)
+    assert planner.snapshot() == {
+        "YK4_OTP_FIDO_CCID": {
+            "4.3.7": {"OtpConnection": {"count": 1, "failures": 0, "total": 0.15}},
+            "5.4.3": {"OtpConnection": {"count": 1, "failures": 0, "total": 0.05}},
+        }
+    }
+    assert "YK4_OTP_FIDO_CCID" in planner.format()
+
+
+def test_saved_on_significant_change(app_data):
+    planner = InterfacePlanner()
+    planner.record(PID_ALL, VERSION, OtpConnection, 0.1)
+    planner.save()
+    path = app_data / "interfaces.json"
+    path.unlink()
+    planner.record(PID_ALL, VERSION, OtpConnection, 0.105)
+    planner.save()
+    assert not path.exists()  # Mean moved by less than SAVE_THRESHOLD
+
+    planner.record(PID_ALL, VERSION, OtpConnection, 0.5)
+    planner.save()
+    assert InterfacePlanner().get(PID_ALL, OtpConnection).count == 3
@@ -0,0 +1,186 @@
+from canokit.core import TRANSPORT, TimeoutError
+from canokit.core.smartcard import SmartCardConnection, ApduError
+from canokit.management import DeviceInfo
+from ckman import pool as pool_module
+from ckman.base import YkmanDevice
+from ckman.pool import ConnectionPool, check_connection
+from fido2.hid import CtapHidDevice
+import pytest
+
+
+class FakeConnection(SmartCardConnection):
+    def __init__(self):
+        self.closed = False
+
+    @property
+    def transport(self):
+        return TRANSPORT.USB
+
+    def send_and_receive(self, apdu):
+        return b"", 0x9000
+
+    def close(self):
+        self.closed = True
+
+
+class FakeDevice(YkmanDevice):
+    def __init__(self, name):
+        super().__init__(TRANSPORT.USB, name, None)
+        self.opened = []
+
+    def open_connection(self, connection_type):
+        self.opened.append(FakeConnection())
+        return self.opened[-1]
+
+
+def test_reuse():
+    pool = ConnectionPool()
+    device = FakeDevice("reader")
+    with pool.lease(device, SmartCardConnection) as first:
+        pass
+    with pool.lease(FakeDevice("reader"), SmartCardConnection) as second:
+        assert second is first
+    assert len(device.opened) == 1
+    assert pool.open_connections == 1
+
+    pool.close()
+    assert first.closed
+    assert pool.open_connections == 0
+
+
+def test_concurrent_leases():
+    pool = ConnectionPool()
+    device = FakeDevice("reader")
+    with pool.lease(device, SmartCardConnection) as first:
+        with pool.lease(device, SmartCardConnection) as second:
+            assert first is not second
+    assert pool.open_connections == 2
+
+
+def test_discard_on_error():
+    pool = ConnectionPool()
+    device = FakeDevice("reader")
+    with pytest.raises(ApduError):
+        with pool.lease(device, SmartCardConnection):
+            raise ApduError(b"", 0x6A82)
+    assert pool.open_connections == 1  # Device errors leave the connection usable
+
+    with pytest.raises(OSError):
+        with pool.lease(device, SmartCardConnection) as connection:
+            raise OSError()
+    assert connection.closed
+    assert pool.open_connections == 0
+
+
+def test_health_check():
+    healthy = [False]
+    pool = ConnectionPool(health_check=lambda c: healthy[0])
+    device = FakeDevice("reader")
+    with pool.lease(device, SmartCardConnection) as first:
+        pass
+    with pool.lease(device, SmartCardConnection) as second:
+        assert second is not first
+        assert first.closed
+    healthy[0] = True
+    with pool.lease(device, SmartCardConnection) as third:
+        assert third is second
+
+
+class FakeCtapDevice(CtapHidDevice):
+    def __init__(self, echo):
+        self.echo = echo
+
+    def ping(self, msg=b"Hello FIDO"):
+        if self.echo is None:
+            raise OSError("Device removed")
+        return self.echo(msg)
+
+
+def test_check_fido_connection():
+    assert check_connection(FakeCtapDevice(lambda msg: msg))
+    assert not check_connection(FakeCtapDevice(lambda msg: b""))
+    assert not check_connection(FakeCtapDevice(None))
+
+
+def test_max_connections():
+    pool = ConnectionPool(max_connections=1)
+    one, two = FakeDevice("one"), FakeDevice("two")
+    with pool.lease(one, SmartCardConnection) as first:
+        with pytest.raises(TimeoutError):
+            pool.checkout(two, SmartCardConnection, timeout=0.01)
+    with pool.lease(two, SmartCardConnection):
+        assert first.closed  # Idle connection evicted to make room
+    assert pool.open_connections == 1
+
+
+def test_idle_timeout():
+    pool = ConnectionPool(idle_timeout=60)
+    device = FakeDevice("reader")
+    with pool.lease(device, SmartCardConnection) as connection:
+        pass
+    pool.evict_idle()
+    assert not connection.closed
+    pool.evict_idle(0)
+    assert connection.closed
+    assert pool.open_connections == 0
+
+
+def test_connect_remembers_device(monkeypatch):
+    device = FakeDevice("reader")
+    info = DeviceInfo(None, 123, None, {}, {}, False, False, None)
+    calls = []
+
+    def connect_to_device(serial, connection_types):
+        calls.append(serial)
+        return device.open_connection(SmartCardConnection), device, info
+
+    monkeypatch.setattr(pool_module, "connect_to_device", connect_to_device)
+    pool = ConnectionPool()
+    for _ in range(3):
+        with pool.connect(123, [SmartCardConnection]) as (conn, dev, dev_info):
+            assert (dev, dev_info) == (device, info)
+    assert calls == [123]
+    assert len(device.opened) == 1
+
+
+def test_selection_reset_on_reuse():
+    pool = ConnectionPool()
+    device = FakeDevice("reader")
+    with pool.lease(device, SmartCardConnection) as first:
+        first._selected = (b"aid", b"response")
+    with pool.lease(device, SmartCardConnection) as second:
+        assert second is first
+        assert second._selected is None
+
+
+def test_checkin_after_close():
+    pool = ConnectionPool()
+    device = FakeDevice("reader")
+    connection = pool.checkout(device, SmartCardConnection)
+    pool.close()
+    assert not connection.closed
+    pool.checkin(connection)
+    assert connection.closed
+    assert pool.open_connections == 0
+    with pytest.raises(ValueError):
+        pool.checkout(device, SmartCardConnection)
+
+
+def test_connect_within_max_connections(monkeypatch):
+    device = FakeDevice("reader")
+    info = DeviceInfo(None, 123, None, {}, {}, False, False, None)
+
+    def connect_to_device(serial, connection_types):
+        return device.open_connection(SmartCardConnection), device, info
+
+    monkeypatch.setattr(pool_module, "connect_to_device", connect_to_device)
+    pool = ConnectionPool(max_connections=1)
+    with pool.connect(123, [SmartCardConnection]):
+        with pytest.raises(TimeoutError):
+            with pool.connect(123, [SmartCardConnection], timeout=0.01):
+                pass
+        with pytest.raises(TimeoutError):
+            with pool.connect(456, [SmartCardConnection], timeout=0.01):
+                pass
+    assert len(device.opened) == 1
+    assert pool.open_connections == 1
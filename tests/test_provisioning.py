@@ -0,0 +1,114 @@
+from canokit.core.fido import FidoConnection
+from canokit.core.otp import OtpConnection, modhex_encode
+from canokit.core.smartcard import SmartCardConnection
+from canokit.yubiotp import SLOT, YubiOtpSession
+from ckman import device
+from ckman.device import CONNECTION_LIST_MAPPING
+from ckman.emulator import EmulatedYubiKeyDevice, create_keys, list_devices
+from ckman.provisioning import (
+    RecordWriter,
+    UnrecordedCredentialError,
+    YubiOtpProvisioner,
+    YubiOtpRecord,
+    serial_public_id,
+)
+import json
+import pytest
+
+
+class BrokenDevice(EmulatedYubiKeyDevice):
+    def open_connection(self, connection_type):
+        raise OSError("Broken")
+
+
+def test_serial_public_id():
+    assert modhex_encode(serial_public_id(12345678)) == "vvccccnrhbfu"
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".jsonl"])
+def test_record_writer(tmp_path, suffix):
+    fname = str(tmp_path / ("records" + suffix))
+    record = YubiOtpRecord(123, serial_public_id(123), bytes(6), bytes(range(16)))
+    with RecordWriter(fname, sync_count=2) as writer:
+        writer.write(record)
+        assert writer._pending == 1
+        writer.write(record)
+        assert writer._pending == 0
+    with RecordWriter(fname) as writer:
+        writer.write(record)
+
+    with open(fname) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 3
+    fields = ["123", "vvccccccccin", "000000000000", bytes(range(16)).hex()]
+    if suffix == ".jsonl":
+        assert json.loads(lines[0]) == {
+            "serial": 123,
+            "public_id": fields[1],
+            "private_id": fields[2],
+            "key": fields[3],
+        }
+    else:
+        assert lines[0].split(",") == fields
+
+
+def test_program_attached(tmp_path, monkeypatch):
+    keys = create_keys(10, latency=0.01)
+    devices = list_devices(keys, OtpConnection)
+    devices.append(BrokenDevice(create_keys(1, 1)[0], OtpConnection))
+    monkeypatch.setitem(CONNECTION_LIST_MAPPING, OtpConnection, lambda: devices)
+    monkeypatch.setitem(CONNECTION_LIST_MAPPING, SmartCardConnection, lambda: [])
+    monkeypatch.setitem(CONNECTION_LIST_MAPPING, FidoConnection, lambda: [])
+    monkeypatch.setattr(device, "ScardMonitor", lambda: None)
+    monkeypatch.setattr(device, "open_hid_monitor", lambda: None)
+
+    done = []
+    fname = str(tmp_path / "records.csv")
+    with RecordWriter(fname) as writer:
+        provisioner = YubiOtpProvisioner(
+            SLOT.ONE, writer, workers=4, on_done=lambda *args: done.append(args)
+        )
+        programmed, failed = provisioner.run()
+
+    assert sorted(r.serial for r in programmed) == [k.serial for k in keys]
+    assert len({r.key for r in programmed}) == len(keys)
+    assert [(d, str(e)) for d, e in failed] == [(devices[-1], "Broken")]
+    assert len(done) == len(devices)
+    with open(fname) as f:
+        assert sorted(f.read().splitlines()) == sorted(
+            ",".join(r.as_row()) for r in programmed
+        )
+
+    for dev in devices[:-1]:
+        with dev.open_connection(OtpConnection) as connection:
+            state = YubiOtpSession(connection).get_config_state()
+            assert state.is_configured(SLOT.ONE)
+
+    # The same YubiKeys aren't programmed again
+    programmed, failed = provisioner.run(devices=devices[:1])
+    assert programmed == []
+    assert "already been programmed" in str(failed[0][1])
+
+
+class FailingWriter:
+    def write(self, record):
+        raise OSError("Disk full")
+
+    def sync(self):
+        pass
+
+
+def test_unrecorded_credential():
+    keys = create_keys(1)
+    devices = list_devices(keys, OtpConnection)
+    provisioner = YubiOtpProvisioner(SLOT.ONE, FailingWriter())
+    programmed, failed = provisioner.run(devices=devices)
+
+    assert programmed == []
+    ((dev, error),) = failed
+    assert isinstance(error, UnrecordedCredentialError)
+    assert error.record.serial == keys[0].serial
+    assert isinstance(error.__cause__, OSError)
+    with devices[0].open_connection(OtpConnection) as connection:
+        state = YubiOtpSession(connection).get_config_state()
+        assert state.is_configured(SLOT.ONE)
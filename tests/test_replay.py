@@ -0,0 +1,68 @@
+from canokit.core import TRANSPORT
+from canokit.core.otp import OtpConnection
+from canokit.core.smartcard import SmartCardConnection, SmartCardProtocol
+from ckman.replay import (
+    RecordingSmartCardConnection,
+    ReplaySmartCardConnection,
+    RecordingOtpConnection,
+    ReplayOtpConnection,
+    load_records,
+    KIND_APDU,
+)
+import pytest
+
+
+class EchoConnection(SmartCardConnection):
+    transport = TRANSPORT.NFC
+    atr = b"\x3b\x00"
+
+    def send_and_receive(self, apdu):
+        return apdu[5:], 0x9000
+
+
+class CounterOtpConnection(OtpConnection):
+    def __init__(self):
+        self.counter = 0
+
+    def receive(self):
+        self.counter += 1
+        return bytes([self.counter]) * 8
+
+    def send(self, data):
+        pass
+
+
+def test_record_and_replay_smartcard(tmp_path):
+    fname = str(tmp_path / "ccid.rec")
+    with RecordingSmartCardConnection(EchoConnection(), fname) as conn:
+        protocol = SmartCardProtocol(conn)
+        assert protocol.send_apdu(0, 1, 0, 0, b"hello") == b"hello"
+        assert protocol.send_apdu(0, 2, 0, 0, b"world") == b"world"
+
+    records = load_records(fname)
+    assert [r.kind for r in records[1:]] == [KIND_APDU, KIND_APDU]
+    assert records[1].received == b"hello"
+    assert records[1].sw == 0x9000
+
+    replay = ReplaySmartCardConnection(fname)
+    assert replay.transport == TRANSPORT.NFC
+    assert replay.atr == b"\x3b\x00"
+    protocol = SmartCardProtocol(replay)
+    assert protocol.send_apdu(0, 1, 0, 0, b"hello") == b"hello"
+    with pytest.raises(ValueError):
+        protocol.send_apdu(0, 2, 0, 0, b"other")
+
+
+def test_record_and_replay_otp(tmp_path):
+    fname = str(tmp_path / "otp.rec")
+    with RecordingOtpConnection(CounterOtpConnection(), fname) as conn:
+        conn.receive()
+        conn.send(b"\0" * 8)
+        conn.receive()
+
+    replay = ReplayOtpConnection(load_records(fname))
+    assert replay.receive() == b"\1" * 8
+    replay.send(b"\0" * 8)
+    assert not replay.done
+    assert replay.receive() == b"\2" * 8
+    assert replay.done
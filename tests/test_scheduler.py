@@ -0,0 +1,109 @@
+from canokit.core import TRANSPORT
+from canokit.core.otp import OtpConnection
+from canokit.core.smartcard import SmartCardConnection
+from canokit.core.fido import FidoConnection
+from canokit.management import DeviceInfo
+from ckman import scheduler as scheduler_module
+from ckman.base import PID
+from ckman.scheduler import InterfaceScheduler
+import pytest
+
+
+class FakeConnection:
+    def __init__(self, connection_type, log):
+        self.connection_type = connection_type
+        self.log = log
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        self.log.append(("close", self.connection_type))
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    log = []
+
+    def connect_to_device(serial, connection_types):
+        (connection_type,) = connection_types
+        if connection_type is FidoConnection:
+            raise ValueError("No FIDO")
+        log.append(("open", connection_type, serial))
+        info = DeviceInfo(None, 123, None, None, {TRANSPORT.USB: 0}, False, False)
+        return FakeConnection(connection_type, log), None, info
+
+    def scan_devices():
+        return {PID.YK4_OTP_FIDO_CCID: log.count("attached")}, 0
+
+    log.append("attached")
+    monkeypatch.setattr(scheduler_module, "connect_to_device", connect_to_device)
+    monkeypatch.setattr(scheduler_module, "scan_devices", scan_devices)
+    return log
+
+
+def test_grouped_by_interface(connections):
+    scheduler = InterfaceScheduler()
+
+    def operation(name):
+        def run(connection):
+            connections.append(("run", name))
+            return name
+
+        return run
+
+    results = [
+        scheduler.add(OtpConnection, operation("otp 1")),
+        scheduler.add(SmartCardConnection, operation("ccid 1")),
+        scheduler.add(OtpConnection, operation("otp 2")),
+        scheduler.add(SmartCardConnection, operation("ccid 2")),
+    ]
+    scheduler.run()
+    connections.remove("attached")
+
+    assert [r.result() for r in results] == ["otp 1", "ccid 1", "otp 2", "ccid 2"]
+    assert connections == [
+        ("open", OtpConnection, None),
+        ("run", "otp 1"),
+        ("run", "otp 2"),
+        ("close", OtpConnection),
+        ("open", SmartCardConnection, 123),  # Serial read from the first group
+        ("run", "ccid 1"),
+        ("run", "ccid 2"),
+        ("close", SmartCardConnection),
+    ]
+    assert set(scheduler.switch_delays) == {OtpConnection, SmartCardConnection}
+    assert scheduler.info.serial == 123
+
+
+def test_errors_kept_per_operation(connections):
+    scheduler = InterfaceScheduler(123)
+
+    def fail(connection):
+        raise KeyError("failed")
+
+    failed = scheduler.add(OtpConnection, fail)
+    ok = scheduler.add(OtpConnection, lambda conn: 1)
+    fido = scheduler.add(FidoConnection, lambda conn: 2)
+    pending = InterfaceScheduler().add(OtpConnection, lambda conn: 3)
+    scheduler.run()
+
+    with pytest.raises(KeyError):
+        failed.result()
+    assert ok.result() == 1
+    with pytest.raises(ValueError, match="No FIDO"):
+        fido.result()
+    with pytest.raises(ValueError):
+        pending.result()
+    assert FidoConnection not in scheduler.switch_delays
+
+
+def test_multiple_devices_need_serial(connections):
+    connections.append("attached")
+    scheduler = InterfaceScheduler()
+    operation = scheduler.add(OtpConnection, lambda conn: 1)
+    scheduler.run()
+
+    with pytest.raises(ValueError, match="serial must be given"):
+        operation.result()
+    assert ("open", OtpConnection, None) not in connections
@@ -0,0 +1,206 @@
+from canokit.core import TRANSPORT, add_command_observer, remove_command_observer
+from canokit.core import ApplicationNotAvailableError
+from canokit.core.smartcard import (
+    SmartCardConnection,
+    SmartCardProtocol,
+    ApduError,
+    ApduFormat,
+)
+import pytest
+
+MISSING_AID = b"\xa0\x00\x00\x00\x00"
+
+
+class FakeSmartCardConnection(SmartCardConnection):
+    """Echoes the (reassembled) command data back, in chunks of 256 bytes."""
+
+    def __init__(self, chunk=256, atr=None):
+        self.chunk = chunk
+        self._atr = atr
+        self.sent = []
+        self._command = bytearray()
+        self._pending = b""
+
+    @property
+    def transport(self):
+        return TRANSPORT.USB
+
+    @property
+    def atr(self):
+        return self._atr
+
+    def send_and_receive(self, apdu):
+        apdu = bytes(apdu)
+        self.sent.append(apdu)
+        cla, ins = apdu[0], apdu[1]
+        if ins == 0xC0:
+            data = self._pending
+        elif ins == 0xEE or (ins == 0xA4 and apdu[5:] == MISSING_AID):
+            return b"", 0x6A82
+        else:
+            if len(apdu) > 5 and apdu[4] == 0:
+                body = apdu[7:]
+            else:
+                body = apdu[5:]
+            self._command += body
+            if cla & 0x10:
+                return b"", 0x9000
+            data, self._command = bytes(self._command), bytearray()
+
+        resp, self._pending = data[: self.chunk], data[self.chunk :]
+        if self._pending:
+            return resp, 0x6100 | min(len(self._pending), 0xFF)
+        return resp, 0x9000
+
+
+@pytest.mark.parametrize("size", [0, 1, 255, 256, 257, 1024, 3000, 65536])
+def test_send_apdu_short_chaining(size):
+    payload = bytes(i & 0xFF for i in range(size))
+    conn = FakeSmartCardConnection()
+    protocol = SmartCardProtocol(conn)
+    assert protocol.send_apdu(0, 0x01, 0, 0, payload) == payload
+
+    commands = [a for a in conn.sent if a[1] == 0x01]
+    assert len(commands) == max(1, -(-size // 255))
+    assert all(a[0] == 0x10 for a in commands[:-1])
+    assert commands[-1][0] == 0x00
+
+
+def test_send_apdu_extended():
+    payload = bytes(range(256)) * 8
+    conn = FakeSmartCardConnection()
+    protocol = SmartCardProtocol(conn)
+    protocol.apdu_format = ApduFormat.EXTENDED
+    assert protocol.send_apdu(0, 0x01, 0, 0, payload) == payload
+    assert len([a for a in conn.sent if a[1] == 0x01]) == 1
+
+
+def test_send_apdu_into_buffer():
+    conn = FakeSmartCardConnection()
+    protocol = SmartCardProtocol(conn)
+    out = bytearray(b"prefix")
+    result = protocol.send_apdu(0, 0x01, 0, 0, b"\x01" * 600, out=out)
+    assert result is out
+    assert out == b"prefix" + b"\x01" * 600
+
+
+def test_send_apdu_error_leaves_buffer():
+    conn = FakeSmartCardConnection()
+    protocol = SmartCardProtocol(conn)
+    out = bytearray(b"prefix")
+    with pytest.raises(ApduError) as e:
+        protocol.send_apdu(0, 0xEE, 0, 0, out=out)
+    assert e.value.sw == 0x6A82
+    assert out == b"prefix"
+
+
+@pytest.mark.parametrize(
+    "atr, apdu_format",
+    [
+        (None, ApduFormat.SHORT),
+        ("3bfd1300008131fe158073c021c057597562694b657940", ApduFormat.EXTENDED),
+        ("3bfc1300008131fe15597562696b65794e454f7233e1", ApduFormat.SHORT),
+        ("3bf71100008131fe6543616e6f6b657999", ApduFormat.SHORT),
+        ("3b8f8001804f0ca000000306030000000000006b", ApduFormat.SHORT),
+        ("3b", ApduFormat.SHORT),
+    ],
+)
+def test_apdu_format_from_atr(atr, apdu_format):
+    conn = FakeSmartCardConnection(atr=atr and bytes.fromhex(atr))
+    assert conn.supported_apdu_format is apdu_format
+    assert SmartCardProtocol(conn).apdu_format is apdu_format
+
+
+def test_extended_negotiated_single_command():
+    atr = bytes.fromhex("3bfd1300008131fe158073c021c057597562694b657940")
+    conn = FakeSmartCardConnection(chunk=0x10000, atr=atr)
+    payload = b"\x01" * 3000
+    assert SmartCardProtocol(conn).send_apdu(0, 0x01, 0, 0, payload) == payload
+    assert len(conn.sent) == 1
+
+
+def test_select_elided_until_other_command():
+    conn = FakeSmartCardConnection()
+    protocol = SmartCardProtocol(conn)
+    aid = b"\xa0\x00\x00\x05\x27\x21\x01"
+    assert protocol.select(aid) == aid
+    assert protocol.select(aid) == aid
+    assert SmartCardProtocol(conn).select(aid) == aid
+    assert len(conn.sent) == 1
+
+    protocol.select(b"\xa0\x00\x00\x03\x08")
+    protocol.select(aid)
+    assert len(conn.sent) == 3
+
+    protocol.send_apdu(0, 0x01, 0, 0)
+    protocol.select(aid)
+    assert len(conn.sent) == 5
+
+    with pytest.raises(ApduError):
+        protocol.send_apdu(0, 0xEE, 0, 0)
+    protocol.select(aid)
+    assert len(conn.sent) == 7
+
+    conn.reset_selection()
+    protocol.select(aid)
+    assert len(conn.sent) == 8
+
+
+def test_observer_events():
+    conn = FakeSmartCardConnection()
+    protocol = SmartCardProtocol(conn)
+    events = []
+    protocol.add_observer(events.append)
+    aid = b"\xa0\x00\x00\x05\x27\x21\x01"
+    protocol.select(aid)
+    protocol.send_apdu(0, 0x01, 0, 0, b"\x01" * 600)
+    with pytest.raises(ApduError):
+        protocol.send_apdu(0, 0xEE, 0, 0)
+
+    select, echo, error = events
+    assert (select.application, select.ins, select.sent) == (aid, 0xA4, len(aid))
+    assert (echo.application, echo.ins, echo.sw) == (aid, 0x01, 0x9000)
+    assert (echo.sent, echo.received) == (600, 600)
+    assert echo.segments == 3 + 2  # 3 chained commands, 2 GET RESPONSE
+    assert error.sw == 0x6A82 and isinstance(error.error, ApduError)
+    assert all(e.duration >= 0 and e.wait is None for e in events)
+
+    protocol.remove_observer(events.append)
+    protocol.send_apdu(0, 0x01, 0, 0)
+    assert len(events) == 3
+
+
+def test_observer_application_after_failed_select():
+    conn = FakeSmartCardConnection()
+    protocol = SmartCardProtocol(conn)
+    events = []
+    protocol.add_observer(events.append)
+    aid = b"\xa0\x00\x00\x05\x27\x21\x01"
+    protocol.select(aid)
+    with pytest.raises(ApplicationNotAvailableError):
+        protocol.select(MISSING_AID)
+    protocol.send_apdu(0, 0x01, 0, 0)
+    protocol.select(aid)
+
+    other = SmartCardProtocol(conn)
+    other.add_observer(events.append)
+    other.select(aid)  # Cached, nothing sent
+    other.send_apdu(0, 0x01, 0, 0)
+
+    assert [(e.application, e.ins) for e in events] == [
+        (aid, 0xA4),
+        (MISSING_AID, 0xA4),
+        (aid, 0x01),
+        (aid, 0xA4),
+        (aid, 0x01),
+    ]
+
+
+def test_global_observer():
+    events = []
+    add_command_observer(events.append)
+    try:
+        SmartCardProtocol(FakeSmartCardConnection()).send_apdu(0, 0x01, 0, 0, b"x")
+    finally:
+        remove_command_observer(events.append)
+    assert [(e.ins, e.received, e.segments) for e in events] == [(0x01, 1, 1)]
@@ -0,0 +1,87 @@
+from canokit.core.trace import TraceBuffer, TRACE_APDU, TRACE_OTP, trace
+from canokit.yubiotp import YubiOtpSession, HmacSha1SlotConfiguration, SLOT
+from ckman.emulator import EmulatedYubiKey, EmulatedOtpConnection
+import io
+
+
+def test_ring_buffer_keeps_latest():
+    buffer = TraceBuffer(size=4)
+    for i in range(10):
+        buffer.record_apdu(bytes([0, 0xA4, 4, 0, 1, i]), b"", 0x9000)
+    entries = buffer.entries()
+    assert [e.sent[-1] for e in entries] == [6, 7, 8, 9]
+    assert all(e.kind == TRACE_APDU and e.sw == 0x9000 for e in entries)
+
+    buffer.clear()
+    assert buffer.entries() == []
+
+
+def test_disabled():
+    buffer = TraceBuffer()
+    buffer.enabled = False
+    buffer.record_apdu(b"\0\xa4\4\0", b"", 0x9000)
+    assert buffer.entries() == []
+
+
+def test_redact_apdu():
+    buffer = TraceBuffer()
+    buffer.record_apdu(b"\x00\x20\x00\x80\x08123456\xff\xff", b"", 0x9000)
+    buffer.record_apdu(b"\x00\xcb\x3f\xff\x05\x5c\x03\x5f\xc1\x02", b"cert", 0x9000)
+    verify, get_data = buffer.entries()
+    assert verify.sent == b"\x00\x20\x00\x80" and verify.redacted == 9
+    assert get_data.redacted == 0 and get_data.received == b"cert"
+
+    fd = io.StringIO()
+    buffer.dump(fd)
+    lines = fd.getvalue().splitlines()
+    assert len(lines) == 4
+    assert lines[0].endswith("APDU SEND: 00200080 <9 bytes redacted>")
+    assert lines[1].endswith("APDU RECV:  SW=9000")
+    assert "313233343536" not in fd.getvalue()
+    assert lines[3].endswith("RECV: 63657274 SW=9000")
+
+
+def test_redact_apdu_response():
+    buffer = TraceBuffer()
+    buffer.record_apdu(b"\x00\xa4\x04\x00\x02\xa0\x00", b"oath", 0x9000)
+    buffer.record_apdu(b"\x00\xa4\x00\x01\x02\x74\x00", b"codes", 0x6105)
+    buffer.record_apdu(b"\x00\xc0\x00\x00", b"more!", 0x9000)
+    buffer.record_apdu(b"\x00\xc0\x00\x00", b"other", 0x9000)
+    buffer.record_apdu(b"\x00\xcb\x3f\xff\x05\x5c\x03\x5f\xc1\x09", b"key", 0x9000)
+    buffer.record_apdu(b"\x00\x01\x38\x00\x03abc", b"hmac", 0x9000)
+    select, codes, remaining, other, protected, hmac = buffer.entries()
+    assert select.received == b"oath" and select.redacted_received == 0
+    assert codes.received == b"" and codes.redacted_received == 5
+    assert remaining.received == b"" and remaining.redacted_received == 5
+    assert other.received == b"other"
+    assert protected.redacted_received == 3 and hmac.redacted_received == 4
+
+    fd = io.StringIO()
+    buffer.dump(fd)
+    assert fd.getvalue().splitlines()[3].endswith("RECV: <5 bytes redacted> SW=6105")
+
+
+def test_redact_chained_response_per_channel():
+    buffer = TraceBuffer()
+    buffer.record_apdu(b"\x00\xa4\x00\x01\x02\x74\x00", b"codes", 0x6105, 1)
+    buffer.record_apdu(b"\x00\x01\x00\x00", b"", 0x9000, 2)
+    buffer.record_apdu(b"\x00\xc0\x00\x00", b"more!", 0x9000, 1)
+    buffer.record_apdu(b"\x00\xa3\x00\x00\x04abcd", b"", 0x9000, 2)
+    codes, other, remaining, validate = buffer.entries()
+    assert codes.redacted_received == 5 and remaining.redacted_received == 5
+    assert validate.sent == b"\x00\xa3\x00\x00" and validate.redacted == 5
+
+
+def test_otp_exchanges_traced():
+    key = EmulatedYubiKey(12345678)
+    session = YubiOtpSession(EmulatedOtpConnection(key))
+    trace.clear()
+    session.put_configuration(SLOT.TWO, HmacSha1SlotConfiguration(b"secret" * 3))
+    session.calculate_hmac_sha1(SLOT.TWO, b"challenge")
+
+    config, hmac = trace.entries()
+    assert config.kind == TRACE_OTP and config.redacted == 64
+    assert config.sent[0] == 0x03 and b"secret" not in config.sent
+    assert hmac.redacted == 0 and hmac.sent.startswith(b"challenge")
+    assert hmac.sent[64] == 0x38
+    assert hmac.received == b"" and hmac.redacted_received > 20
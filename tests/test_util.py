@@ -1,6 +1,6 @@
 #  vim: set fileencoding=utf-8 :
 
-from canokit.core import Tlv, bytes2int
+from canokit.core import Tlv, TlvWriter, iter_tlv, bytes2int
 from canokit.core.otp import modhex_encode, modhex_decode
 from canokit.management import FORM_FACTOR
 from ckman.util import is_pkcs12, is_pem, parse_private_key, parse_certificates
@@ -67,6 +67,18 @@ class TestUtilityFunctions(unittest.TestCase):
         self.assertEqual(4, tlvs[2].length)
         self.assertEqual(b"\xfe\xed\xfa\xce", tlvs[2].value)
 
+    def test_iter_tlv(self):
+        data = b"\x00\x02\xd0\x0d\xa1\x00\x12\x82\x01\x90" + b"hi" * 200
+        tlvs = [(tag, bytes(value)) for tag, value in iter_tlv(data)]
+        self.assertEqual([(0, b"\xd0\x0d"), (0xA1, b""), (0x12, b"hi" * 200)], tlvs)
+        self.assertEqual(dict(tlvs), Tlv.parse_dict(data))
+        self.assertEqual(b"hi" * 200, Tlv.unpack(0x12, data[6:]))
+
+        with self.assertRaises(ValueError):
+            list(iter_tlv(b"\x00\x02\xd0"))
+        with self.assertRaises(ValueError):
+            Tlv.unpack(0x00, data)
+
     def test_time_challenge(self):
         self.assertEqual(b"\0" * 8, time_challenge(0))
         self.assertEqual(b"\x00\x00\x00\x00\x00\x06G\x82", time_challenge(12345678))
@@ -90,6 +102,23 @@ class TestUtilityFunctions(unittest.TestCase):
             b"\0\5hello\xfe\0\x12\x82\x01\x90" + b"hi" * 200, tlv1 + tlv2 + tlv3
         )
 
+    def test_tlv_writer(self):
+        writer = TlvWriter().add(0, b"hello").add(0xFE)
+        with writer.constructed(0x7C):
+            writer.add(0x12, b"hi" * 200)
+            with writer.constructed(0x7F49):
+                writer.add_header(0x81, 3).add_raw(b"abc")
+        self.assertEqual(
+            Tlv(0, b"hello")
+            + Tlv(0xFE)
+            + Tlv(0x7C, Tlv(0x12, b"hi" * 200) + Tlv(0x7F49, Tlv(0x81, b"abc"))),
+            writer.get_bytes(),
+        )
+
+        writer.begin(0x7C)
+        with self.assertRaises(ValueError):
+            writer.get_bytes()
+
     def test_is_pkcs12(self):
         with self.assertRaises(TypeError):
             is_pkcs12(None)